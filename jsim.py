@@ -6,11 +6,61 @@ PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(PROJECT_ROOT)
 
 import click
-from src.common.click import add_click_commands
-from src.data.scraping.main import scrape_cli
+from src.common.click import (
+    LazyCommand, add_click_commands, profile_startup_option
+)
 
+# The command modules are imported only when the commands are invoked
+COMMANDS = [
+    LazyCommand(
+        'scrape', 'src.data.scraping.main:scrape_cli',
+        'Scrape the websites into the feeds, images and tensors.'
+    ),
+    LazyCommand(
+        'reparse', 'src.data.scraping.main:reparse_cli',
+        'Regenerate the feed of the website from the HTML archive.'
+    ),
+    LazyCommand(
+        'loadtest', 'src.data.scraping.loadtest:loadtest_cli',
+        'Load test the crawl against the local mock retailer.'
+    ),
+    LazyCommand(
+        'bench', 'src.data.scraping.bench:bench_cli',
+        'Benchmark the parsers of the website over the recorded pages.'
+    ),
+    LazyCommand(
+        'dedup', 'src.data.dedup:dedup_cli',
+        'Find duplicate products across the scraped websites.'
+    ),
+    LazyCommand(
+        'history', 'src.data.history:history_cli',
+        'Record and query the history of the website catalog changes.'
+    ),
+    LazyCommand(
+        'features', 'src.features.build_features:features_cli',
+        'Build the model-ready features of the website products.'
+    ),
+    LazyCommand(
+        'images', 'src.features.image_hashes:images_cli',
+        'Hash the images of the website and find near-duplicate ones.'
+    ),
+    LazyCommand(
+        'index', 'src.models.index:index_cli',
+        'Build and query the similarity index of the website products.'
+    ),
+    LazyCommand(
+        'pairs', 'src.models.pairs:pairs_cli',
+        'Generate the training pairs of the website items.'
+    ),
+    LazyCommand(
+        'serve', 'src.models.serve:serve_cli',
+        'Serve the similar products of the website over HTTP.'
+    ),
+]
 
-@add_click_commands(scrape_cli)
+
+@add_click_commands(*COMMANDS)
+@profile_startup_option()
 @click.group('jsim')
 def cli():
     pass
@@ -1,7 +1,157 @@
+import importlib
+import subprocess
+import sys
+
+import click
+
+
+class LazyCommand(click.Command):
+    """
+    Placeholder of the click command, which is imported only when it's
+    invoked, so that the imports of the command module (e.g. Scrapy or
+    scikit-learn) don't slow down the startup of the other commands.
+    The group lists the placeholder with its own short help text.
+    """
+    def __init__(self, name, import_path, short_help=None):
+        """
+        :param name: str
+            The name of the command in the group.
+        :param import_path: str
+            The path to the command in the form 'package.module:name'.
+        :param short_help: str
+            The help text shown in the list of the group commands.
+        """
+        super(LazyCommand, self).__init__(
+            name, short_help=short_help, add_help_option=False
+        )
+        self.import_path = import_path
+        self._command = None
+
+    def load(self):
+        """:return: click.Command, the imported command."""
+        if self._command is None:
+            module_name, attr = self.import_path.split(':')
+            command = getattr(importlib.import_module(module_name), attr)
+            if not isinstance(command, click.Command):
+                raise TypeError(
+                    f'{self.import_path} is not a click command'
+                )
+            self._command = command
+        return self._command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # The context of the imported command is returned, so the group
+        # invokes the imported command with its own parameters
+        return self.load().make_context(
+            info_name, args, parent=parent, **extra
+        )
+
+    def invoke(self, ctx):
+        return self.load().invoke(ctx)
+
+    def get_params(self, ctx):
+        return self.load().get_params(ctx)
+
+
 def add_click_commands(*args):
+    """
+    Adds the commands to the decorated click group. The commands may
+    be `LazyCommand` placeholders, which are imported on invocation.
+    """
     def decorator(click_group):
         for cmd in args:
             click_group.add_command(cmd)
         return click_group
 
     return decorator
+
+
+def parse_import_times(output):
+    """
+    Parses the import times printed by the interpreter run with the
+    `-X importtime` option.
+    :param output: str
+    :return: list of tuples (str, int, float, float)
+        The imported module, its nesting level and its self and
+        cumulative import times in milliseconds.
+    """
+    records = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        records.append((
+            module, (len(name) - len(module) - 1) // 2,
+            int(fields[0]) / 1000, int(fields[1]) / 1000
+        ))
+    return records
+
+
+def profile_import_times(args):
+    """
+    Runs the command line of the script in a new interpreter and
+    returns its import times (see `parse_import_times`).
+    :param args: list of str
+        The arguments of the script run by `sys.argv[0]`.
+    :return: list of tuples (str, int, float, float)
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', sys.argv[0]] + list(args),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    return parse_import_times(process.stderr)
+
+
+def report_startup(group, top=20):
+    """
+    Prints the import time of the command line startup (the group
+    help) and of the invocation of each group command (its help), and
+    the slowest imports with their self and cumulative import times.
+    :param group: click.Group
+    :param top: int
+        The number of the slowest imports to print.
+    """
+    def total(records):
+        return sum(x[3] for x in records if x[1] == 0)
+
+    startup = profile_import_times(['--help'])
+    click.echo(f'Startup: {total(startup):.1f} ms\nCommands:')
+    slowest = {}
+    for name in sorted(group.commands):
+        records = profile_import_times([name, '--help'])
+        click.echo(f'  {name:<16} {total(records):10.1f} ms')
+        for record in startup + records:
+            if record[0] not in slowest or record[3] > slowest[record[0]][3]:
+                slowest[record[0]] = record
+
+    click.echo('\nThe slowest imports (self, cumulative):')
+    for module, _, self_time, cumulative in sorted(
+            slowest.values(), key=lambda x: -x[3])[:top]:
+        click.echo(f'  {module:<48} {self_time:8.1f} {cumulative:10.1f} ms')
+
+
+def profile_startup_option(top=20):
+    """
+    Adds the eager `--profile-startup` option to the decorated click
+    group, which prints the startup import times (see
+    `report_startup`) instead of running the command line.
+    :param top: int
+        The number of the slowest imports to print.
+    """
+    def callback(ctx, param, value):
+        if not value or ctx.resilient_parsing:
+            return
+        report_startup(ctx.command, top)
+        ctx.exit()
+
+    return click.option(
+        '--profile-startup', is_flag=True, is_eager=True,
+        expose_value=False, callback=callback,
+        help='Print the import times of the startup and of each command '
+             'and exit.'
+    )
@@ -0,0 +1,212 @@
+"""
+Minimal in-process metrics: labelled histograms, gauges and counters,
+which can be rendered in the Prometheus text exposition format or
+converted to json-compatible dicts. The module-level `REGISTRY` is
+shared by all instrumented components of the process.
+"""
+import bisect
+import math
+
+# Default histogram buckets (upper bounds), in seconds
+LATENCY_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60
+)
+FAST_BUCKETS = (
+    .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1
+)
+
+
+class Histogram:
+    """Counts the observed values in the fixed cumulative buckets."""
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        # The last counter is for the values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimates the quantile as the upper bound of the bucket
+        containing it (inf if it's above the largest bucket).
+        """
+        if not self.count:
+            return None
+        rank, cumulative = q * self.count, 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def cumulative_counts(self):
+        """
+        :return: list of tuples (float, int)
+            Bucket upper bounds (including inf) and the numbers of
+            observed values less than or equal to them.
+        """
+        result, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(.5),
+            'p90': self.quantile(.9),
+            'p99': self.quantile(.99),
+        }
+
+
+class Gauge:
+    """Holds the last set value."""
+    def __init__(self):
+        self.value = 0.
+
+    def set(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return {'value': self.value}
+
+
+class Counter:
+    """Holds the total of the increments."""
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value=1):
+        self.value += value
+
+    def to_dict(self):
+        return {'value': self.value}
+
+
+class MetricFamily:
+    """
+    The named metric, which values are tracked separately for each
+    combination of label values (e.g. `site` and `method`).
+    """
+    def __init__(self, name, description, metric_type, factory):
+        self.name = name
+        self.description = description
+        self.type = metric_type
+        self._factory = factory
+        self.children = {}
+
+    def labels(self, **labels):
+        """
+        Returns the metric (Histogram, Gauge or Counter) of the label
+        values, created on the first access.
+        """
+        key = tuple(sorted(labels.items()))
+        metric = self.children.get(key)
+        if metric is None:
+            metric = self.children[key] = self._factory()
+        return metric
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n')
+        )
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class MetricsRegistry:
+    """The collection of metric families."""
+    def __init__(self):
+        self.families = {}
+
+    def _register(self, name, description, metric_type, factory):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = MetricFamily(
+                name, description, metric_type, factory
+            )
+        elif family.type != metric_type:
+            raise ValueError(f'Metric {name} is already a {family.type}')
+        return family
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self._register(
+            name, description, 'histogram', lambda: Histogram(buckets)
+        )
+
+    def gauge(self, name, description):
+        return self._register(name, description, 'gauge', Gauge)
+
+    def counter(self, name, description):
+        return self._register(name, description, 'counter', Counter)
+
+    def snapshot(self, **label_filter):
+        """
+        Converts metrics to the json-compatible dict.
+        :param label_filter:
+            Only metrics with the given label values are included,
+            e.g. `site='sokolov.ru'`.
+        :return: dict
+            Metric name -> list of dicts with `labels` key and metric
+            values (see `to_dict` methods of metrics).
+        """
+        result = {}
+        for name, family in sorted(self.families.items()):
+            values = []
+            for key, metric in family.children.items():
+                labels = dict(key)
+                if any(labels.get(k) != v for k, v in label_filter.items()):
+                    continue
+                values.append({'labels': labels, **metric.to_dict()})
+            if values:
+                result[name] = values
+        return result
+
+    def render(self):
+        """
+        :return: str
+            All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, family in sorted(self.families.items()):
+            lines.append(f'# HELP {name} {family.description}')
+            lines.append(f'# TYPE {name} {family.type}')
+            for key, metric in sorted(family.children.items()):
+                if family.type in ('gauge', 'counter'):
+                    lines.append(
+                        f'{name}{_format_labels(key)} '
+                        f'{_format_value(metric.value)}'
+                    )
+                    continue
+                for bound, count in metric.cumulative_counts():
+                    le = (('le', _format_value(bound)),)
+                    labels = _format_labels(key + le)
+                    lines.append(f'{name}_bucket{labels} {count}')
+                labels = _format_labels(key)
+                lines.append(f'{name}_sum{labels} {_format_value(metric.sum)}')
+                lines.append(f'{name}_count{labels} {metric.count}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+
+def get_site_py(site):
+    """
+    Return the website domain, in which dots are replaced with
+    underscores, used to name website folders: <site_py>.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: str
+    """
+    return site.replace('.', '_')
+
+
+def get_processed_data_path(site):
+    """
+    Return the path to the folder with the processed data of the
+    website (relative to the project root): data/processed/<site_py>/.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: Path
+    """
+    return Path('data', 'processed', get_site_py(site))
+
+
+def get_image_tensors_path(site):
+    """
+    Return the path to the folder with the packed image tensors of the
+    website (see `ImageTensorStore`): data/processed/<site_py>/images/.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: str
+    """
+    return str(Path(get_processed_data_path(site), 'images'))
+
+
+def get_image_hashes_path(site):
+    """
+    Return the path to the cache of the perceptual hashes of the
+    website images (see `ImageHashCache`):
+    data/processed/<site_py>/images/hashes.sqlite.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: str
+    """
+    return str(Path(get_image_tensors_path(site), 'hashes.sqlite'))
+
+
+def get_features_path(site):
+    """
+    Return the path to the folder with the model-ready features of the
+    website products (see `build_features`):
+    data/processed/<site_py>/features/.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: str
+    """
+    return str(Path(get_processed_data_path(site), 'features'))
+
+
+def get_models_path(site):
+    """
+    Return the path to the folder with the models of the website
+    (relative to the project root): models/<site_py>/.
+
+    :param site: str
+        The shortest domain name of the website.
+    :return: Path
+    """
+    return Path('models', get_site_py(site))
+
+
+def get_canonical_ids_path():
+    """
+    Return the path to the table mapping products of all websites to
+    the canonical ids of their duplicate clusters (see `deduplicate`):
+    data/processed/canonical_ids.csv.
+
+    :return: Path
+    """
+    return Path('data', 'processed', 'canonical_ids.csv')
+
+
+def get_history_path():
+    """
+    Return the path to the history of the website catalogs (see
+    `record_history`): data/history/.
+
+    :return: Path
+    """
+    return Path('data', 'history')
@@ -0,0 +1,67 @@
+import sqlite3
+from pathlib import Path
+
+
+class SqliteStore:
+    """
+    Base class for small persistent key-value-like stores kept in a
+    single SQLite file. Subclasses declare the table layout in `schema`
+    (a script of `CREATE ... IF NOT EXISTS` statements) and use the
+    `execute` method to query the database.
+
+    Writes are grouped into transactions: the changes are committed
+    every `commit_every` modifications and when the store is closed,
+    which is much cheaper than committing after each single update
+    and still bounds the amount of work lost in case of a crash.
+    """
+    schema = ''
+
+    def __init__(self, path, commit_every=1000):
+        """
+        :param path: str or Path
+            The path to the SQLite database file. Missing parent
+            folders are created automatically.
+        :param commit_every: int
+            The number of modifications after which the pending
+            transaction is committed.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+
+        self.connection = sqlite3.connect(str(self.path))
+        # WAL journal allows readers to access the database while
+        # a crawl process is writing to it
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.schema)
+        self._pending = 0
+
+    def execute(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters)
+
+    def modified(self, count=1):
+        """
+        Registers `count` modifications and commits the pending
+        transaction if the modifications threshold is exceeded.
+        :return: bool, whether the transaction has been committed.
+        """
+        self._pending += count
+        if self._pending >= self.commit_every:
+            self.commit()
+            return True
+        return False
+
+    def commit(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,421 @@
+"""
+Cross-website deduplication of products. The same manufacturer item
+may be sold by several retailers (or listed twice by one), which
+pollutes the training pairs, so the products of all csv feeds
+(data/raw/*/items.csv) are clustered into duplicates:
+- products with the same brand and SKU are duplicates;
+- other candidates are found by MinHash-LSH over character shingles
+  of the title, description and gems within blocks of products with
+  the same brand, metal, probe and category, and are confirmed by the
+  estimated Jaccard similarity and close dimensions.
+All the steps are vectorized and near-linear in the number of products,
+no pairwise comparison of the whole catalog is made: only the products
+of an LSH bucket are compared pairwise (up to MAX_BUCKET_SIZE of them).
+
+The result is the canonical ids table (see `get_canonical_ids_path`):
+site, sku, canonical_id (<site_py>:<sku> of the cluster representative)
+and cluster_size.
+"""
+import click
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from src.common.paths import get_canonical_ids_path, get_site_py
+
+BLOCK_FIELDS = ['brand', 'metal', 'probe', 'category']
+TEXT_FIELDS = ['title', 'description', 'gems']
+DIMENSION_FIELDS = ['weight', 'width', 'height']
+# The maximum relative difference of dimensions of duplicates
+DIMENSION_TOLERANCE = .05
+# The prime modulus of MinHash permutations, a bit larger than 2 ** 32
+MINHASH_PRIME = 4294967311
+# The multipliers of the polynomial hashes
+SHINGLE_BASE = np.uint64(1000003)
+MIX_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# The maximum number of products of an LSH bucket compared pairwise,
+# the rest of a larger bucket (e.g. of boilerplate texts) is skipped
+MAX_BUCKET_SIZE = 100
+# The number of candidate pairs which signatures are compared at once
+SIMILARITY_CHUNKSIZE = 100000
+
+
+def load_catalog(sites=None):
+    """
+    Reads the deduplicated fields of the csv feeds of the websites.
+    :param sites: list of str or None
+        The domain names of websites, all the scraped ones by default.
+    :return: pandas.DataFrame sorted by site and SKU, `site` column
+        contains <site_py> of the website.
+    """
+    if sites:
+        feed_paths = [
+            Path('data', 'raw', get_site_py(x), 'items.csv') for x in sites
+        ]
+    else:
+        feed_paths = sorted(Path('data', 'raw').glob('*/items.csv'))
+
+    fields = ['sku'] + BLOCK_FIELDS + TEXT_FIELDS + DIMENSION_FIELDS
+    dtypes = {x: np.float32 for x in DIMENSION_FIELDS}
+    dtypes.update({x: str for x in fields if x not in dtypes})
+    feeds = []
+    for feed_path in feed_paths:
+        feed = pd.read_csv(
+            feed_path, usecols=lambda x: x in dtypes, dtype=dtypes,
+            keep_default_na=False, na_values=['']
+        ).reindex(columns=fields)
+        feed.insert(0, 'site', feed_path.parent.name)
+        feeds.append(feed)
+    if not feeds:
+        return pd.DataFrame(columns=['site'] + fields)
+    catalog = pd.concat(feeds, ignore_index=True)
+    catalog = catalog[catalog['sku'].notna()]
+    return catalog.sort_values(['site', 'sku'], kind='stable') \
+        .reset_index(drop=True)
+
+
+def normalize_text(values):
+    """
+    Lowercases the texts and replaces non-alphanumeric characters with
+    single spaces.
+    :param values: pandas.Series
+    :return: pandas.Series
+    """
+    return values.fillna('').str.lower() \
+        .str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+
+def hash_shingles(texts, shingle_size):
+    """
+    Hashes all character shingles of the texts with the vectorized
+    polynomial hash.
+    :param texts: list of str
+        Non-empty texts, the shorter ones are padded to `shingle_size`.
+    :return: tuple (numpy.ndarray, numpy.ndarray)
+        Hashes (uint64 below 2 ** 32) of the shingles of all the texts
+        and the start positions of each text in them.
+    """
+    texts = [x.ljust(shingle_size) for x in texts]
+    lengths = np.array([len(x) for x in texts], dtype=np.int64)
+    codes = np.frombuffer(
+        ''.join(texts).encode('utf-32-le'), dtype=np.uint32
+    ).astype(np.uint64)
+
+    n_positions = len(codes) - shingle_size + 1
+    hashes = np.zeros(n_positions, dtype=np.uint64)
+    for j in range(shingle_size):
+        hashes = hashes * SHINGLE_BASE + codes[j:j + n_positions]
+    # Mix the bits and keep the 32 higher ones
+    hashes = (hashes * MIX_MULTIPLIER) >> np.uint64(32)
+
+    # Only the shingles within a single text are valid
+    ends = np.cumsum(lengths)
+    docs = np.repeat(np.arange(len(texts)), lengths)[:n_positions]
+    valid = np.arange(n_positions) + shingle_size <= ends[docs]
+    starts = np.concatenate([[0], np.cumsum(lengths - shingle_size + 1)])
+    return hashes[valid], starts[:-1]
+
+
+def minhash_signatures(texts, num_perm=128, shingle_size=5, seed=0,
+                       chunksize=10000):
+    """
+    Computes MinHash signatures of the shingle sets of the texts.
+    :param texts: list of str
+        Non-empty texts.
+    :return: numpy.ndarray of uint64 with shape (texts, num_perm)
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+    prime = np.uint64(MINHASH_PRIME)
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for start in range(0, len(texts), chunksize):
+        hashes, offsets = hash_shingles(
+            texts[start:start + chunksize], shingle_size
+        )
+        # a * h + b < 2 ** 64, since a, b and h are below 2 ** 32
+        for i in range(num_perm):
+            signatures[start:start + len(offsets), i] = np.minimum.reduceat(
+                (a[i] * hashes + b[i]) % prime, offsets
+            )
+    return signatures
+
+
+def _group_pairs(keys, rows):
+    """
+    Links the rows having equal keys: each row is paired with the
+    first and the previous rows of its group in the sorted order, so
+    the groups are connected, but not all the pairs are listed (see
+    `_bucket_pairs` for the pairs verified independently).
+    :param keys: list of numpy.ndarray
+        Key columns, the last one is the primary sort key.
+    :return: tuple (numpy.ndarray, numpy.ndarray), the paired rows.
+    """
+    order = np.lexsort([rows] + keys)
+    if not len(order):
+        return rows[:0], rows[:0]
+    same = np.ones(len(order) - 1, dtype=bool)
+    for key in keys:
+        sorted_key = key[order]
+        same &= sorted_key[1:] == sorted_key[:-1]
+
+    sorted_rows = rows[order]
+    group_starts = np.concatenate([[True], ~same])
+    first = sorted_rows[group_starts][np.cumsum(group_starts) - 1]
+    members = ~group_starts
+    # The second rows of groups are already paired with the first ones
+    chained = same & members[:-1]
+    return (
+        np.concatenate([first[members], sorted_rows[:-1][chained]]),
+        np.concatenate([sorted_rows[members], sorted_rows[1:][chained]]),
+    )
+
+
+def _bucket_pairs(keys, rows, max_size=MAX_BUCKET_SIZE):
+    """
+    Pairs all the rows having equal keys with each other, since the
+    pairs of LSH candidates are verified independently. Only the first
+    `max_size` rows of a bucket in the sorted order are paired.
+    :param keys: list of numpy.ndarray
+        Key columns, the last one is the primary sort key.
+    :return: tuple (numpy.ndarray, numpy.ndarray, int)
+        The paired rows and the number of truncated buckets.
+    """
+    order = np.lexsort([rows] + keys)
+    if not len(order):
+        return rows[:0], rows[:0], 0
+    same = np.ones(len(order) - 1, dtype=bool)
+    for key in keys:
+        sorted_key = key[order]
+        same &= sorted_key[1:] == sorted_key[:-1]
+
+    sorted_rows = rows[order]
+    group_starts = np.concatenate([[True], ~same])
+    groups = np.cumsum(group_starts) - 1
+    starts = np.flatnonzero(group_starts)
+    sizes = np.diff(np.append(starts, len(order)))
+    positions = np.arange(len(order)) - starts[groups]
+    truncated = int((sizes > max_size).sum())
+    sizes = np.minimum(sizes, max_size)[groups]
+    # Only the members of buckets of two or more rows are paired
+    members = np.flatnonzero((sizes > 1) & (positions < sizes))
+    left, right = [rows[:0]], [rows[:0]]
+    for offset in range(1, sizes.max()):
+        members = members[positions[members] + offset < sizes[members]]
+        left.append(sorted_rows[members])
+        right.append(sorted_rows[members + offset])
+    return np.concatenate(left), np.concatenate(right), truncated
+
+
+def _dimensions_match(catalog, left, right):
+    """
+    :return: numpy.ndarray of bool, whether the known dimensions of
+        the paired products differ by less than DIMENSION_TOLERANCE.
+    """
+    match = np.ones(len(left), dtype=bool)
+    for field in DIMENSION_FIELDS:
+        values = catalog[field].to_numpy(dtype=np.float32)
+        x, y = values[left], values[right]
+        with np.errstate(invalid='ignore'):
+            close = np.abs(x - y) <= DIMENSION_TOLERANCE * np.maximum(
+                np.abs(x), np.abs(y)
+            )
+        match &= close | np.isnan(x) | np.isnan(y)
+    return match
+
+
+def find_duplicate_pairs(catalog, num_perm=128, bands=16, threshold=.8,
+                         shingle_size=5, seed=0,
+                         max_bucket_size=MAX_BUCKET_SIZE):
+    """
+    Finds the pairs of duplicate products of the catalog.
+    :param catalog: pandas.DataFrame
+        The catalog returned by `load_catalog`.
+    :param num_perm: int
+        The number of MinHash permutations.
+    :param bands: int
+        The number of LSH bands, must divide `num_perm`. More bands
+        find less similar candidates.
+    :param threshold: float
+        The minimum estimated Jaccard similarity of the duplicates.
+    :param shingle_size: int
+        The number of characters in a shingle.
+    :param max_bucket_size: int
+        The maximum number of products of an LSH bucket compared
+        pairwise (see `_bucket_pairs`).
+    :return: tuple (numpy.ndarray, numpy.ndarray, dict)
+        Rows of the paired products and the statistics.
+    """
+    if num_perm % bands:
+        raise ValueError('The number of permutations must be divisible '
+                         'by the number of bands')
+    rows = np.arange(len(catalog))
+
+    # Products with the same brand and SKU
+    brands, skus = normalize_text(catalog['brand']), \
+        normalize_text(catalog['sku'])
+    known = ((brands != '') & (skus != '')).to_numpy()
+    exact_key = pd.factorize(brands + '\0' + skus)[0]
+    exact_left, exact_right = _group_pairs([exact_key[known]], rows[known])
+
+    # MinHash-LSH candidates within blocks
+    texts = normalize_text(catalog[TEXT_FIELDS[0]])
+    for field in TEXT_FIELDS[1:]:
+        texts = texts + ' ' + normalize_text(catalog[field])
+    texts = texts.str.strip()
+    has_text = (texts != '').to_numpy()
+    text_rows = rows[has_text]
+    signatures = minhash_signatures(
+        texts[has_text].tolist(), num_perm, shingle_size, seed
+    )
+    blocks = catalog[BLOCK_FIELDS[0]].fillna('').str.lower()
+    for field in BLOCK_FIELDS[1:]:
+        blocks = blocks + '\0' + catalog[field].fillna('').str.lower()
+    blocks = pd.factorize(blocks)[0][has_text]
+
+    band_size = num_perm // bands
+    candidate_left, candidate_right = [], []
+    oversized = 0
+    for band in range(bands):
+        band_hashes = np.zeros(len(text_rows), dtype=np.uint64)
+        for column in range(band * band_size, (band + 1) * band_size):
+            band_hashes = (band_hashes * SHINGLE_BASE) ^ signatures[:, column]
+        left, right, truncated = _bucket_pairs(
+            [band_hashes, blocks], np.arange(len(text_rows)), max_bucket_size
+        )
+        oversized += truncated
+        candidate_left.append(left)
+        candidate_right.append(right)
+    left = np.concatenate(candidate_left).astype(np.int64)
+    right = np.concatenate(candidate_right).astype(np.int64)
+    # Unique unordered pairs
+    pairs = np.unique(
+        np.minimum(left, right) * len(text_rows) + np.maximum(left, right)
+    )
+    left, right = pairs // max(len(text_rows), 1), \
+        pairs % max(len(text_rows), 1)
+
+    similarity = np.empty(len(left), dtype=np.float64)
+    for start in range(0, len(left), SIMILARITY_CHUNKSIZE):
+        end = start + SIMILARITY_CHUNKSIZE
+        similarity[start:end] = (
+            signatures[left[start:end]] == signatures[right[start:end]]
+        ).mean(axis=1)
+    left, right = text_rows[left], text_rows[right]
+    confirmed = (similarity >= threshold) & \
+        _dimensions_match(catalog, left, right)
+
+    stats = {
+        'products': len(catalog),
+        'exact_pairs': len(exact_left),
+        'candidate_pairs': len(pairs),
+        'oversized_buckets': oversized,
+        'similar_pairs': int(confirmed.sum()),
+    }
+    return (
+        np.concatenate([exact_left, left[confirmed]]),
+        np.concatenate([exact_right, right[confirmed]]),
+        stats,
+    )
+
+
+def deduplicate(sites=None, num_perm=128, bands=16, threshold=.8,
+                shingle_size=5, seed=0, max_bucket_size=MAX_BUCKET_SIZE):
+    """
+    Clusters the duplicate products of the websites (connected
+    components of the duplicate pairs) and saves the canonical ids
+    table (see the module description) atomically.
+    See `find_duplicate_pairs` for the description of parameters.
+    :return: dict, the statistics of the deduplication.
+    """
+    catalog = load_catalog(sites)
+    left, right, stats = find_duplicate_pairs(
+        catalog, num_perm, bands, threshold, shingle_size, seed,
+        max_bucket_size
+    )
+    graph = sp.coo_matrix(
+        (np.ones(len(left), dtype=np.int8), (left, right)),
+        shape=(len(catalog), len(catalog))
+    )
+    _, labels = connected_components(graph, directed=False)
+
+    # The representative of a cluster is its first product by site
+    # and SKU (the catalog is sorted so)
+    representatives = pd.Series(np.arange(len(catalog))) \
+        .groupby(labels).transform('min').to_numpy()
+    ids = (catalog['site'] + ':' + catalog['sku']).to_numpy()
+    sizes = np.bincount(labels)[labels]
+    table = pd.DataFrame({
+        'site': catalog['site'],
+        'sku': catalog['sku'],
+        'canonical_id': ids[representatives],
+        'cluster_size': sizes,
+    })
+
+    path = get_canonical_ids_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(str(path) + '.tmp')
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    clusters = int((np.bincount(labels) > 1).sum())
+    stats.update({
+        'clusters': clusters,
+        'duplicates': int((sizes > 1).sum()) - clusters,
+    })
+    return stats
+
+
+@click.command('dedup')
+@click.option(
+    '--site', '-s', 'sites', type=str, multiple=True,
+    help='The domain name of the website to deduplicate products of '
+         '(may be specified several times) [default: all scraped]'
+)
+@click.option(
+    '--num-perm', type=int, default=128, show_default=True,
+    help='The number of MinHash permutations.'
+)
+@click.option(
+    '--bands', type=int, default=16, show_default=True,
+    help='The number of LSH bands (must divide --num-perm).'
+)
+@click.option(
+    '--threshold', type=float, default=.8, show_default=True,
+    help='The minimum estimated Jaccard similarity of duplicates.'
+)
+@click.option(
+    '--shingle-size', type=int, default=5, show_default=True,
+    help='The number of characters in a text shingle.'
+)
+@click.option(
+    '--max-bucket-size', type=click.IntRange(2), default=MAX_BUCKET_SIZE,
+    show_default=True,
+    help='The maximum number of products of an LSH bucket compared '
+         'pairwise.'
+)
+def dedup_cli(sites, num_perm, bands, threshold, shingle_size,
+              max_bucket_size):
+    """
+    Find duplicate products across the scraped websites and write the
+    table of their canonical ids to data/processed/canonical_ids.csv.
+    """
+    try:
+        stats = deduplicate(
+            sites, num_perm, bands, threshold, shingle_size,
+            max_bucket_size=max_bucket_size
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo(
+        f'{stats["products"]} products: {stats["exact_pairs"]} same '
+        f'brand and SKU pairs, {stats["similar_pairs"]} similar pairs of '
+        f'{stats["candidate_pairs"]} LSH candidates '
+        f'({stats["oversized_buckets"]} truncated buckets)\n'
+        f'{stats["duplicates"]} duplicates in {stats["clusters"]} clusters'
+    )
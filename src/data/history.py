@@ -0,0 +1,368 @@
+"""
+Append-only history of the website catalogs. The feeds are overwritten
+by every crawl, so after each crawl the feed is compared with the
+previous state of the catalog, and only the changes are appended to
+the columnar history store in data/history/ (see `get_history_path`):
+- changes/site=<site_py>/date=<YYYY-MM-DD>/<time>.parquet - Parquet
+  files partitioned by the website and the crawl date (UTC) with the
+  records sku, field, value (string as in the csv feed, null if the
+  field became empty) and crawled_at;
+- latest/<site_py>.parquet - the state of the catalog after the last
+  recorded crawl, which the next crawl is compared with.
+
+A new item is recorded with all its non-empty fields. An item missing
+from the complete (not incremental) crawl is recorded as removed by
+the PRESENCE_FIELD = '0' record, and as present ('1') when it appears
+again. So the storage grows with the amount of change rather than
+with the catalog size times the number of crawls.
+
+The queries (`state_at`, `price_series`) read only the partitions of
+the website and of the requested dates.
+"""
+import click
+import os
+from datetime import datetime, time, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.common.paths import get_history_path, get_site_py
+from src.data.scraping import config
+
+# The pseudo field of the item presence in the catalog: '1' or '0'
+PRESENCE_FIELD = '_present'
+CHANGES_SCHEMA = pa.schema([
+    pa.field('sku', pa.string()),
+    pa.field('field', pa.string()),
+    pa.field('value', pa.string()),
+    pa.field('crawled_at', pa.timestamp('us', tz='UTC')),
+])
+PARTITIONING = ds.partitioning(
+    pa.schema([pa.field('site', pa.string()), pa.field('date', pa.string())]),
+    flavor='hive'
+)
+
+
+def _get_latest_path(site):
+    return Path(get_history_path(), 'latest', f'{get_site_py(site)}.parquet')
+
+
+def _to_utc(moment, end_of_day=True):
+    """
+    :param moment: datetime.date or datetime.datetime
+        A date means the end (or the start) of the day, a naive
+        datetime is UTC.
+    :return: datetime.datetime
+    """
+    if not isinstance(moment, datetime):
+        moment = datetime.combine(
+            moment, time.max if end_of_day else time.min
+        )
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def read_catalog(feed_path):
+    """
+    Reads the csv feed as the catalog state: the values are strings,
+    empty if missing, the items are indexed by SKU (the last row of a
+    duplicate SKU is kept).
+    :return: pandas.DataFrame
+    """
+    catalog = pd.read_csv(
+        feed_path, dtype=str, keep_default_na=False, na_filter=False
+    )
+    catalog = catalog[catalog['sku'] != '']
+    catalog = catalog.drop_duplicates('sku', keep='last')
+    return catalog.set_index('sku')
+
+
+def diff_catalogs(previous, current, complete=True):
+    """
+    Finds the changes between the catalog states (see `read_catalog`).
+    :param previous: pandas.DataFrame
+        The previous state with the PRESENCE_FIELD column.
+    :param current: pandas.DataFrame
+        The current state without the PRESENCE_FIELD column.
+    :param complete: bool
+        Whether the current state contains all the catalog items, so
+        the missing ones are removed.
+    :return: tuple (pandas.DataFrame, pandas.DataFrame)
+        The changes (sku, field, value; value is None if the field is
+        empty) and the new state with the PRESENCE_FIELD column.
+    """
+    fields = list(current.columns)
+    fields += [
+        x for x in previous.columns
+        if x not in current.columns and x != PRESENCE_FIELD
+    ]
+    state = current.reindex(columns=fields, fill_value='')
+    state[PRESENCE_FIELD] = '1'
+    missing = previous.index.difference(state.index)
+    if len(missing):
+        kept = previous.loc[missing].reindex(columns=fields, fill_value='')
+        kept[PRESENCE_FIELD] = '0' if complete \
+            else previous.loc[missing, PRESENCE_FIELD]
+        state = pd.concat([state, kept])
+
+    before = previous.reindex(
+        index=state.index, columns=fields + [PRESENCE_FIELD]
+    )
+    is_new = before[PRESENCE_FIELD].isna().to_numpy()
+    skus = state.index.to_numpy()
+    changes = []
+    for field in fields + [PRESENCE_FIELD]:
+        values = state[field].to_numpy()
+        old = before[field].fillna('').to_numpy()
+        # New items are recorded with their non-empty fields only
+        changed = np.where(is_new, values != '', values != old)
+        if changed.any():
+            changes.append(pd.DataFrame({
+                'sku': skus[changed],
+                'field': field,
+                'value': values[changed],
+            }))
+    if changes:
+        changes = pd.concat(changes, ignore_index=True)
+        changes.loc[changes['value'] == '', 'value'] = None
+    else:
+        changes = pd.DataFrame(columns=['sku', 'field', 'value'])
+    return changes, state
+
+
+def record_history(site, feed_path=None, complete=True, crawled_at=None):
+    """
+    Appends the changes of the website catalog since the previous
+    recorded crawl to the history (see the module docstring).
+    :param site: str
+        The shortest domain name of the website.
+    :param feed_path: str or None
+        The path to the csv feed, the feed of the website by default.
+    :param complete: bool
+        Whether the feed contains all the catalog items (i.e. it's
+        produced by the finished not incremental crawl), so the items
+        missing from it are recorded as removed.
+    :param crawled_at: datetime.datetime or None
+        The time of the crawl, the current time by default.
+    :return: int, the number of recorded changes.
+    """
+    if feed_path is None:
+        feed_path, _ = config.get_scraping_output_paths(site)
+    crawled_at = _to_utc(crawled_at or datetime.now(timezone.utc))
+    latest_path = _get_latest_path(site)
+    if latest_path.exists():
+        previous = pd.read_parquet(latest_path).set_index('sku')
+    else:
+        previous = pd.DataFrame(columns=[PRESENCE_FIELD], dtype=str)
+        previous.index.name = 'sku'
+    changes, state = diff_catalogs(
+        previous, read_catalog(feed_path), complete
+    )
+
+    if len(changes):
+        changes = changes.sort_values(['sku', 'field'], kind='stable')
+        changes['crawled_at'] = pd.Timestamp(crawled_at)
+        partition_path = Path(
+            get_history_path(), 'changes', f'site={get_site_py(site)}',
+            f'date={crawled_at.date().isoformat()}'
+        )
+        partition_path.mkdir(parents=True, exist_ok=True)
+        pq.write_table(
+            pa.Table.from_pandas(
+                changes, schema=CHANGES_SCHEMA, preserve_index=False
+            ),
+            Path(partition_path, f'{crawled_at:%H%M%S%f}.parquet')
+        )
+
+    # The state is replaced after the changes are written: if the
+    # process crashes in between, the changes are recorded again
+    latest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(str(latest_path) + '.tmp')
+    state.reset_index().to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, latest_path)
+    return len(changes)
+
+
+def load_changes(site, since=None, until=None, skus=None, fields=None):
+    """
+    Reads the changes of the website catalog from the history. Only
+    the partitions of the website within the dates are read.
+    :param site: str
+        The shortest domain name of the website.
+    :param since: datetime.date or datetime.datetime or None
+    :param until: datetime.date or datetime.datetime or None
+        The inclusive bounds of the crawl time, a date bound includes
+        the whole day.
+    :param skus: list of str or None
+        The SKUs of the items to read the changes of.
+    :param fields: list of str or None
+        The fields to read the changes of.
+    :return: pandas.DataFrame
+        sku, field, value, crawled_at sorted by crawled_at.
+    """
+    path = Path(get_history_path(), 'changes')
+    if not path.exists():
+        return CHANGES_SCHEMA.empty_table().to_pandas()
+
+    condition = ds.field('site') == get_site_py(site)
+    if since is not None:
+        since = _to_utc(since, end_of_day=False)
+        condition &= ds.field('date') >= since.date().isoformat()
+    if until is not None:
+        until = _to_utc(until)
+        condition &= ds.field('date') <= until.date().isoformat()
+    if skus is not None:
+        condition &= ds.field('sku').isin(list(skus))
+    if fields is not None:
+        condition &= ds.field('field').isin(list(fields))
+
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    changes = dataset.to_table(
+        columns=CHANGES_SCHEMA.names, filter=condition
+    ).to_pandas()
+    if since is not None:
+        changes = changes[changes['crawled_at'] >= pd.Timestamp(since)]
+    if until is not None:
+        changes = changes[changes['crawled_at'] <= pd.Timestamp(until)]
+    return changes.sort_values('crawled_at', kind='stable') \
+        .reset_index(drop=True)
+
+
+def state_at(site, moment):
+    """
+    Restores the state of the website catalog at the moment from the
+    history: the last recorded values of the items present then.
+    :param site: str
+        The shortest domain name of the website.
+    :param moment: datetime.date or datetime.datetime
+        A date means the end of the day, a naive datetime is UTC.
+    :return: pandas.DataFrame
+        The items indexed by SKU with the string values (None if the
+        field is empty).
+    """
+    changes = load_changes(site, until=moment)
+    last = changes.drop_duplicates(['sku', 'field'], keep='last')
+    state = last.pivot(index='sku', columns='field', values='value')
+    state.columns.name = None
+    # The fields never recorded for the item are empty as well
+    state = state.astype(object).where(state.notna(), None)
+    if PRESENCE_FIELD in state.columns:
+        state = state[state[PRESENCE_FIELD] == '1']
+        state = state.drop(columns=PRESENCE_FIELD)
+    return state
+
+
+def price_series(site, sku, since=None, until=None):
+    """
+    :param site: str
+        The shortest domain name of the website.
+    :param sku: str
+        The SKU of the item.
+    :param since: datetime.date or datetime.datetime or None
+    :param until: datetime.date or datetime.datetime or None
+        The bounds of the crawl time (see `load_changes`).
+    :return: pandas.Series
+        The prices of the item set by the crawls within the bounds,
+        which changed its price or presence (NaN while the item is
+        removed or has no price), indexed by the crawl time.
+    """
+    # The earlier changes are read to know the price at `since`
+    changes = load_changes(
+        site, until=until, skus=[sku], fields=['price', PRESENCE_FIELD]
+    )
+    prices = {}
+    price, present = np.nan, True
+    for field, value, crawled_at in zip(
+            changes['field'], changes['value'], changes['crawled_at']):
+        if field == PRESENCE_FIELD:
+            present = value == '1'
+        else:
+            price = pd.to_numeric(value, errors='coerce')
+        prices[crawled_at] = price if present else np.nan
+
+    series = pd.Series(prices, name=sku, dtype=float)
+    series.index.name = 'crawled_at'
+    if since is not None:
+        series = series[
+            series.index >= pd.Timestamp(_to_utc(since, end_of_day=False))
+        ]
+    return series
+
+
+@click.group('history')
+def history_cli():
+    """
+    Record and query the history of the website catalog changes.
+    """
+
+
+@history_cli.command('record')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to record the feed of'
+)
+@click.option(
+    '--partial', is_flag=True,
+    help='The feed contains only some of the items (e.g. the incremental '
+         'crawl), the missing ones aren\'t recorded as removed.'
+)
+def record_history_cli(site, partial):
+    """
+    Append the changes of the current csv feed of the website since the
+    previous recorded crawl to the history.
+    """
+    count = record_history(site, complete=not partial)
+    click.echo(f'Recorded {count} changes')
+
+
+@history_cli.command('state')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to restore the catalog of'
+)
+@click.option(
+    '--at', 'moment', type=click.DateTime(), required=True,
+    help='The date (the end of the day) or the UTC time of the state.'
+)
+@click.option(
+    '--output', '-o', type=click.Path(dir_okay=False), required=True,
+    help='The csv file to write the catalog to'
+)
+def state_cli(site, moment, output):
+    """
+    Restore the catalog of the website at the given date or time.
+    """
+    if moment.time() == time.min:
+        moment = moment.date()
+    state = state_at(site, moment)
+    state.to_csv(output)
+    click.echo(f'Restored {len(state)} items')
+
+
+@history_cli.command('prices')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to read the prices of'
+)
+@click.option('--sku', type=str, required=True, help='SKU of the item')
+@click.option(
+    '--since', type=click.DateTime(), default=None,
+    help='The start date or UTC time of the series.'
+)
+@click.option(
+    '--until', type=click.DateTime(), default=None,
+    help='The end date (inclusive) or UTC time of the series.'
+)
+def prices_cli(site, sku, since, until):
+    """
+    Print the price changes of the website item.
+    """
+    if until is not None and until.time() == time.min:
+        until = until.date()
+    for crawled_at, price in price_series(site, sku, since, until).items():
+        click.echo(f'{crawled_at.isoformat()}\t{price}')
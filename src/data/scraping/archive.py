@@ -0,0 +1,110 @@
+"""
+This module contains the archive of raw product pages, which allows
+to replay the pages through the parsers without network access.
+"""
+import csv
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+from src.data.scraping.incremental import utc_now
+
+
+class HtmlArchive:
+    """
+    Content-addressed archive of raw HTML pages. The archive folder
+    contains:
+    - objects/<hh>/<hash>.html.gz - gzip-compressed page bodies named
+      by the SHA-1 hash of the body (<hh> denotes the first two hash
+      characters), so identical pages are stored only once;
+    - index.csv - append-only index of archived pages with the
+      following columns: url, hash, encoding, archived_at.
+
+    The same URL may be archived several times (e.g. by subsequent
+    crawls), in this case the latest index record is considered.
+    """
+    index_fields = ['url', 'hash', 'encoding', 'archived_at']
+
+    def __init__(self, path, compresslevel=6):
+        """
+        :param path: str or Path
+            The path to the archive folder.
+        :param compresslevel: int
+            The gzip compression level of the archived pages.
+        """
+        self.path = Path(path)
+        self.compresslevel = compresslevel
+        self._index_file = None
+        self._index_writer = None
+
+    @property
+    def index_path(self):
+        return Path(self.path, 'index.csv')
+
+    def object_path(self, content_hash):
+        return Path(
+            self.path, 'objects', content_hash[:2], f'{content_hash}.html.gz'
+        )
+
+    def add(self, url, body, encoding):
+        """
+        Archives the page body (if it isn't archived yet) and appends
+        the record to the archive index.
+        :param url: str
+            The URL of the page.
+        :param body: bytes
+            The raw page body.
+        :param encoding: str
+            The encoding of the page body.
+        :return: str, the content hash of the page.
+        """
+        content_hash = hashlib.sha1(body).hexdigest()
+        object_path = self.object_path(content_hash)
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first, so that a crash never
+            # leaves a truncated object in the archive
+            tmp_path = object_path.with_name(object_path.name + '.tmp')
+            tmp_path.write_bytes(
+                gzip.compress(body, compresslevel=self.compresslevel)
+            )
+            os.replace(tmp_path, object_path)
+
+        if self._index_writer is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            write_header = not self.index_path.exists()
+            self._index_file = self.index_path.open(
+                'a', newline='', encoding='utf-8'
+            )
+            self._index_writer = csv.writer(self._index_file)
+            if write_header:
+                self._index_writer.writerow(self.index_fields)
+        self._index_writer.writerow([url, content_hash, encoding, utc_now()])
+        return content_hash
+
+    def read(self, content_hash):
+        """Returns the raw body of the archived page."""
+        return gzip.decompress(self.object_path(content_hash).read_bytes())
+
+    def iter_entries(self):
+        """
+        Iterates over the latest index records of archived pages.
+        :return:
+            Nothing, but (url, hash, encoding) tuples are generated.
+        """
+        if not self.index_path.exists():
+            return
+
+        latest = {}
+        with self.index_path.open(newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                latest[row['url']] = (row['hash'], row['encoding'])
+
+        for url, (content_hash, encoding) in latest.items():
+            yield url, content_hash, encoding
+
+    def close(self):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = self._index_writer = None
@@ -0,0 +1,363 @@
+"""
+Micro-benchmarks of the website parsers. The benchmark corpus is a
+small HTML archive (see `HtmlArchive`) of recorded product pages,
+which is kept in data/raw/<site_py>/bench/ together with the golden
+items - the reference parsing results used to verify that the parsers
+output hasn't changed.
+"""
+import click
+import functools
+import json
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from scrapy.http import HtmlResponse
+
+from src.common.paths import get_site_py
+from src.data.scraping import config
+from src.data.scraping.archive import HtmlArchive
+from src.data.scraping.main import load_spider
+
+# Parser methods, which time is measured separately
+TIMED_METHOD_PATTERN = re.compile(r'^_?(parse|list|iter)_')
+
+
+def get_bench_path(site):
+    """
+    Return the path to the benchmark corpus of the website:
+    data/raw/<site_py>/bench/.
+    """
+    return Path(config.get_raw_data_path(site), 'bench')
+
+
+def get_bench_report_path(site):
+    """
+    Return the default path of the benchmark report:
+    reports/bench/<site_py>.json.
+    """
+    return Path('reports', 'bench', get_site_py(site) + '.json')
+
+
+def record_corpus(site, pages):
+    """
+    Copies the latest `pages` product pages from the HTML archive of
+    the website into its benchmark corpus.
+    :return: int, the number of recorded pages.
+    """
+    source = HtmlArchive(config.get_html_archive_path(site))
+    target = HtmlArchive(get_bench_path(site))
+    recorded = 0
+    for url, content_hash, encoding in source.iter_entries():
+        if recorded == pages:
+            break
+        target.add(url, source.read(content_hash), encoding)
+        recorded += 1
+    target.close()
+    return recorded
+
+
+def load_corpus(site):
+    """
+    :return: list of tuples (str, bytes, str)
+        Url, body and encoding of the pages of the benchmark corpus.
+    """
+    archive = HtmlArchive(get_bench_path(site))
+    return [
+        (url, archive.read(content_hash), encoding)
+        for url, content_hash, encoding in archive.iter_entries()
+    ]
+
+
+def _to_json(item):
+    """Converts the parsed item to the json-compatible dict."""
+    return json.loads(json.dumps(dict(item), ensure_ascii=False))
+
+
+def store_golden(site, corpus):
+    """
+    Parses the corpus with the default parser of the website and
+    stores the results as golden items (url -> item) in golden.json.
+    """
+    parser_cls = load_spider(site).get_parser_cls()
+    golden = {
+        url: _to_json(parser_cls(
+            HtmlResponse(url=url, body=body, encoding=encoding)
+        ).parse())
+        for url, body, encoding in corpus
+    }
+    golden_path = Path(get_bench_path(site), 'golden.json')
+    with golden_path.open('w', encoding='utf-8') as f:
+        json.dump(golden, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+def load_golden(site):
+    golden_path = Path(get_bench_path(site), 'golden.json')
+    if not golden_path.exists():
+        return None
+    with golden_path.open(encoding='utf-8') as f:
+        return json.load(f)
+
+
+class MethodTimer:
+    """
+    Accumulates the time spent in the instrumented parser methods.
+    Generator methods (e.g. lists of properties) are measured while
+    being iterated. Nested calls are measured inclusively.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+
+    def _record(self, name, seconds):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.) + seconds
+
+    def _wrap_generator(self, name, generator):
+        elapsed = 0.
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield value
+        self._record(name, elapsed)
+
+    def wrap(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            if hasattr(result, '__next__'):
+                return self._wrap_generator(name, result)
+            self._record(name, elapsed)
+            return result
+
+        return wrapper
+
+    def instrument(self, parser):
+        """Replaces the parser (and its loader) methods with wrappers."""
+        for name in dir(parser):
+            if TIMED_METHOD_PATTERN.match(name):
+                method = getattr(parser, name)
+                if callable(method):
+                    setattr(parser, name, self.wrap(name, method))
+
+        loader = getattr(parser, 'loader', None)
+        if loader is not None:
+            for name in ('add_value', 'load_item'):
+                method = getattr(loader, name)
+                setattr(loader, name, self.wrap(f'loader.{name}', method))
+
+    def report(self):
+        return {
+            name: {
+                'calls': self.calls[name],
+                'total_seconds': self.seconds[name],
+                'mean_seconds': self.seconds[name] / self.calls[name],
+            }
+            for name in sorted(self.calls)
+        }
+
+
+def bench_parser(parser_cls, corpus, rounds=5, golden=None):
+    """
+    Benchmarks the parser over the corpus of pages.
+    :param parser_cls: BaseJewelParser subclass
+        The parser class to benchmark.
+    :param corpus: list of tuples (str, bytes, str)
+        Url, body and encoding of the pages.
+    :param rounds: int
+        The number of passes over the corpus to measure throughput,
+        the best pass is reported.
+    :param golden: dict or None
+        Golden items (url -> item) to verify the parser output against.
+    :return: dict, the benchmark results of the parser.
+    """
+    # Throughput: the parser is created for each page (including
+    # the parsing of HTML), as the spider does it
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for url, body, encoding in corpus:
+            response = HtmlResponse(url=url, body=body, encoding=encoding)
+            parser_cls(response).parse()
+        best = min(best, time.perf_counter() - start)
+
+    # Per-method timing and memory are measured in separate passes,
+    # since instrumentation distorts the throughput
+    timer = MethodTimer()
+    peaks, mismatches = [], []
+    for url, body, encoding in corpus:
+        response = HtmlResponse(url=url, body=body, encoding=encoding)
+        parser = parser_cls(response)
+        timer.instrument(parser)
+        parser.parse()
+
+        tracemalloc.start()
+        response = HtmlResponse(url=url, body=body, encoding=encoding)
+        item = parser_cls(response).parse()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        if golden is not None and golden.get(url) != _to_json(item):
+            mismatches.append(url)
+
+    return {
+        'pages_per_sec': len(corpus) / best if best else None,
+        'seconds_per_page': best / len(corpus),
+        'methods': timer.report(),
+        'peak_memory_bytes': {
+            'mean': sum(peaks) / len(peaks),
+            'max': max(peaks),
+        },
+        'golden_mismatches': mismatches if golden is not None else None,
+    }
+
+
+def bench(site, rounds=5):
+    """
+    Benchmarks all parsers of the website spider (the default and the
+    fast one, if implemented) over the benchmark corpus.
+    :param site: str
+        The shortest domain name of the website.
+    :param rounds: int
+        The number of passes over the corpus to measure throughput.
+    :return: dict, the benchmark report.
+    """
+    corpus = load_corpus(site)
+    if not corpus:
+        raise click.ClickException(
+            f'The benchmark corpus of {site} is empty, record it first'
+        )
+    golden = load_golden(site)
+    spider = load_spider(site)
+
+    parsers = {}
+    for parser_cls in (spider.get_parser_cls(), spider.get_parser_cls(True)):
+        if parser_cls.__name__ not in parsers:
+            parsers[parser_cls.__name__] = bench_parser(
+                parser_cls, corpus, rounds, golden
+            )
+
+    return {
+        'site': site,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'pages': len(corpus),
+        'rounds': rounds,
+        'golden_items': golden is not None,
+        'parsers': parsers,
+    }
+
+
+def compare_reports(report, baseline, tolerance=0.1):
+    """
+    Compares the throughput of the parsers present in both reports.
+    :param tolerance: float
+        The allowed relative throughput decrease.
+    :return: tuple (list of str, bool)
+        Comparison lines and whether any regression is detected.
+    """
+    lines, regressed = [], False
+    for name, results in report['parsers'].items():
+        base = baseline['parsers'].get(name)
+        if base is None:
+            continue
+        if not base['pages_per_sec']:
+            # Nothing to compare the throughput with
+            lines.append(f'{name}: no baseline throughput')
+            continue
+        ratio = results['pages_per_sec'] / base['pages_per_sec']
+        is_regression = ratio < 1 - tolerance
+        regressed = regressed or is_regression
+        lines.append(
+            f'{name}: {results["pages_per_sec"]:.1f} pages/sec, '
+            f'{ratio:.2f}x of baseline'
+            + (' - REGRESSION' if is_regression else '')
+        )
+        for method, stats in results['methods'].items():
+            base_stats = base['methods'].get(method)
+            if base_stats and base_stats['mean_seconds']:
+                ratio = stats['mean_seconds'] / base_stats['mean_seconds']
+                lines.append(f'  {method}: {ratio:.2f}x of baseline time')
+    return lines, regressed
+
+
+@click.command('bench')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to benchmark parsers of'
+)
+@click.option(
+    '--record', type=int, default=None,
+    help='Record the given number of pages from the HTML archive '
+         'of the website into the benchmark corpus first.'
+)
+@click.option(
+    '--update-golden', is_flag=True,
+    help='Store the default parser output as golden items first.'
+)
+@click.option(
+    '--rounds', type=int, default=5, show_default=True,
+    help='The number of passes over the corpus to measure throughput.'
+)
+@click.option(
+    '--output', '-o', type=click.Path(dir_okay=False), default=None,
+    help='The path of the json report [default: reports/bench/<site>.json]'
+)
+@click.option(
+    '--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+    help='The path of the baseline json report to compare against.'
+)
+@click.option(
+    '--tolerance', type=float, default=0.1, show_default=True,
+    help='The allowed relative throughput decrease against the baseline.'
+)
+def bench_cli(site, record, update_golden, rounds, output, baseline,
+              tolerance):
+    """
+    Benchmark the parsers of the website over the recorded product
+    pages, verify their output against the golden items and write
+    the json report.
+    """
+    if record:
+        click.echo(f'Recorded {record_corpus(site, record)} pages')
+    if update_golden:
+        store_golden(site, load_corpus(site))
+
+    report = bench(site, rounds)
+    output = Path(output or get_bench_report_path(site))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open('w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    failed = []
+    for name, results in report['parsers'].items():
+        click.echo(
+            f'{name}: {results["pages_per_sec"]:.1f} pages/sec, peak memory '
+            f'{results["peak_memory_bytes"]["max"] / 1024:.0f} KiB per item'
+        )
+        mismatches = results['golden_mismatches']
+        if mismatches:
+            failed.append(f'the {name} output differs from golden items')
+            click.echo(f'  {len(mismatches)} items differ from golden ones')
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            lines, regressed = compare_reports(report, json.load(f), tolerance)
+        click.echo('\n'.join(lines))
+        if regressed:
+            failed.append('the throughput regressed against the baseline')
+
+    if failed:
+        raise click.ClickException('Benchmark failed: ' + '; '.join(failed))
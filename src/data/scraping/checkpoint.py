@@ -0,0 +1,87 @@
+"""
+This module contains the feed checkpoint of the resumable crawls (see
+`scrape` with the `resume` option). The scraped items are committed to
+the checkpoint in batches instead of the feeds, so that a crashed or
+stopped crawl can be continued without losing or duplicating items;
+the feeds are exported from the checkpoint when the crawl finishes.
+"""
+import json
+
+from itemadapter import ItemAdapter
+
+from src.common.sqlite import SqliteStore
+
+
+class FeedCheckpoint(SqliteStore):
+    """
+    Scraped items keyed by their page URLs in the order of scraping,
+    and the state of the crawl job: RUNNING while the crawl is running,
+    PAUSED after the crawl has been closed. The RUNNING state found
+    before the crawl means that the previous crawl has crashed.
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS items (
+            url TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            item TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    '''
+    RUNNING = 'running'
+    PAUSED = 'paused'
+
+    def __init__(self, path, commit_every=100):
+        super(FeedCheckpoint, self).__init__(path, commit_every)
+        self._seq = self.execute(
+            'SELECT COALESCE(MAX(seq), 0) FROM items'
+        ).fetchone()[0]
+
+    def get_state(self):
+        """:return: str or None, the state of the crawl job."""
+        row = self.execute(
+            "SELECT value FROM job WHERE key = 'state'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, state):
+        self.execute(
+            "INSERT OR REPLACE INTO job VALUES ('state', ?)", (state,)
+        )
+        self.commit()
+
+    def has(self, url):
+        """Checks whether the item of the page has been scraped."""
+        return self.execute(
+            'SELECT 1 FROM items WHERE url = ?', (url,)
+        ).fetchone() is not None
+
+    def add(self, url, item):
+        """
+        Stores the item of the page, replacing the previous one.
+        :return: bool, whether the batch of items has been committed.
+        """
+        self._seq += 1
+        self.execute(
+            'INSERT OR REPLACE INTO items VALUES (?, ?, ?)',
+            (url, self._seq, json.dumps(
+                ItemAdapter(item).asdict(), ensure_ascii=False
+            ))
+        )
+        return self.modified()
+
+    def count(self):
+        return self.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def iter_items(self, item_cls):
+        """
+        :param item_cls: scrapy.Item subclass
+        :return:
+            Nothing, but the stored items are generated in the order
+            of scraping.
+        """
+        rows = self.execute('SELECT item FROM items ORDER BY seq')
+        for data, in rows:
+            yield item_cls(json.loads(data))
@@ -1,9 +1,50 @@
 from pathlib import Path
 
+from src.common.paths import get_site_py
+from src.data.scraping.items import get_feed_fields
+
+# The item fields exported to the feeds (others are in side tables)
+FEED_FIELDS = get_feed_fields()
 # Overwrite CSV files by default, do not append new data
-CSV_FEED_PARAMS = {'format': 'csv', 'overwrite': True}
-# Use custom pipeline class that controls image-related attributes
-ITEM_PIPELINES = {'src.data.scraping.pipelines.SimpleImagesPipeline': 1}
+CSV_FEED_PARAMS = {'format': 'csv', 'overwrite': True, 'fields': FEED_FIELDS}
+# Columnar feed stored alongside the csv one, if requested
+PARQUET_FEED_PARAMS = {
+    'format': 'parquet', 'overwrite': True, 'fields': FEED_FIELDS
+}
+# Custom feed exporters: format name -> exporter class, list values are
+# written to csv feeds as JSON arrays
+FEED_EXPORTERS = {
+    'csv': 'src.data.scraping.exporters.JsonListCsvItemExporter',
+    'parquet': 'src.data.scraping.exporters.ParquetItemExporter',
+}
+# Use custom pipeline class that controls image-related attributes,
+# the image tensors pipeline is disabled unless image sizes are specified
+ITEM_PIPELINES = {
+    'src.data.scraping.pipelines.SimpleImagesPipeline': 1,
+    'src.data.scraping.pipelines.ImageTensorPipeline': 2,
+    'src.data.scraping.pipelines.GemInsertsPipeline': 3,
+}
+# Custom spider middlewares, disabled unless the corresponding settings
+# are specified
+SPIDER_MIDDLEWARES = {
+    'src.data.scraping.middlewares.HtmlArchiveMiddleware': 100,
+    'src.data.scraping.middlewares.ItemTimingMiddleware': 10,
+}
+# Custom extensions, disabled unless the corresponding settings
+# are specified
+EXTENSIONS = {
+    'src.data.scraping.extensions.MetricsExtension': 500,
+}
+# HTTP cache used by the `--cache` scraping mode: the storage keeping
+# all responses of the website in the single SQLite file, the age
+# after which responses expire (1 week) and the maximum size of the
+# cache (2 GiB), the least recently used responses are evicted first
+HTTPCACHE_STORAGE = 'src.data.scraping.httpcache.SqliteCacheStorage'
+HTTPCACHE_EXPIRATION_SECS = 7 * 24 * 60 * 60
+HTTPCACHE_MAX_BYTES = 2 * 1024 ** 3
+# Cache policies: serve all cached responses or revalidate stale ones
+HTTPCACHE_DUMMY_POLICY = 'scrapy.extensions.httpcache.DummyPolicy'
+HTTPCACHE_RFC2616_POLICY = 'scrapy.extensions.httpcache.RFC2616Policy'
 
 # The name of the package containing this file (in dot notation)
 SCRAPING_PACKAGE_NAME = '.'.join(__name__.split('.')[:-1])
@@ -22,6 +63,21 @@ SPIDER_MODULES = [
 SPIDER_LOADER_WARN_ONLY = False
 
 
+def get_raw_data_path(site):
+    """
+    Return the path to the folder with the raw scraped data of the
+    website (relative to the project root): data/raw/<site_py>/.
+
+    Here, <site_py> is the shortest website domain, in which dots are
+    replaced with underscores.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: Path
+    """
+    return Path('data', 'raw', get_site_py(site))
+
+
 def get_scraping_output_paths(site):
     """
     Return paths to the scraping output files (relative to the
@@ -37,8 +93,110 @@ def get_scraping_output_paths(site):
     :return: tuple (str, str)
         CSV feed path and image folder path, respectively.
     """
-    site_py = site.replace('.', '_')
-    raw_data_path = Path('data', 'raw')
-    feed_path = Path(raw_data_path, site_py, 'items.csv')
-    images_path = Path(raw_data_path, site_py, 'images')
+    raw_data_path = get_raw_data_path(site)
+    feed_path = Path(raw_data_path, 'items.csv')
+    images_path = Path(raw_data_path, 'images')
     return str(feed_path), str(images_path)
+
+
+def get_inserts_path(site):
+    """
+    Return the path to the side table of gem inserts of the jewels
+    (see `Jewel.inserts`): data/raw/<site_py>/inserts.csv.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'inserts.csv'))
+
+
+def get_parquet_feed_path(site):
+    """
+    Return the path to the columnar Parquet feed:
+    data/raw/<site_py>/items.parquet.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'items.parquet'))
+
+
+def get_crawl_state_path(site):
+    """
+    Return the path to the crawl state database used by the incremental
+    scraping mode: data/raw/<site_py>/crawl_state.sqlite.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'crawl_state.sqlite'))
+
+
+def get_html_archive_path(site):
+    """
+    Return the path to the archive of raw product pages (see
+    `HtmlArchive`): data/raw/<site_py>/html/.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'html'))
+
+
+def get_http_cache_path(site):
+    """
+    Return the path to the HTTP cache database used by the `--cache`
+    scraping mode: data/raw/<site_py>/httpcache.sqlite.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'httpcache.sqlite'))
+
+
+def get_metrics_dump_path(site):
+    """
+    Return the path to the json dump of the crawl metrics (see
+    `MetricsExtension`): reports/metrics/<site_py>.json.
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path('reports', 'metrics', get_site_py(site) + '.json'))
+
+
+def get_job_path(site):
+    """
+    Return the path to the folder of the resumable crawl job used by
+    the `--resume` scraping mode: data/raw/<site_py>/job/. It contains
+    the feed checkpoint (checkpoint.sqlite, see `FeedCheckpoint`) and
+    the Scrapy job directory with the persisted scheduler queue and
+    seen request fingerprints (scheduler/).
+
+    :param site: str
+        The shortest domain name of the website to scrape data from.
+    :return: str
+    """
+    return str(Path(get_raw_data_path(site), 'job'))
+
+
+def get_delta_feed_path(feed_path):
+    """
+    Return the path to the temporary feed collecting new and updated
+    items during the incremental scraping, which are merged into
+    the main feed after the crawl: <feed name>.delta.<feed suffix>.
+
+    :param feed_path: str
+        The path to the main feed.
+    :return: str
+    """
+    feed_path = Path(feed_path)
+    return str(feed_path.with_name(
+        f'{feed_path.stem}.delta{feed_path.suffix}'
+    ))
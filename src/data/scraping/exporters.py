@@ -0,0 +1,171 @@
+"""
+This module complements `scrapy.exporters` with custom item exporters.
+"""
+import csv
+import json
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from itemadapter import ItemAdapter
+from scrapy.exporters import BaseItemExporter, CsvItemExporter
+from src.data.scraping.items import Jewel, get_feed_fields
+
+# Item field dtype (see `Jewel`) -> Arrow data type
+ARROW_TYPES = {
+    'string': pa.string(),
+    'float32': pa.float32(),
+    'int32': pa.int32(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'list': pa.list_(pa.string()),
+}
+
+
+def get_field_dtype(item_cls, name):
+    return item_cls.fields[name].get('dtype', 'string')
+
+
+def get_arrow_schema(item_cls=Jewel, fields=None):
+    """
+    Builds the Arrow schema from the `dtype` metadata of item fields.
+    :param item_cls: scrapy.Item subclass
+        The item class, which fields are described by the schema.
+    :param fields: list of str or None
+        The fields included into the schema, all the item fields
+        exported to the feeds by default (in the same order as the
+        csv feed has them).
+    :return: pyarrow.Schema
+    """
+    if fields is None:
+        fields = get_feed_fields(item_cls)
+    return pa.schema([
+        pa.field(name, ARROW_TYPES[get_field_dtype(item_cls, name)])
+        for name in fields
+    ])
+
+
+class JsonListCsvItemExporter(CsvItemExporter):
+    """
+    Csv item exporter writing the list values as JSON arrays instead
+    of joining them with commas, which may be present in the values
+    themselves (e.g. in the image URLs of CDN transforms).
+    """
+    def serialize_field(self, field, name, value):
+        if isinstance(value, (list, tuple)):
+            return json.dumps(list(value), ensure_ascii=False)
+        return super(JsonListCsvItemExporter, self).serialize_field(
+            field, name, value
+        )
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """
+    Exports items to the Parquet file with the explicit schema derived
+    from the item fields (see `get_arrow_schema`). The items are
+    buffered column-wise and written in row groups of `row_group_size`
+    items, so the memory consumption is bounded by the row group size.
+    Categorical fields are dictionary-encoded.
+    """
+    def __init__(self, file, item_cls=Jewel, row_group_size=10000,
+                 compression='snappy', **kwargs):
+        # Ignore csv/json specific options (encoding, indent) passed by
+        # the feed exports extension
+        super(ParquetItemExporter, self).__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.schema = get_arrow_schema(item_cls, self.fields_to_export)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._columns = {name: [] for name in self.schema.names}
+        self._rows = 0
+        self._writer = None
+
+    def start_exporting(self):
+        self._writer = pq.ParquetWriter(
+            self.file, self.schema, compression=self.compression
+        )
+
+    def export_item(self, item):
+        adapter = ItemAdapter(item)
+        for name, values in self._columns.items():
+            values.append(adapter.get(name))
+        self._rows += 1
+        if self._rows >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if not self._rows:
+            return
+
+        arrays = []
+        for field in self.schema:
+            values = self._columns[field.name]
+            if pa.types.is_dictionary(field.type):
+                array = pa.array(values, type=field.type.value_type)
+                array = array.dictionary_encode()
+            else:
+                array = pa.array(values, type=field.type)
+            arrays.append(array)
+            values.clear()
+
+        self._writer.write_table(
+            pa.Table.from_arrays(arrays, schema=self.schema)
+        )
+        self._rows = 0
+
+    def finish_exporting(self):
+        self._write_row_group()
+        self._writer.close()
+
+
+def _parse_csv_value(value, dtype):
+    """Converts csv feed value back to the item field value."""
+    if value == '':
+        return [] if dtype == 'list' else None
+    if dtype == 'float32':
+        return float(value)
+    if dtype == 'int32':
+        return int(value)
+    if dtype == 'list':
+        # Lists are JSON arrays (see `JsonListCsvItemExporter`), the
+        # feeds exported before were joined with commas
+        if value.startswith('['):
+            return json.loads(value)
+        return value.split(',')
+    return value
+
+
+def csv_to_parquet(csv_path, parquet_path, item_cls=Jewel,
+                   row_group_size=10000):
+    """
+    Converts the csv feed to the Parquet feed in a streaming way. The
+    resulting file replaces the existing Parquet feed atomically.
+    :param csv_path: str
+        The path to the csv feed.
+    :param parquet_path: str
+        The path to the Parquet feed.
+    :param item_cls: scrapy.Item subclass
+        The class of items stored in the feed.
+    :param row_group_size: int
+        The number of rows in Parquet row groups.
+    :return: nothing
+    """
+    tmp_path = Path(str(parquet_path) + '.tmp')
+    with open(csv_path, newline='', encoding='utf-8') as f, \
+            tmp_path.open('wb') as out:
+        reader = csv.DictReader(f)
+        fields = [x for x in reader.fieldnames if x in item_cls.fields]
+        dtypes = {x: get_field_dtype(item_cls, x) for x in fields}
+
+        exporter = ParquetItemExporter(
+            out, item_cls, row_group_size, fields_to_export=fields
+        )
+        exporter.start_exporting()
+        for row in reader:
+            exporter.export_item({
+                name: _parse_csv_value(row[name], dtype)
+                for name, dtype in dtypes.items()
+            })
+        exporter.finish_exporting()
+
+    os.replace(tmp_path, parquet_path)
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor, task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from src.common.metrics import FAST_BUCKETS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    'jsim_download_seconds',
+    'Download latency of responses (kind is page or image).'
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    'jsim_parse_seconds',
+    'Time spent in the parser methods and the whole parsing of a page.',
+    FAST_BUCKETS
+)
+ITEM_PIPELINE_SECONDS = REGISTRY.histogram(
+    'jsim_item_pipeline_seconds',
+    'Time spent by items in the item pipelines (incl. image downloads).'
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    'jsim_queue_depth',
+    'The number of requests or items waiting in the crawler stage.'
+)
+
+
+class MetricsResource(Resource):
+    """Serves the metrics in the Prometheus text exposition format."""
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+        return REGISTRY.render().encode('utf-8')
+
+
+class MetricsExtension:
+    """
+    Records the crawl metrics (see `src.common.metrics`) labelled with
+    the website domain:
+    - download latency of pages and images;
+    - parse time of each `parse_*` method of the parser, the loading
+      of items and the whole parsing of pages (the parser of
+      `BaseJewelSpider` reports them via `parse_timer`);
+    - the time items spend in the item pipelines (see
+      `ItemTimingMiddleware`);
+    - queue depths of the scheduler, downloader, spider callbacks
+      and item pipelines, sampled every METRICS_INTERVAL seconds.
+
+    The metrics are dumped to the json file METRICS_DUMP_PATH every
+    METRICS_INTERVAL seconds and on the crawl end. If METRICS_PORT
+    is specified, they are also served in the Prometheus text format
+    at http://127.0.0.1:<port>/metrics. All crawlers of the process
+    share the single metrics endpoint.
+
+    The extension is enabled by the METRICS_ENABLED setting.
+    """
+    _port = None
+    _port_users = 0
+
+    def __init__(self, crawler, interval, dump_path, port):
+        self.crawler = crawler
+        self.interval = interval
+        self.dump_path = Path(dump_path) if dump_path else None
+        self.port = port
+        self.site = None
+        self._loop = task.LoopingCall(self.update)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(
+            crawler,
+            settings.getfloat('METRICS_INTERVAL', 10),
+            settings.get('METRICS_DUMP_PATH'),
+            settings.getint('METRICS_PORT'),
+        )
+        crawler.signals.connect(
+            extension.spider_opened, signal=signals.spider_opened
+        )
+        crawler.signals.connect(
+            extension.spider_closed, signal=signals.spider_closed
+        )
+        crawler.signals.connect(
+            extension.response_received, signal=signals.response_received
+        )
+        return extension
+
+    def spider_opened(self, spider):
+        self.site = spider.allowed_domains[0]
+        parse_seconds = {}
+
+        def parse_timer(method, seconds):
+            histogram = parse_seconds.get(method)
+            if histogram is None:
+                histogram = parse_seconds[method] = PARSE_SECONDS.labels(
+                    site=self.site, method=method
+                )
+            histogram.observe(seconds)
+
+        spider.parse_timer = parse_timer
+        self._loop.start(self.interval, now=False)
+        if self.port:
+            self._listen()
+
+    def spider_closed(self, spider):
+        if self._loop.running:
+            self._loop.stop()
+        self.update()
+        if self.port:
+            self._stop_listening()
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            kind = 'image' if request.meta.get('image_request') else 'page'
+            DOWNLOAD_SECONDS.labels(site=self.site, kind=kind).observe(latency)
+
+    def update(self):
+        self._sample_queues()
+        if self.dump_path is not None:
+            self._dump()
+
+    def _sample_queues(self):
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        scraper_slot = engine.scraper.slot
+        depths = {
+            'scheduler': len(engine.slot.scheduler),
+            'downloader': len(engine.downloader.active),
+            'spider': len(scraper_slot.active) if scraper_slot else 0,
+            'pipelines': scraper_slot.itemproc_size if scraper_slot else 0,
+        }
+        for stage, depth in depths.items():
+            QUEUE_DEPTH.labels(site=self.site, stage=stage).set(depth)
+
+    def _dump(self):
+        report = {
+            'site': self.site,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+            'metrics': REGISTRY.snapshot(site=self.site),
+        }
+        self.dump_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(str(self.dump_path) + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, self.dump_path)
+
+    def _listen(self):
+        cls = MetricsExtension
+        if cls._port is None:
+            root = Resource()
+            root.putChild(b'metrics', MetricsResource())
+            cls._port = reactor.listenTCP(
+                self.port, Site(root), interface='127.0.0.1'
+            )
+            logger.info(
+                'Serving metrics at http://127.0.0.1:%d/metrics', self.port
+            )
+        cls._port_users += 1
+
+    def _stop_listening(self):
+        cls = MetricsExtension
+        cls._port_users -= 1
+        if not cls._port_users and cls._port is not None:
+            cls._port.stopListening()
+            cls._port = None
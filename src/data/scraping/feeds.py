@@ -0,0 +1,140 @@
+"""
+This module contains helpers for post-processing of the feed files
+produced by the scraping spiders.
+"""
+import csv
+import os
+from pathlib import Path
+
+from itemadapter import ItemAdapter
+
+from src.data.scraping.items import INSERT_FIELDS
+
+
+def read_csv_keys(feed_path, key='sku'):
+    """
+    :return: set of str, the values of the key column of the CSV feed
+        (empty if the feed doesn't exist).
+    """
+    feed_path = Path(feed_path)
+    if not feed_path.exists():
+        return set()
+    with feed_path.open(newline='', encoding='utf-8') as f:
+        return {row[key] for row in csv.DictReader(f)}
+
+
+def merge_csv_feeds(feed_path, delta_path, key='sku', replaced_keys=()):
+    """
+    Merges the rows of the delta CSV feed into the main CSV feed:
+    all rows of the main feed, whose key value is present in the delta
+    feed, are replaced with the rows of the delta feed, the rest of the
+    delta rows are appended. The merged feed replaces the main one
+    atomically, and the delta feed is removed afterwards.
+
+    Only the delta feed (which is usually small) is held in memory,
+    the main feed is processed in a streaming way. Since all the rows
+    of a key are replaced at once, the function is suitable for feeds
+    with several rows per key as well.
+
+    :param feed_path: str
+        The path to the main CSV feed. It may not exist, in this
+        case the delta feed simply becomes the main one.
+    :param delta_path: str
+        The path to the CSV feed with new and updated rows.
+    :param key: str
+        The name of the column identifying the rows.
+    :param replaced_keys: set of str
+        The keys, which rows of the main feed are replaced even if they
+        aren't present in the delta feed (e.g. the SKUs of updated items
+        for the side tables of items, which may have no rows now).
+    :return: int, the number of merged delta rows.
+    """
+    feed_path, delta_path = Path(feed_path), Path(delta_path)
+    if not delta_path.exists():
+        return 0
+
+    with delta_path.open(newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        delta_fields = reader.fieldnames or []
+        delta_rows = list(reader)
+    if not delta_rows and not replaced_keys:
+        delta_path.unlink()
+        return 0
+    delta_keys = {row[key] for row in delta_rows} | set(replaced_keys)
+
+    merged_path = feed_path.with_name(feed_path.name + '.merging')
+    with merged_path.open('w', newline='', encoding='utf-8') as out:
+        if feed_path.exists():
+            with feed_path.open(newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                fields = list(reader.fieldnames or [])
+                # New fields may appear in the delta feed
+                fields += [x for x in delta_fields if x not in fields]
+                writer = csv.DictWriter(out, fields, restval='')
+                writer.writeheader()
+                for row in reader:
+                    if row[key] not in delta_keys:
+                        writer.writerow(row)
+        else:
+            writer = csv.DictWriter(out, delta_fields, restval='')
+            writer.writeheader()
+
+        writer.writerows(delta_rows)
+
+    os.replace(merged_path, feed_path)
+    delta_path.unlink()
+    return len(delta_rows)
+
+
+def remove_csv_rows(feed_path, keys, key='sku'):
+    """
+    Removes the rows with the given key values from the CSV feed. The
+    feed is processed in a streaming way and replaced atomically.
+    :param feed_path: str
+        The path to the CSV feed, nothing is done if it doesn't exist.
+    :param keys: set of str
+        The key values of the removed rows.
+    :param key: str
+        The name of the column identifying the rows.
+    :return: int, the number of removed rows.
+    """
+    feed_path = Path(feed_path)
+    if not keys or not feed_path.exists():
+        return 0
+
+    removed = 0
+    filtered_path = feed_path.with_name(feed_path.name + '.filtering')
+    with feed_path.open(newline='', encoding='utf-8') as f, \
+            filtered_path.open('w', newline='', encoding='utf-8') as out:
+        reader = csv.DictReader(f)
+        writer = csv.DictWriter(out, reader.fieldnames or [], restval='')
+        writer.writeheader()
+        for row in reader:
+            if row[key] in keys:
+                removed += 1
+            else:
+                writer.writerow(row)
+
+    os.replace(filtered_path, feed_path)
+    return removed
+
+
+class InsertsTableWriter:
+    """
+    Writes the gem inserts of items (see `Jewel.inserts`) to the CSV
+    side table, one row per insert: sku and INSERT_FIELDS.
+    """
+    fields = ['sku'] + INSERT_FIELDS
+
+    def __init__(self, file):
+        """
+        :param file: text file object opened with newline=''.
+        """
+        self.writer = csv.DictWriter(file, self.fields, restval='')
+        self.writer.writeheader()
+
+    def write_item(self, item):
+        adapter = ItemAdapter(item)
+        sku = adapter.get('sku')
+        for insert in adapter.get('inserts') or []:
+            self.writer.writerow({'sku': sku, **insert})
@@ -0,0 +1,183 @@
+"""
+The storage of `scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware`
+keeping all cached responses of the website in the single SQLite file.
+"""
+import logging
+import time
+import zlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from src.common.sqlite import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(SqliteStore):
+    """
+    Cached responses keyed by request fingerprints. Bodies are
+    compressed with zlib. The cache is bounded by the age of responses
+    and the total size of the stored bodies: the least recently used
+    responses are evicted first.
+    """
+    schema = '''
+        PRAGMA auto_vacuum = INCREMENTAL;
+        CREATE TABLE IF NOT EXISTS responses (
+            fingerprint TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            headers BLOB NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed_at
+            ON responses (accessed_at);
+    '''
+
+    def __init__(self, path, max_age=0, max_bytes=0):
+        """
+        :param path: str or Path
+            The path to the SQLite database file.
+        :param max_age: float
+            The age (in seconds) after which the responses expire,
+            0 means never.
+        :param max_bytes: int
+            The maximum total size of the stored (compressed) responses,
+            0 means unlimited.
+        """
+        super(ResponseCache, self).__init__(path)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.total_bytes = self.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+
+    def get(self, fingerprint):
+        """
+        :return: tuple (str, int, bytes, bytes) or None
+            Url, status, raw headers and body of the cached response,
+            or None if it isn't cached or expired.
+        """
+        row = self.execute(
+            'SELECT url, status, headers, body, stored_at FROM responses '
+            'WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, stored_at = row
+        now = time.time()
+        if 0 < self.max_age < now - stored_at:
+            return None
+
+        self.execute(
+            'UPDATE responses SET accessed_at = ? WHERE fingerprint = ?',
+            (now, fingerprint)
+        )
+        self.modified()
+        return url, status, headers, zlib.decompress(body)
+
+    def put(self, fingerprint, url, status, headers, body):
+        body = zlib.compress(body)
+        size = len(headers) + len(body)
+        old_size = self.execute(
+            'SELECT size FROM responses WHERE fingerprint = ?',
+            (fingerprint,)
+        ).fetchone()
+        now = time.time()
+        self.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (fingerprint, url, status, headers, body, size, now, now)
+        )
+        self.modified()
+        self.total_bytes += size - (old_size[0] if old_size else 0)
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the expired responses and then the least recently used
+        ones until the total size is 10% below the limit (so that the
+        eviction doesn't happen on every following insert).
+        :return: int, the number of evicted responses.
+        """
+        evicted = 0
+        if self.max_age:
+            evicted += self.execute(
+                'DELETE FROM responses WHERE stored_at < ?',
+                (time.time() - self.max_age,)
+            ).rowcount
+
+        self.total_bytes = self.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            excess = self.total_bytes - int(self.max_bytes * .9)
+            fingerprints = []
+            rows = self.execute(
+                'SELECT fingerprint, size FROM responses '
+                'ORDER BY accessed_at'
+            )
+            for fingerprint, size in rows:
+                if excess <= 0:
+                    break
+                fingerprints.append((fingerprint,))
+                excess -= size
+                self.total_bytes -= size
+            self.connection.executemany(
+                'DELETE FROM responses WHERE fingerprint = ?', fingerprints
+            )
+            evicted += len(fingerprints)
+
+        if evicted:
+            self.commit()
+            # Return the freed pages to the file system
+            self.execute('PRAGMA incremental_vacuum').fetchall()
+        return evicted
+
+
+class SqliteCacheStorage:
+    """
+    HTTP cache storage keeping the responses in `ResponseCache` at
+    HTTPCACHE_SQLITE_PATH. Supports the standard HTTPCACHE_EXPIRATION_SECS
+    setting and HTTPCACHE_MAX_BYTES limiting the size of the cache.
+
+    Works with both the dummy policy (all responses are served from the
+    cache) and the RFC2616 policy (stale responses are revalidated with
+    If-None-Match / If-Modified-Since requests).
+    """
+    def __init__(self, settings):
+        self.path = settings['HTTPCACHE_SQLITE_PATH']
+        self.max_age = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES')
+        self.cache = None
+
+    def open_spider(self, spider):
+        self.cache = ResponseCache(self.path, self.max_age, self.max_bytes)
+        evicted = self.cache.evict()
+        logger.debug(
+            'Using SQLite cache storage in %s (%d responses evicted)',
+            self.path, evicted, extra={'spider': spider}
+        )
+
+    def close_spider(self, spider):
+        self.cache.close()
+
+    def retrieve_response(self, spider, request):
+        cached = self.cache.get(request_fingerprint(request))
+        if cached is None:
+            return None
+        url, status, raw_headers, body = cached
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        response_cls = responsetypes.from_args(headers=headers, url=url)
+        return response_cls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        self.cache.put(
+            request_fingerprint(request), response.url, response.status,
+            headers_dict_to_raw(response.headers), response.body
+        )
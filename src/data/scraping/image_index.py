@@ -0,0 +1,65 @@
+import time
+
+from src.common.sqlite import SqliteStore
+
+
+class ImageIndex(SqliteStore):
+    """
+    On-disk index of the content-addressed images store, kept in the
+    single SQLite file: image URL -> content hash -> stored file path,
+    together with the HTTP validators (ETag and Last-Modified headers)
+    of the image response and the time it was fetched at.
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS images (
+            url TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            path TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS images_checksum ON images (checksum);
+    '''
+
+    def get(self, url):
+        """
+        :param url: str
+            Image URL.
+        :return: dict or None
+            The index record of the image (with keys equal to the
+            columns of the table) or None if the image is unknown.
+        """
+        cursor = self.execute('SELECT * FROM images WHERE url = ?', (url,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([x[0] for x in cursor.description], row))
+
+    def put(self, url, checksum, path, etag=None, last_modified=None):
+        self.execute(
+            'INSERT OR REPLACE INTO images '
+            '(url, checksum, path, etag, last_modified, fetched_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (url, checksum, path, etag, last_modified, time.time())
+        )
+        self.modified()
+
+    def touch(self, url):
+        """Marks the image as fetched now (e.g. after revalidation)."""
+        self.execute(
+            'UPDATE images SET fetched_at = ? WHERE url = ?',
+            (time.time(), url)
+        )
+        self.modified()
+
+    def count_urls(self):
+        return self.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def iter_files(self):
+        """
+        Iterates over the distinct stored images.
+        :return:
+            Nothing, but (checksum, path) pairs are generated.
+        """
+        yield from self.execute('SELECT DISTINCT checksum, path FROM images')
@@ -0,0 +1,129 @@
+"""
+This module contains the persistent crawl state used by the incremental
+scraping mode: for each product page it keeps the sitemap `lastmod`
+value, the hash of the page content, the SKU of its item and the
+time the page was last listed in the sitemap, so that unchanged pages
+can be skipped on the next crawl, and the items of the delisted pages
+can be removed from the feed.
+"""
+from datetime import datetime, timezone
+
+from src.common.sqlite import SqliteStore
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class CrawlState(SqliteStore):
+    """
+    Per-site crawl state of the product pages, stored in a single
+    SQLite file: URL -> (sitemap lastmod, content hash, item SKU,
+    last-seen time).
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            lastmod TEXT,
+            content_hash TEXT,
+            last_seen TEXT,
+            sku TEXT
+        );
+    '''
+
+    def __init__(self, path, commit_every=1000):
+        super(CrawlState, self).__init__(path, commit_every)
+        columns = {row[1] for row in self.execute('PRAGMA table_info(pages)')}
+        if 'sku' not in columns:
+            # The state created before the SKUs were stored, they are
+            # filled in as the pages are parsed again
+            self.execute('ALTER TABLE pages ADD COLUMN sku TEXT')
+
+    def get(self, url):
+        """
+        :param url: str
+            Product page URL.
+        :return: tuple (str, str) or None
+            Stored sitemap lastmod and content hash of the page,
+            or None if the page has never been crawled.
+        """
+        return self.execute(
+            'SELECT lastmod, content_hash FROM pages WHERE url = ?', (url,)
+        ).fetchone()
+
+    def is_unchanged(self, url, lastmod):
+        """
+        Checks whether the page has been already crawled and its sitemap
+        lastmod value is the same as the one stored. Pages without
+        lastmod in the sitemap are always considered as changed, since
+        nothing can be said about them without downloading.
+        """
+        if not lastmod:
+            return False
+        state = self.get(url)
+        return state is not None and state[0] == lastmod and bool(state[1])
+
+    def has_content(self, url, content_hash):
+        """Checks whether the page content hash is the same as stored."""
+        state = self.get(url)
+        return state is not None and state[1] == content_hash
+
+    def update(self, url, lastmod=None, content_hash=None, sku=None):
+        """
+        Stores the page state and marks the page as seen now. None
+        values of lastmod, content_hash and sku keep the stored ones.
+        """
+        self.execute(
+            'INSERT INTO pages (url, lastmod, content_hash, last_seen, sku) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET '
+            'lastmod = COALESCE(excluded.lastmod, lastmod), '
+            'content_hash = COALESCE(excluded.content_hash, content_hash), '
+            'last_seen = excluded.last_seen, '
+            'sku = COALESCE(excluded.sku, sku)',
+            (url, lastmod, content_hash, utc_now(), sku)
+        )
+        self.modified()
+
+    def touch(self, url):
+        """Marks the already known page as seen now."""
+        self.execute(
+            'UPDATE pages SET last_seen = ? WHERE url = ?', (utc_now(), url)
+        )
+        self.modified()
+
+    def count_seen(self, since):
+        """:return: int, the number of pages seen since the time."""
+        return self.execute(
+            'SELECT COUNT(*) FROM pages WHERE last_seen >= ?', (since,)
+        ).fetchone()[0]
+
+    def get_unseen_skus(self, since):
+        """
+        Returns the SKUs of the items of the pages not seen since the
+        time (i.e. delisted from the sitemap), except for the ones of
+        the pages still listed (e.g. if the page URL has changed).
+        :param since: str
+            ISO time in UTC (see `utc_now`).
+        :return: set of str
+        """
+        rows = self.execute(
+            'SELECT DISTINCT sku FROM pages '
+            'WHERE last_seen < ? AND sku IS NOT NULL AND sku NOT IN ('
+            '    SELECT sku FROM pages '
+            '    WHERE last_seen >= ? AND sku IS NOT NULL'
+            ')', (since, since)
+        )
+        return {sku for sku, in rows}
+
+    def remove_unseen(self, since):
+        """
+        Removes the pages not seen since the time, so that they are
+        crawled as new ones if they are listed again.
+        :return: int, the number of removed pages.
+        """
+        count = self.execute(
+            'DELETE FROM pages WHERE last_seen < ?', (since,)
+        ).rowcount
+        self.modified(count)
+        return count
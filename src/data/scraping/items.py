@@ -1,45 +1,79 @@
 from scrapy.item import Item, Field
 
+# The fields of gem insert records (see `Jewel.inserts`)
+INSERT_FIELDS = [
+    'gem_type', 'count', 'carat_weight', 'color', 'cut', 'shape', 'quality'
+]
+
 
 class Jewel(Item):
-    """Container class for storing jewel properties."""
+    """
+    Container class for storing jewel properties.
+
+    The `dtype` metadata of the fields describes their types in the
+    columnar feeds (see `exporters.ParquetItemExporter`): 'string'
+    (the default one), 'float32', 'int32', 'category' (strings from
+    the finite set of values) or 'list' (list of strings).
+
+    The fields with `feed=False` metadata aren't exported to the feeds
+    (see `get_feed_fields`), they are stored in the side tables.
+    """
     # Free-form, but sufficiently short jewel title (string)
     title = Field()
     # Optional free-form jewel textual description (string)
     description = Field()
     # Jewel category, e.x. ring, pendant, bracelet etc.
     # (string from the finite set of values)
-    category = Field()
+    category = Field(dtype='category')
     # Jewel brand or manufacturer name (string)
     brand = Field()
     # Jewel price (float)
-    price = Field()
+    price = Field(dtype='float32')
     # The currency of the jewel price, e.x. RUB, BYN
     # (string from the finite set of values)
-    currency = Field()
+    currency = Field(dtype='category')
     # Manufacturer's internal identifier of a jewel (string)
     sku = Field()
     # Jewel weight in grams (float number)
-    weight = Field()
+    weight = Field(dtype='float32')
     # Jewel width in millimeters (float number)
-    width = Field()
+    width = Field(dtype='float32')
     # Jewel height in millimeters (float number)
-    height = Field()
+    height = Field(dtype='float32')
     # Metal from which the jewel is made, e.x. gold, silver
     # (string from the finite set of values)
-    metal = Field()
+    metal = Field(dtype='category')
     # The probe of the jewel method, e.x. 375, 585, 925
     # (string from the finite set of values)
-    probe = Field()
+    probe = Field(dtype='category')
     # Target type of jewelry owner: women, men, children, etc.
     # (string from the finite set of values)
-    for_whom = Field()
+    for_whom = Field(dtype='category')
     # Textual description of gem inserts, if any (structured string)
     gems = Field()
+    # Gem inserts, if any, as the list of dicts with keys: gem_type,
+    # count, carat_weight, color, cut, shape, quality (see INSERT_FIELDS).
+    # Exported to the separate inserts.csv table keyed by SKU
+    inserts = Field(feed=False)
+    # The total weight of gem inserts in carats, if known (float number)
+    gems_carats = Field(dtype='float32')
+    # The number of distinct types of gem inserts (integer number)
+    gem_types = Field(dtype='int32')
     # Name of the collection the jewel belongs to, if any (string)
     collection = Field()
     # The list of jewel image urls (list of strings)
-    image_urls = Field()
+    image_urls = Field(dtype='list')
     # Auto-filled filed containing a local paths to jewel images
     # (list of strings)
-    images = Field()
+    images = Field(dtype='list')
+
+
+def get_feed_fields(item_cls=Jewel):
+    """
+    Returns the names of item fields exported to the feeds (all but
+    the ones with `feed=False` metadata) in the order of the csv feed.
+    """
+    return [
+        name for name, meta in item_cls.fields.items()
+        if meta.get('feed', True)
+    ]
@@ -0,0 +1,297 @@
+"""
+End-to-end crawl load test against the local mock retailer (see
+`mock_site`). The mock server and the crawl are run in separate
+processes, so that the CPU time and the memory of the crawl process
+are measured alone. The crawl uses the same settings and pipelines as
+`scrape` does, its output is written to a temporary folder.
+"""
+import click
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from scrapy.crawler import Crawler, CrawlerProcess
+
+# The peak memory is measured with resource on Unix and with pywin32
+# on Windows, it isn't measured on other platforms
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import win32api
+    import win32process
+except ImportError:
+    win32api, win32process = None, None
+
+from src.data.scraping.main import (
+    get_process_settings, get_site_settings, load_spider
+)
+from src.data.scraping.mock_site import COUNTERS, run_mock_server
+
+# The mock catalog imitates this website
+SITE = 'sokolov.ru'
+# The time to wait for the mock server to start, in seconds
+SERVER_START_TIMEOUT = 30
+# The interval of checking whether the crawl process is alive, seconds
+CRAWL_POLL_INTERVAL = 1
+
+
+def _get_peak_rss_mb():
+    """
+    :return: float or None, the peak resident memory of the current
+        process in megabytes, None if it can't be measured.
+    """
+    if resource is not None:
+        # Kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if win32process is not None:
+        memory = win32process.GetProcessMemoryInfo(
+            win32api.GetCurrentProcess()
+        )
+        return memory['PeakWorkingSetSize'] / 1024 ** 2
+    return None
+
+
+def _run_crawl(base_url, output_path, settings, result):
+    """
+    Runs the crawl of the mock catalog in the working folder
+    `output_path` and puts its statistics to the `result` queue,
+    the target of the crawl process of `loadtest`.
+    """
+    os.chdir(output_path)
+    process = CrawlerProcess(settings=get_process_settings(
+        settings['log_level'], fast_parse=settings['fast_parse'],
+        tensor_sizes=settings['tensor_sizes']
+    ))
+    crawler_settings = process.settings.copy()
+    crawler_settings.setdict(get_site_settings(SITE))
+    crawler_settings.setdict(dict(
+        CONCURRENT_REQUESTS=settings['concurrency'],
+        CONCURRENT_REQUESTS_PER_DOMAIN=settings['concurrency'],
+        AUTOTHROTTLE_ENABLED=settings['autothrottle'],
+    ), priority='cmdline')
+    crawler = Crawler(load_spider(SITE), crawler_settings)
+    process.crawl(
+        crawler, sitemap_urls=[f'{base_url}/sitemap.xml'],
+        allowed_domains=['127.0.0.1']
+    )
+
+    started = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - started
+    stats = crawler.stats.get_stats()
+    result.put({
+        'seconds': elapsed,
+        'cpu_seconds': time.process_time(),
+        'peak_rss_mb': _get_peak_rss_mb(),
+        'stats': {
+            key: value for key, value in stats.items()
+            if isinstance(value, (int, float))
+        },
+    })
+
+
+def loadtest(products=2000, concurrency=16, latency=.05, error_rate=.01,
+             images=50, image_size=400, page_padding=64 * 1024,
+             autothrottle=False, fast_parse=False, tensor_sizes=(),
+             log_level='WARNING', output_path=None):
+    """
+    Crawls the mock retailer catalog with the sokolov.ru spider and
+    measures the crawl throughput and the resources of the crawl.
+    :param products: int
+        The number of products of the mock catalog.
+    :param concurrency: int
+        The number of concurrent requests of the crawler.
+    :param latency: float
+        The mean response delay of the mock server in seconds.
+    :param error_rate: float
+        The share of failed (503) responses of the mock server.
+    :param images: int
+        The number of distinct images of the mock catalog.
+    :param image_size: int
+        The width and the height of the images.
+    :param page_padding: int
+        The approximate size of the padding of product pages in bytes.
+    :param autothrottle: bool
+        Whether to enable the AutoThrottle extension.
+    :param fast_parse: bool
+        Whether to use the single-pass parser.
+    :param tensor_sizes: list of int
+        The sizes of the image tensors to make (see `scrape`).
+    :param log_level: str
+        Minimum level of messages of the crawl log.
+    :param output_path: str or None
+        The folder of the crawl output (it's kept), a temporary one
+        by default (it's removed).
+    :return: dict, the report of the load test, the peak memory is
+        None if it can't be measured on the platform (neither Unix nor
+        Windows with pywin32).
+    """
+    context = multiprocessing.get_context('spawn')
+    counters = context.Array('q', len(COUNTERS))
+    port = context.Value('i', 0)
+    ready = context.Event()
+    catalog_options = dict(
+        products=products, images=images, image_size=image_size,
+        page_padding=page_padding
+    )
+    server = context.Process(
+        target=run_mock_server, daemon=True,
+        args=(catalog_options, latency, error_rate, counters, port, ready)
+    )
+    server.start()
+
+    remove_output = output_path is None
+    if remove_output:
+        output_path = tempfile.mkdtemp(prefix='jsim-loadtest-')
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+    try:
+        if not ready.wait(SERVER_START_TIMEOUT):
+            raise RuntimeError('The mock server has not started')
+        result = context.Queue()
+        crawl = context.Process(target=_run_crawl, args=(
+            f'http://127.0.0.1:{port.value}', output_path, dict(
+                concurrency=concurrency, autothrottle=autothrottle,
+                fast_parse=fast_parse, tensor_sizes=list(tensor_sizes),
+                log_level=log_level
+            ), result
+        ))
+        crawl.start()
+        report = None
+        while report is None:
+            # The report is put before the crawl process exits
+            exited = crawl.exitcode is not None
+            try:
+                report = result.get(timeout=CRAWL_POLL_INTERVAL)
+            except queue.Empty:
+                if exited:
+                    raise RuntimeError(
+                        f'The crawl process has exited with code '
+                        f'{crawl.exitcode} without the report'
+                    )
+        crawl.join()
+    finally:
+        server.terminate()
+        server.join()
+        if remove_output:
+            shutil.rmtree(output_path, ignore_errors=True)
+
+    served = dict(zip(COUNTERS, counters[:]))
+    stats = report.pop('stats')
+    items = stats.get('item_scraped_count', 0)
+    seconds = report['seconds']
+    report.update({
+        'products': products,
+        'concurrency': concurrency,
+        'latency': latency,
+        'error_rate': error_rate,
+        'items': items,
+        'items_per_second': items / seconds,
+        'image_mb_per_second': served['image_bytes'] / 2 ** 20 / seconds,
+        'cpu_ms_per_item': 1000 * report['cpu_seconds'] / max(items, 1),
+        'requests': stats.get('downloader/request_count', 0),
+        'retries': stats.get('retry/count', 0),
+        'served': served,
+    })
+    return report
+
+
+@click.command('loadtest')
+@click.option(
+    '--products', type=int, default=2000, show_default=True,
+    help='The number of products of the mock catalog.'
+)
+@click.option(
+    '--concurrency', type=int, default=16, show_default=True,
+    help='The number of concurrent requests of the crawler.'
+)
+@click.option(
+    '--latency', type=float, default=.05, show_default=True,
+    help='The mean response delay of the mock server in seconds.'
+)
+@click.option(
+    '--error-rate', type=click.FloatRange(0, 1), default=.01,
+    show_default=True,
+    help='The share of failed (503) responses of the mock server.'
+)
+@click.option(
+    '--images', type=int, default=50, show_default=True,
+    help='The number of distinct images of the mock catalog.'
+)
+@click.option(
+    '--image-size', type=int, default=400, show_default=True,
+    help='The width and the height of the mock images.'
+)
+@click.option(
+    '--page-padding', type=int, default=64 * 1024, show_default=True,
+    help='The size of the padding markup of product pages in bytes.'
+)
+@click.option(
+    '--autothrottle/--no-autothrottle', default=False, show_default=True,
+    help='Whether to enable the AutoThrottle extension.'
+)
+@click.option(
+    '--fast-parse', is_flag=True,
+    help='Use the single-pass parser.'
+)
+@click.option(
+    '--tensor-size', 'tensor_sizes', type=int, multiple=True,
+    help='The size of image tensors to make (may be specified several '
+         'times).'
+)
+@click.option(
+    '--log-level', '-l', default='WARNING', show_default=True,
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']),
+    help='Minimum level of messages of the crawl log.'
+)
+@click.option(
+    '--output', '-o', 'output_path', type=click.Path(file_okay=False),
+    default=None,
+    help='The folder to keep the crawl output in [default: a temporary '
+         'one, which is removed]'
+)
+@click.option(
+    '--report', 'report_path', type=click.Path(dir_okay=False),
+    default=None, help='The json file to write the report to.'
+)
+def loadtest_cli(products, concurrency, latency, error_rate, images,
+                 image_size, page_padding, autothrottle, fast_parse,
+                 tensor_sizes, log_level, output_path, report_path):
+    """
+    Crawl the local mock retailer with the sokolov.ru spider and report
+    the throughput (items/s, image MB/s), CPU time per item and peak
+    memory of the crawl.
+    """
+    try:
+        report = loadtest(
+            products, concurrency, latency, error_rate, images, image_size,
+            page_padding, autothrottle, fast_parse, tensor_sizes, log_level,
+            output_path
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        f'items:        {report["items"]} of {products} in '
+        f'{report["seconds"]:.1f} s\n'
+        f'throughput:   {report["items_per_second"]:.1f} items/s, '
+        f'{report["image_mb_per_second"]:.2f} image MB/s\n'
+        f'requests:     {report["requests"]} '
+        f'({report["served"]["errors"]} failed, '
+        f'{report["retries"]} retried)\n'
+        f'cpu:          {report["cpu_ms_per_item"]:.2f} ms/item '
+        f'({report["cpu_seconds"]:.1f} s)\n'
+        f'peak memory:  ' + (
+            f'{report["peak_rss_mb"]:.0f} MB'
+            if report['peak_rss_mb'] is not None else 'not measured'
+        )
+    )
+    if report_path:
+        Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
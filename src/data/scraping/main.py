@@ -1,60 +1,630 @@
 import click
+import contextlib
 import logging
-from scrapy.crawler import CrawlerProcess
+import multiprocessing
+import os
+import shutil
+import traceback
+from pathlib import Path
+
+from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.http import HtmlResponse
 from scrapy.settings import Settings
 from scrapy.spiderloader import SpiderLoader
 
+from src.common.paths import get_image_tensors_path
+from src.data.history import record_history
 from src.data.scraping import config
+from src.data.scraping.archive import HtmlArchive
+from src.data.scraping.checkpoint import FeedCheckpoint
+from src.data.scraping.exporters import (
+    JsonListCsvItemExporter, ParquetItemExporter, csv_to_parquet
+)
+from src.data.scraping.feeds import (
+    InsertsTableWriter, merge_csv_feeds, read_csv_keys, remove_csv_rows
+)
+from src.data.scraping.incremental import CrawlState, utc_now
+from src.data.scraping.items import Jewel
+from src.data.scraping.pipelines import SimpleImagesPipeline
+
+logger = logging.getLogger(__name__)
+
+
+def _get_spider_loader_settings():
+    return Settings(dict(
+        SPIDER_MODULES=config.SPIDER_MODULES,
+        SPIDER_LOADER_WARN_ONLY=config.SPIDER_LOADER_WARN_ONLY,
+    ))
+
+
+def load_spider(site):
+    """
+    Returns the scraping spider class corresponding to the website.
+    The matching between the website domain and its scraping spider is
+    based on the scraper's name attribute. Dots in the domain are
+    replaced with underscores and the suffix `_spider` is added to the
+    result to obtain the scraper's name.
+    :param site: str
+        The shortest domain name of the website.
+    :return: BaseJewelSpider subclass
+    """
+    spider_name = site.replace('.', '_') + '_spider'
+    return SpiderLoader(_get_spider_loader_settings()).load(spider_name)
+
+
+def list_sites():
+    """
+    Returns the domain names of all websites, for which the scraping
+    spiders are implemented in `config.SPIDER_MODULES`.
+    :return: list of str
+    """
+    spider_loader = SpiderLoader(_get_spider_loader_settings())
+    return sorted(
+        spider_loader.load(name).allowed_domains[0]
+        for name in spider_loader.list()
+    )
+
+
+def get_job_paths(site):
+    """
+    :return: tuple (str, str)
+        The paths to the feed checkpoint and the Scrapy job directory
+        of the resumable crawl of the website (see `get_job_path`).
+    """
+    job_path = config.get_job_path(site)
+    return (
+        str(Path(job_path, 'checkpoint.sqlite')),
+        str(Path(job_path, 'scheduler')),
+    )
+
+
+def get_site_settings(site, incremental=False, archive_html=False,
+                      parquet=False, resume=False):
+    """
+    Returns the crawler settings specific to the website: the paths
+    of the feeds, gem inserts table, images, image tensors, crawl
+    state, HTML archive, HTTP cache, metrics dump and crawl job.
+    See `scrape` for the description of parameters.
+    :return: dict
+    """
+    feed_path, images_path = config.get_scraping_output_paths(site)
+    inserts_path = config.get_inserts_path(site)
+    crawl_state_path = None
+    if incremental:
+        # New and updated items are collected in separate feeds,
+        # which are merged into the main ones after the crawl
+        crawl_state_path = config.get_crawl_state_path(site)
+        feed_path = config.get_delta_feed_path(feed_path)
+        inserts_path = config.get_delta_feed_path(inserts_path)
+
+    feeds = {feed_path: config.CSV_FEED_PARAMS}
+    if parquet and not incremental:
+        feeds[config.get_parquet_feed_path(site)] = config.PARQUET_FEED_PARAMS
+
+    checkpoint_path, jobdir = None, None
+    if resume:
+        # The items are committed to the checkpoint, the feeds and
+        # the inserts table are exported from it after the crawl
+        checkpoint_path, jobdir = get_job_paths(site)
+        feeds, inserts_path = {}, None
+
+    return dict(
+        FEEDS=feeds,
+        FEED_CHECKPOINT_PATH=checkpoint_path,
+        JOBDIR=jobdir,
+        INSERTS_FEED_PATH=inserts_path,
+        IMAGES_STORE=images_path,
+        IMAGE_TENSORS_PATH=get_image_tensors_path(site),
+        CRAWL_STATE_PATH=crawl_state_path,
+        HTML_ARCHIVE_PATH=(
+            config.get_html_archive_path(site) if archive_html else None
+        ),
+        HTTPCACHE_SQLITE_PATH=config.get_http_cache_path(site),
+        METRICS_DUMP_PATH=config.get_metrics_dump_path(site),
+    )
+
+
+def export_feeds(items, feed_path, inserts_path, parquet_path=None):
+    """
+    Writes the items to the csv feed, the gem inserts table and,
+    optionally, the Parquet feed. The files are written to temporary
+    ones first, which replace the previous files atomically.
+    :param items: iterable of Jewel
+    :param feed_path: str
+    :param inserts_path: str
+    :param parquet_path: str or None
+    :return: int, the number of exported items.
+    """
+    outputs = [(feed_path, JsonListCsvItemExporter)]
+    if parquet_path:
+        outputs.append((parquet_path, ParquetItemExporter))
+
+    count = 0
+    exporters = []
+    with contextlib.ExitStack() as stack:
+        for path, exporter_cls in outputs:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            file = stack.enter_context(open(path + '.tmp', 'wb'))
+            exporters.append(
+                exporter_cls(file, fields_to_export=config.FEED_FIELDS)
+            )
+            exporters[-1].start_exporting()
+        inserts_writer = InsertsTableWriter(stack.enter_context(
+            open(inserts_path + '.tmp', 'w', newline='', encoding='utf-8')
+        ))
+
+        for item in items:
+            for exporter in exporters:
+                exporter.export_item(item)
+            inserts_writer.write_item(item)
+            count += 1
+
+        for exporter in exporters:
+            exporter.finish_exporting()
+
+    for path in [x for x, _ in outputs] + [inserts_path]:
+        os.replace(path + '.tmp', path)
+    return count
+
+
+def prepare_job(site):
+    """
+    Prepares the crawl job of the website to be resumed. If the
+    previous crawl has crashed, its persisted scheduler state may be
+    inconsistent, so it's discarded: the sitemaps are read again, and
+    only the pages of the items committed to the checkpoint are skipped.
+    """
+    checkpoint_path, jobdir = get_job_paths(site)
+    if not Path(checkpoint_path).exists():
+        return
+    with FeedCheckpoint(checkpoint_path) as checkpoint:
+        state, count = checkpoint.get_state(), checkpoint.count()
+    if state == FeedCheckpoint.RUNNING:
+        logger.warning(
+            'The previous crawl of %s has crashed, resuming it from '
+            '%d committed items', site, count
+        )
+        shutil.rmtree(jobdir, ignore_errors=True)
+    else:
+        logger.info(
+            'Resuming the crawl of %s from %d committed items', site, count
+        )
+
+
+def export_checkpoint(site, incremental=False, parquet=False):
+    """
+    Exports the items of the finished resumable crawl from the
+    checkpoint to the feeds (the delta ones in the incremental mode)
+    and removes the crawl job.
+    See `scrape` for the description of parameters.
+    :return: int, the number of exported items.
+    """
+    checkpoint_path, _ = get_job_paths(site)
+    settings = get_site_settings(site, incremental, parquet=parquet)
+    # Format -> path of the feed
+    feed_paths = {
+        params['format']: path
+        for path, params in settings['FEEDS'].items()
+    }
+    with FeedCheckpoint(checkpoint_path) as checkpoint:
+        count = export_feeds(
+            checkpoint.iter_items(Jewel), feed_paths['csv'],
+            settings['INSERTS_FEED_PATH'], feed_paths.get('parquet')
+        )
+    shutil.rmtree(config.get_job_path(site))
+    return count
+
+
+def remove_delisted_items(site, since):
+    """
+    Removes the items of the product pages not listed in the sitemaps
+    since the time from the feed and the gem inserts table, and the
+    pages from the crawl state (see `CrawlState.get_unseen_skus`).
+    :param since: str
+        ISO time in UTC (see `utc_now`), when the finished incremental
+        crawl has started.
+    :return: int or None
+        The number of removed items, None if nothing has been checked,
+        since no pages have been seen at all (e.g. the sitemap hasn't
+        been downloaded).
+    """
+    with CrawlState(config.get_crawl_state_path(site)) as crawl_state:
+        if not crawl_state.count_seen(since):
+            return None
+        skus = crawl_state.get_unseen_skus(since)
+        feed_path, _ = config.get_scraping_output_paths(site)
+        # The state is updated last, so that the items are removed
+        # on the next crawl if this one is interrupted
+        count = remove_csv_rows(feed_path, skus)
+        remove_csv_rows(config.get_inserts_path(site), skus)
+        crawl_state.remove_unseen(since)
+    return count
 
 
-def scrape(site, log_level='INFO', logstats_interval=10):
+def finalize_site_output(site, incremental=False, parquet=False,
+                         resume=False, finished=True, history=False,
+                         started=None):
     """
-    Runs the scraping spider corresponding to the website that walks
-    through the website, parses the product data and saves it to the
-    data/raw/ folder. The output data is a folder (named as the website
+    Post-processes the website feeds after the crawl is finished.
+    See `scrape` for the description of parameters.
+    :param finished: bool
+        Whether the crawl has finished (not stopped before).
+    :param started: str or None
+        ISO time in UTC (see `utc_now`), when the crawl has started.
+        If specified, the items delisted from the sitemaps are removed
+        after the finished incremental crawl.
+    """
+    # Whether the feed has all the catalog items: only the full crawl
+    # or the incremental one removing the delisted items
+    complete = not incremental
+    if resume:
+        if not finished:
+            logger.info(
+                'The crawl of %s is stopped, run it with the resume '
+                'option to continue', site
+            )
+            return
+        export_checkpoint(site, incremental, parquet)
+
+    if incremental:
+        feed_path, _ = config.get_scraping_output_paths(site)
+        delta_path = config.get_delta_feed_path(feed_path)
+        # The inserts of all updated items are replaced, including the
+        # ones of items without inserts now
+        updated_skus = read_csv_keys(delta_path)
+        merge_csv_feeds(feed_path, delta_path)
+        inserts_path = config.get_inserts_path(site)
+        merge_csv_feeds(
+            inserts_path, config.get_delta_feed_path(inserts_path),
+            replaced_keys=updated_skus
+        )
+        if finished and started is not None:
+            removed = remove_delisted_items(site, started)
+            if removed is None:
+                logger.warning(
+                    'No product pages of %s have been listed in the '
+                    'sitemaps, delisted items are kept', site
+                )
+            else:
+                logger.info('Removed %d delisted items of %s', removed, site)
+                complete = True
+        if parquet:
+            # The merged feed is converted entirely, since Parquet
+            # files can't be updated in place
+            csv_to_parquet(feed_path, config.get_parquet_feed_path(site))
+
+    if history:
+        count = record_history(site, complete=finished and complete)
+        logger.info('Recorded %d changes of %s to the history', count, site)
+
+
+def get_process_settings(log_level='INFO', logstats_interval=10,
+                         fast_parse=False, tensor_sizes=(), metrics=False,
+                         metrics_port=None, cache=False,
+                         cache_revalidate=False):
+    """
+    Returns the settings of the crawler process shared by the spiders
+    of all websites.
+    See `scrape` for the description of parameters.
+    :return: dict
+    """
+    return dict(
+        FEED_EXPORTERS=config.FEED_EXPORTERS,
+        ITEM_PIPELINES=config.ITEM_PIPELINES,
+        SPIDER_MIDDLEWARES=config.SPIDER_MIDDLEWARES,
+        EXTENSIONS=config.EXTENSIONS,
+        FAST_PARSE=fast_parse,
+        IMAGE_TENSOR_SIZES=list(tensor_sizes),
+        METRICS_ENABLED=metrics or metrics_port is not None,
+        METRICS_INTERVAL=logstats_interval,
+        METRICS_PORT=metrics_port,
+        HTTPCACHE_ENABLED=cache or cache_revalidate,
+        HTTPCACHE_STORAGE=config.HTTPCACHE_STORAGE,
+        HTTPCACHE_POLICY=(
+            config.HTTPCACHE_RFC2616_POLICY if cache_revalidate
+            else config.HTTPCACHE_DUMMY_POLICY
+        ),
+        # Keep uncacheable responses too, they may be revalidated later
+        HTTPCACHE_ALWAYS_STORE=True,
+        HTTPCACHE_EXPIRATION_SECS=config.HTTPCACHE_EXPIRATION_SECS,
+        HTTPCACHE_MAX_BYTES=config.HTTPCACHE_MAX_BYTES,
+        LOG_LEVEL=log_level,
+        LOGSTATS_INTERVAL=logstats_interval,
+    )
+
+
+def scrape(sites, log_level='INFO', logstats_interval=10, incremental=False,
+           archive_html=False, fast_parse=False, parquet=False,
+           concurrency=None, autothrottle=None, tensor_sizes=(),
+           metrics=False, metrics_port=None, cache=False,
+           cache_revalidate=False, resume=False, history=False):
+    """
+    Runs the scraping spiders corresponding to the websites that walk
+    through the websites, parse the product data and save it to the
+    data/raw/ folder. All spiders are run concurrently in the single
+    process, each one with its own downloader and output paths, so the
+    total crawl time is roughly the time of the slowest website.
+
+    The output data of each website is a folder (named as the website
     domain, in which dots are replaced with underscores) that contains:
     - a csv feed file (items.csv) describing all products
       with their attributes;
-    - an images/ sub-folder containing images of products.
+    - a csv table (inserts.csv) describing gem inserts of products,
+      one row per insert type;
+    - an images/ sub-folder containing images of products;
+    - optionally, a columnar Parquet feed file (items.parquet) with
+      the same data as the csv feed.
+
+    Optionally, the images are also resized and packed into the image
+    tensor stores in data/processed/<site_py>/images/ (see
+    `ImageTensorStore`).
 
     The matching between the website domain and its scraping spider is
     based on the scraper's name attribute. Dots in the domain are
     replaced with underscores and the suffix `_spider` is added to the
     result to obtain the scraper's name.
 
-    :param site: str
-        The shortest domain name of the website to scrape data from.
+    :param sites: list of str
+        The shortest domain names of the websites to scrape data from,
+        the repeated ones are crawled once.
     :param log_level: str [DEBUG|INFO|WARNING|ERROR|CRITICAL]
         Minimum level of messages to be written to the log.
     :param logstats_interval: float
         The interval (in seconds) between each logging printout of
         the scraping spider statistics.
-    :return: nothing
+    :param incremental: bool
+        Whether to skip the product pages that haven't changed since
+        the previous crawl (according to the crawl state stored in
+        data/raw/<site_py>/crawl_state.sqlite) and merge the new and
+        updated items into the existing csv feed instead of
+        overwriting it. The items of the pages delisted from the
+        sitemaps are removed from the feed after the finished crawl.
+    :param archive_html: bool
+        Whether to store the raw product pages in the HTML archive
+        (data/raw/<site_py>/html/), so that the feed can be regenerated
+        later without network access by the `reparse` function.
+    :param fast_parse: bool
+        Whether to use the single-pass parser of the website spider
+        (if it's implemented) instead of the default one.
+    :param parquet: bool
+        Whether to write the Parquet feed alongside the csv one.
+    :param concurrency: int or None
+        The maximum number of concurrent requests to each website.
+        If None, the spider's or Scrapy's default value is used.
+    :param autothrottle: bool or None
+        Whether to adjust the crawling speed dynamically based on the
+        website load. If None, the spider's or Scrapy's default value
+        is used.
+    :param tensor_sizes: list of int
+        The sizes of square image tensors to pack the images into.
+        If empty, the image tensors are not created.
+    :param metrics: bool
+        Whether to record the crawl metrics (latency histograms of
+        downloads, parsing and item pipelines, queue depths) and dump
+        them to reports/metrics/<site_py>.json periodically.
+    :param metrics_port: int or None
+        The port of the local endpoint serving the metrics in the
+        Prometheus text format (http://127.0.0.1:<port>/metrics).
+        If None, the metrics aren't served.
+    :param cache: bool
+        Whether to cache the responses of the website (except images)
+        in data/raw/<site_py>/httpcache.sqlite and serve the cached
+        responses instead of requesting them again.
+    :param cache_revalidate: bool
+        Whether to revalidate the cached responses according to their
+        caching headers (with If-None-Match / If-Modified-Since
+        requests) instead of serving them unconditionally.
+    :param resume: bool
+        Whether to make the crawl resumable: the scheduler queue and
+        the seen requests are persisted in data/raw/<site_py>/job/
+        (see `get_job_path`), and the scraped items are committed to
+        the checkpoint there in batches. If the crawl crashes or is
+        stopped, it continues from the checkpoint on the next run with
+        this option without duplicating items. The feeds are exported
+        from the checkpoint atomically when the crawl finishes.
+    :param history: bool
+        Whether to append the changes of the catalog to the history
+        (data/history/, see `record_history`) after the crawl.
+    :return: dict
+        The crawl statistics of each website: site -> stats dict.
     """
-    scrapy_settings = Settings(dict(
-        SPIDER_MODULES=config.SPIDER_MODULES,
-        SPIDER_LOADER_WARN_ONLY=config.SPIDER_LOADER_WARN_ONLY,
+    process = CrawlerProcess(settings=get_process_settings(
+        log_level, logstats_interval, fast_parse, tensor_sizes, metrics,
+        metrics_port, cache, cache_revalidate
     ))
-    spider_name = site.replace('.', '_') + '_spider'
-    spider = SpiderLoader(scrapy_settings).load(spider_name)
 
-    feed_path, images_path = config.get_scraping_output_paths(site)
+    # Limits explicitly requested for the run take precedence
+    # over the spider-specific custom settings
+    limits = {}
+    if concurrency is not None:
+        limits['CONCURRENT_REQUESTS_PER_DOMAIN'] = concurrency
+    if autothrottle is not None:
+        limits['AUTOTHROTTLE_ENABLED'] = autothrottle
 
-    process = CrawlerProcess(settings=dict(
-        FEEDS={feed_path: config.CSV_FEED_PARAMS},
-        ITEM_PIPELINES=config.ITEM_PIPELINES,
-        IMAGES_STORE=images_path,
-        LOG_LEVEL=log_level,
-        LOGSTATS_INTERVAL=logstats_interval,
-    ))
-    process.crawl(spider)
+    crawlers = {}
+    # The crawlers of the same website would share all the output
+    for site in dict.fromkeys(sites):
+        if resume:
+            prepare_job(site)
+        settings = process.settings.copy()
+        settings.setdict(get_site_settings(
+            site, incremental, archive_html, parquet, resume
+        ))
+        settings.setdict(limits, priority='cmdline')
+        crawlers[site] = Crawler(load_spider(site), settings)
+        process.crawl(crawlers[site])
+    # The pages not seen since the start are delisted from the sitemaps
+    started = utc_now()
     process.start()
 
+    stats = {}
+    for site, crawler in crawlers.items():
+        finished = crawler.stats.get_value('finish_reason') == 'finished'
+        finalize_site_output(
+            site, incremental, parquet, resume, finished, history, started
+        )
+        stats[site] = crawler.stats.get_stats()
+    return stats
+
+
+def format_stats_summary(stats):
+    """
+    Formats the combined summary of the crawl statistics returned by
+    the `scrape` function.
+    :return: str
+    """
+    columns = [
+        ('items', 'item_scraped_count'),
+        ('pages', 'response_received_count'),
+        ('images', 'file_count'),
+        ('errors', 'log_count/ERROR'),
+    ]
+    header = f'{"site":<24}' + ''.join(f'{x:>10}' for x, _ in columns)
+    lines = [header + f'{"seconds":>10}']
+
+    totals = {name: 0 for name, _ in columns}
+    # The websites are crawled concurrently, the longest crawl is the
+    # time of the entire run
+    total_elapsed = 0
+    for site, site_stats in stats.items():
+        line = f'{site:<24}'
+        for name, key in columns:
+            value = site_stats.get(key, 0)
+            totals[name] += value
+            line += f'{value:>10}'
+        elapsed = (
+            site_stats['finish_time'] - site_stats['start_time']
+        ).total_seconds() if 'finish_time' in site_stats else 0
+        total_elapsed = max(total_elapsed, elapsed)
+        lines.append(line + f'{elapsed:>10.0f}')
+
+    lines.append(
+        f'{"total":<24}' + ''.join(f'{totals[x]:>10}' for x, _ in columns)
+        + f'{total_elapsed:>10.0f}'
+    )
+    return '\n'.join(lines)
+
+
+def _reparse_page(task):
+    """
+    Parses a single archived page in a worker process.
+    :param task: tuple
+        Parser class, the path to the HTML archive, page url,
+        content hash and encoding.
+    :return: tuple (Jewel, str)
+        The parsed jewel instance (or None in case of failure)
+        and the error traceback (or None in case of success).
+    """
+    parser_cls, archive_path, url, content_hash, encoding = task
+    try:
+        body = HtmlArchive(archive_path).read(content_hash)
+        response = HtmlResponse(url=url, body=body, encoding=encoding)
+        return parser_cls(response).parse(), None
+    except Exception:
+        return None, f'{url}: {traceback.format_exc()}'
+
+
+def reparse(site, processes=None, chunksize=16, fast_parse=False,
+            parquet=False):
+    """
+    Regenerates the items of the csv feed (and the gem inserts table)
+    of the website from the HTML archive of product pages collected by
+    the `scrape` function (with enabled `archive_html` option). The
+    archived pages are parsed by the parser of the website spider in a
+    pool of worker processes, no network requests are made. The
+    `images` field is filled with the paths of images already present
+    in the images folder.
+
+    The re-parsed items are merged into the existing feed like the
+    ones of the incremental crawl, since the archive may not cover the
+    whole catalog: the items crawled before the archiving was enabled
+    are kept unchanged, and the archived pages of the items missing
+    from the feed (e.g. delisted products) are skipped. If there is no
+    feed yet, all the archived pages are exported.
+
+    :param site: str
+        The shortest domain name of the website.
+    :param processes: int
+        The number of worker processes, defaults to the number of CPUs.
+    :param chunksize: int
+        The number of pages sent to a worker process at once.
+    :param fast_parse: bool
+        Whether to use the single-pass parser of the website spider
+        (if it's implemented) instead of the default one.
+    :param parquet: bool
+        Whether to write the Parquet feed alongside the csv one.
+    :return: dict
+        The numbers of parsed and failed pages, skipped pages of the
+        items missing from the feed and the items of the feed kept
+        unchanged, since their pages aren't archived.
+    """
+    parser_cls = load_spider(site).get_parser_cls(fast_parse)
+    feed_path, images_path = config.get_scraping_output_paths(site)
+    inserts_path = config.get_inserts_path(site)
+    archive = HtmlArchive(config.get_html_archive_path(site))
+    images_pipeline = SimpleImagesPipeline(images_path)
+    feed_skus = read_csv_keys(feed_path)
+
+    tasks = (
+        (parser_cls, str(archive.path), url, content_hash, encoding)
+        for url, content_hash, encoding in archive.iter_entries()
+    )
+    stats = dict(parsed=0, failed=0, skipped=0, kept=0)
+    reparsed_skus = set()
+
+    def iter_items(pool):
+        for item, error in pool.imap(_reparse_page, tasks, chunksize):
+            if item is None:
+                logger.error('Failed to parse archived page %s', error)
+                stats['failed'] += 1
+                continue
+            if feed_skus and item.get('sku') not in feed_skus:
+                stats['skipped'] += 1
+                continue
+            reparsed_skus.add(item.get('sku'))
+            item['images'] = images_pipeline.stored_paths(
+                item.get('image_urls', [])
+            )
+            yield item
+
+    delta_path = config.get_delta_feed_path(feed_path)
+    inserts_delta_path = config.get_delta_feed_path(inserts_path)
+    with multiprocessing.Pool(processes) as pool:
+        stats['parsed'] = export_feeds(
+            iter_items(pool), delta_path, inserts_delta_path
+        )
+    merge_csv_feeds(feed_path, delta_path)
+    # The inserts of all re-parsed items are replaced, including the
+    # ones of items without inserts now
+    merge_csv_feeds(
+        inserts_path, inserts_delta_path, replaced_keys=reparsed_skus
+    )
+    if parquet:
+        csv_to_parquet(feed_path, config.get_parquet_feed_path(site))
+
+    stats['kept'] = len(feed_skus - reparsed_skus)
+    if stats['kept']:
+        logger.warning(
+            '%d items of the %s feed have no archived pages, they are '
+            'kept unchanged', stats['kept'], site
+        )
+    if stats['skipped']:
+        logger.warning(
+            '%d archived pages of %s are skipped, their items are missing '
+            'from the feed', stats['skipped'], site
+        )
+    return stats
+
 
 @click.command('scrape')
 @click.option(
-    '--site', '-s', type=str, required=True,
-    help='The domain name of the website to scrape data from'
+    '--site', '-s', 'sites', type=str, multiple=True,
+    help='The domain name of the website to scrape data from '
+         '(may be specified several times)'
+)
+@click.option(
+    '--all', 'all_sites', is_flag=True,
+    help='Scrape all websites, for which the spiders are implemented'
 )
 @click.option(
     '--log-level',
@@ -68,10 +638,115 @@ def scrape(site, log_level='INFO', logstats_interval=10):
     help='The interval (in seconds) between each logging printout '
          'of the scraping spider statistics.'
 )
-def scrape_cli(site, log_level, logstats_interval):
+@click.option(
+    '--incremental', is_flag=True,
+    help='Skip the product pages that have not changed since the previous '
+         'crawl, merge new items into the existing feed and remove the '
+         'delisted ones from it.'
+)
+@click.option(
+    '--archive-html', is_flag=True,
+    help='Store the raw product pages in the HTML archive for offline '
+         're-parsing.'
+)
+@click.option(
+    '--fast-parse', is_flag=True,
+    help='Use the single-pass parser of the website, if implemented.'
+)
+@click.option(
+    '--parquet', is_flag=True,
+    help='Write the columnar Parquet feed alongside the csv one.'
+)
+@click.option(
+    '--concurrency', type=int, default=None,
+    help='The maximum number of concurrent requests to each website'
+)
+@click.option(
+    '--autothrottle/--no-autothrottle', default=None,
+    help='Adjust the crawling speed dynamically based on the website load'
+)
+@click.option(
+    '--tensor-size', 'tensor_sizes', type=int, multiple=True,
+    help='Pack images into memory-mapped tensors of the given size '
+         '(may be specified several times)'
+)
+@click.option(
+    '--metrics', is_flag=True,
+    help='Record the crawl metrics and dump them to reports/metrics/ '
+         'every logstats interval.'
+)
+@click.option(
+    '--metrics-port', type=int, default=None,
+    help='Serve the crawl metrics in the Prometheus text format at '
+         'http://127.0.0.1:<port>/metrics (implies --metrics)'
+)
+@click.option(
+    '--cache', is_flag=True,
+    help='Serve the responses from the local HTTP cache of the website, '
+         'if cached.'
+)
+@click.option(
+    '--cache-revalidate', is_flag=True,
+    help='Revalidate the cached responses with conditional requests '
+         'according to their caching headers (implies --cache).'
+)
+@click.option(
+    '--resume', is_flag=True,
+    help='Persist the crawl progress in data/raw/<site_py>/job/ and '
+         'continue the crashed or stopped crawl from it.'
+)
+@click.option(
+    '--history', is_flag=True,
+    help='Append the changes of the catalog to the history in '
+         'data/history/ after the crawl.'
+)
+def scrape_cli(sites, all_sites, log_level, logstats_interval, incremental,
+               archive_html, fast_parse, parquet, concurrency, autothrottle,
+               tensor_sizes, metrics, metrics_port, cache, cache_revalidate,
+               resume, history):
+    """
+    Run scraping spiders corresponding to the websites that walk
+    through the websites concurrently, parse the product data, and
+    save it to the data/raw/ folder.
+    """
+    if all_sites:
+        sites = list_sites()
+    if not sites:
+        raise click.UsageError('Specify --site at least once or --all')
+
+    stats = scrape(
+        sites, log_level, logstats_interval, incremental, archive_html,
+        fast_parse, parquet, concurrency, autothrottle, tensor_sizes,
+        metrics, metrics_port, cache, cache_revalidate, resume, history
+    )
+    click.echo(format_stats_summary(stats))
+
+
+@click.command('reparse')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to re-parse data of'
+)
+@click.option(
+    '--processes', '-p', type=int, default=None,
+    help='The number of worker processes [default: number of CPUs]'
+)
+@click.option(
+    '--fast-parse', is_flag=True,
+    help='Use the single-pass parser of the website, if implemented.'
+)
+@click.option(
+    '--parquet', is_flag=True,
+    help='Write the columnar Parquet feed alongside the csv one.'
+)
+def reparse_cli(site, processes, fast_parse, parquet):
     """
-    Run scraping spider corresponding to the website that walks
-    through the website, parses the product data, and saves it to
-    the data/raw/ folder.
+    Regenerate the items of the csv feed of the website from the
+    archived product pages without network access.
     """
-    scrape(site, log_level, logstats_interval)
+    stats = reparse(site, processes, fast_parse=fast_parse, parquet=parquet)
+    click.echo(
+        f'Parsed {stats["parsed"]} pages, failed {stats["failed"]} pages, '
+        f'skipped {stats["skipped"]} pages of the items missing from the '
+        f'feed, kept {stats["kept"]} items without archived pages'
+    )
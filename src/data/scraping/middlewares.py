@@ -0,0 +1,95 @@
+import time
+
+from itemadapter import is_item
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
+from src.data.scraping.archive import HtmlArchive
+from src.data.scraping.extensions import ITEM_PIPELINE_SECONDS
+
+
+class HtmlArchiveMiddleware:
+    """
+    Spider middleware storing the raw product pages in the HTML archive
+    (see `HtmlArchive`) before they are passed to the spider. Only the
+    responses handled by the `parse_product` spider callback are stored.
+
+    The middleware is enabled by the HTML_ARCHIVE_PATH setting
+    containing the path to the archive folder.
+    """
+    def __init__(self, archive, stats):
+        self.archive = archive
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        archive_path = crawler.settings.get('HTML_ARCHIVE_PATH')
+        if not archive_path:
+            raise NotConfigured
+
+        middleware = cls(HtmlArchive(archive_path), crawler.stats)
+        crawler.signals.connect(
+            middleware.spider_closed, signal=signals.spider_closed
+        )
+        return middleware
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+    def process_spider_input(self, response, spider):
+        callback = response.request.callback
+        product_callback = getattr(spider, 'parse_product', None)
+        if (
+            isinstance(response, HtmlResponse)
+            and response.status == 200
+            and callback is not None
+            and callback == product_callback
+        ):
+            self.archive.add(response.url, response.body, response.encoding)
+            self.stats.inc_value('html_archive/pages', spider=spider)
+
+
+class ItemTimingMiddleware:
+    """
+    Spider middleware measuring the time items spend in the item
+    pipelines: items are stamped when they leave the spider, and the
+    time is recorded into the `ITEM_PIPELINE_SECONDS` histogram when
+    they are scraped, dropped or failed. Should be the last middleware
+    processing the spider output (i.e. have the lowest order).
+
+    The middleware is enabled by the METRICS_ENABLED setting.
+    """
+    def __init__(self):
+        self.histogram = None
+        self._stamps = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls()
+        crawler.signals.connect(
+            middleware.spider_opened, signal=signals.spider_opened
+        )
+        for signal in (
+            signals.item_scraped, signals.item_dropped, signals.item_error
+        ):
+            crawler.signals.connect(middleware.item_finished, signal=signal)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.histogram = ITEM_PIPELINE_SECONDS.labels(
+            site=spider.allowed_domains[0]
+        )
+
+    def item_finished(self, item):
+        start = self._stamps.pop(id(item), None)
+        if start is not None:
+            self.histogram.observe(time.perf_counter() - start)
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            if is_item(x):
+                self._stamps[id(x)] = time.perf_counter()
+            yield x
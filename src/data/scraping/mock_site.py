@@ -0,0 +1,294 @@
+"""
+Local mock of the sokolov.ru retailer for offline load tests (see
+`loadtest`). The catalog of synthetic products is generated
+deterministically from their numbers, the pages are rendered with the
+markup expected by `SokolovRuJewelParser` and served with a sitemap
+index and product images by the threaded HTTP server. Each response
+is delayed by the random latency, and a share of responses fails with
+503 Service Unavailable (which is retried by the crawler).
+"""
+import io
+import random
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+CATEGORIES = ['Кольца', 'Серьги', 'Подвески', 'Браслеты', 'Цепи']
+METALS = [('Золото', ['375', '585', '750']), ('Серебро', ['925'])]
+FOR_WHOM = ['Для женщин', 'Для мужчин', 'Для детей']
+GEMS = ['Фианит', 'Бриллиант', 'Топаз', 'Сапфир', 'Изумруд']
+GEM_COLORS = ['Белый', 'Голубой', 'Зеленый', 'Красный']
+# The markup repeated to pad the pages to the size of the real ones
+# (navigation menus, scripts etc.)
+PADDING_BLOCK = (
+    '<li class="menu-item"><a href="/jewelry-catalog/">Каталог</a>'
+    '<span class="badge">new</span></li>\n'
+)
+# Counters of the served responses
+COUNTERS = ['sitemaps', 'pages', 'images', 'errors', 'bytes', 'image_bytes']
+
+_SITEMAP_PATTERN = re.compile(r'^/sitemap(?:-(\d+))?\.xml$')
+_PRODUCT_PATTERN = re.compile(r'^/jewelry-catalog/product/(\d+)/$')
+_IMAGE_PATTERN = re.compile(r'^/img/(\d+)\.jpg$')
+
+
+class MockCatalog:
+    """
+    Renders the sitemaps, product pages and images of the synthetic
+    catalog of `products` items.
+    """
+    def __init__(self, products, images=50, image_size=400,
+                 page_padding=64 * 1024, sitemap_size=1000, seed=0):
+        """
+        :param products: int
+            The number of products.
+        :param images: int
+            The number of distinct images, the image of a product is
+            served by its own URL, but the contents repeat.
+        :param image_size: int
+            The width and the height of the images.
+        :param page_padding: int
+            The approximate number of padding bytes of a product page.
+        :param sitemap_size: int
+            The maximum number of product URLs per sitemap.
+        :param seed: int
+        """
+        self.products = products
+        self.sitemap_size = sitemap_size
+        self.seed = seed
+        self.padding = PADDING_BLOCK * (page_padding // len(PADDING_BLOCK))
+        self.images = [
+            self._render_image(i, image_size) for i in range(images)
+        ]
+
+    def _render_image(self, number, size):
+        rng = np.random.default_rng([self.seed, number])
+        # Smooth random colors compress like product photos do
+        colors = rng.integers(0, 256, (4, 4, 3), dtype=np.uint8)
+        image = Image.fromarray(colors).resize((size, size), Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        return buffer.getvalue()
+
+    def render_sitemap(self, base_url, number=None):
+        """
+        :param number: int or None
+            The number of the sitemap, None for the sitemap index.
+        :return: str or None, None if there's no such sitemap.
+        """
+        xmlns = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+        sitemaps = -(-self.products // self.sitemap_size)
+        if number is None:
+            entries = ''.join(
+                f'<sitemap><loc>{base_url}/sitemap-{i}.xml</loc></sitemap>'
+                for i in range(sitemaps)
+            )
+            return (
+                f'<?xml version="1.0" encoding="UTF-8"?>'
+                f'<sitemapindex xmlns="{xmlns}">{entries}</sitemapindex>'
+            )
+        if number >= sitemaps:
+            return None
+        start = number * self.sitemap_size
+        end = min(start + self.sitemap_size, self.products)
+        entries = ''.join(
+            f'<url><loc>{base_url}/jewelry-catalog/product/{i}/</loc>'
+            f'<lastmod>2021-01-{1 + i % 28:02d}</lastmod></url>'
+            for i in range(start, end)
+        )
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<urlset xmlns="{xmlns}">{entries}</urlset>'
+        )
+
+    @staticmethod
+    def _render_prop(name, value, name_in_span=True):
+        name = f'<span>{name}</span>' if name_in_span else name
+        return (
+            f'<div class="props-list"><div class="name">{name}</div>'
+            f'<div class="val"><span>{value}</span></div></div>'
+        )
+
+    def render_product(self, base_url, number):
+        """:return: str or None, None if there's no such product."""
+        if number >= self.products:
+            return None
+        rng = random.Random(self.seed * 1000003 + number)
+        metal, probes = rng.choice(METALS)
+        # 20 products per collection on average
+        collection = rng.randrange(self.products // 20 + 1)
+        props = [
+            ('Коллекция', f'Коллекция {collection}'),
+            ('Бренд', 'SOKOLOV'),
+            ('Для кого', rng.choice(FOR_WHOM)),
+            ('Тип металла', metal),
+            ('Проба', rng.choice(probes)),
+            ('Примерный вес', f'{rng.uniform(.5, 15):.2f} г'),
+            ('Ширина', f'{rng.uniform(1, 20):.1f} мм'),
+            ('Высота', f'{rng.uniform(1, 30):.1f} мм'),
+        ]
+        inserts = []
+        for _ in range(rng.randrange(4)):
+            insert = [
+                ('Тип', rng.choice(GEMS)),
+                ('Количество', rng.randrange(1, 30)),
+                ('Цвет', rng.choice(GEM_COLORS)),
+                ('Огранка', '17/17'),
+                ('Цветность', rng.randrange(1, 8)),
+                ('Чистота', rng.randrange(1, 8)),
+                ('Вес', f'{rng.uniform(.01, 1):.3f} карат'),
+            ]
+            inserts.append(
+                '<div class="props-insert__item">' + ''.join(
+                    self._render_prop(name, value, name_in_span=False)
+                    for name, value in insert
+                ) + '</div>'
+            )
+
+        category = rng.choice(CATEGORIES)
+        price = rng.uniform(500, 150000)
+        return f'''<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8">
+<title>{category} {number}</title></head><body>
+<ul class="menu">{self.padding}</ul>
+<div class="product" data-list-id="product"
+ data-detail-category="Украшения/{category}/Все">
+<h1 data-detail-name="{category} SOKOLOV {number}">{category}</h1>
+<img itemprop="contentUrl" data-src="{base_url}/img/{number}.jpg">
+<meta itemprop="sku" content="{number:08d}">
+<meta itemprop="price" content="{price:.0f}">
+<meta itemprop="priceCurrency" content="RUB">
+</div>
+<div id="props">
+<div class="tab-header-item"><p>О бренде</p></div>
+<div class="tab-header-item"><p>Об украшении</p></div>
+<div class="props wrap-text-show"><p>SOKOLOV</p></div>
+<div class="props wrap-text-show"><p>Украшение {number} из металла
+{metal.lower()}</p></div>
+{''.join(self._render_prop(name, value) for name, value in props)}
+{''.join(inserts)}
+</div></body></html>'''
+
+    def get_image(self, number):
+        """:return: bytes or None, None if there's no such image."""
+        if number >= self.products:
+            return None
+        return self.images[number % len(self.images)]
+
+
+class MockRetailerHandler(BaseHTTPRequestHandler):
+    """
+    Serves the mock catalog of the server (see `MockRetailerServer`).
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency * random.uniform(.5, 1.5))
+        if random.random() < server.error_rate:
+            server.count('errors')
+            self._respond(HTTPStatus.SERVICE_UNAVAILABLE, b'', 'text/plain')
+            return
+
+        base_url = f'http://{self.headers.get("Host", "127.0.0.1")}'
+        path = self.path.split('?', 1)[0]
+        body, content_type, counter = None, None, None
+        match = _SITEMAP_PATTERN.match(path)
+        if match:
+            number = match.group(1)
+            body = server.catalog.render_sitemap(
+                base_url, int(number) if number is not None else None
+            )
+            content_type, counter = 'application/xml', 'sitemaps'
+        match = _PRODUCT_PATTERN.match(path)
+        if match:
+            body = server.catalog.render_product(
+                base_url, int(match.group(1))
+            )
+            content_type, counter = 'text/html; charset=utf-8', 'pages'
+        match = _IMAGE_PATTERN.match(path)
+        if match:
+            body = server.catalog.get_image(int(match.group(1)))
+            content_type, counter = 'image/jpeg', 'images'
+
+        if body is None:
+            self._respond(HTTPStatus.NOT_FOUND, b'', 'text/plain')
+            return
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        server.count(counter)
+        if counter == 'images':
+            server.count('image_bytes', len(body))
+        server.count('bytes', len(body))
+        self._respond(HTTPStatus.OK, body, content_type)
+
+    def _respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests aren't logged, they are counted
+        pass
+
+
+class MockRetailerServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server of the mock catalog, which counts the served
+    responses (see COUNTERS) in the `counters` array, which may be
+    shared with other processes (`multiprocessing.Array`).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, catalog, latency=.05, error_rate=.01,
+                 counters=None):
+        """
+        :param address: tuple (str, int)
+            The host and the port to listen to, the port 0 means any
+            free one.
+        :param catalog: MockCatalog
+        :param latency: float
+            The mean response delay in seconds.
+        :param error_rate: float
+            The share of failed responses.
+        :param counters: list of int or multiprocessing.Array or None
+        """
+        super(MockRetailerServer, self).__init__(address, MockRetailerHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counters = counters if counters is not None \
+            else [0] * len(COUNTERS)
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[COUNTERS.index(name)] += value
+
+
+def run_mock_server(catalog_options, latency, error_rate, counters, port,
+                    ready):
+    """
+    Runs the mock retailer server forever, the target of the server
+    process of `loadtest`.
+    :param catalog_options: dict
+        The parameters of `MockCatalog`.
+    :param port: multiprocessing.Value
+        The port the server listens to is stored there when it's ready.
+    :param ready: multiprocessing.Event
+        Is set when the server is ready.
+    """
+    server = MockRetailerServer(
+        ('127.0.0.1', 0), MockCatalog(**catalog_options), latency,
+        error_rate, counters
+    )
+    port.value = server.server_address[1]
+    ready.set()
+    server.serve_forever()
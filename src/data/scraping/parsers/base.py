@@ -1,3 +1,5 @@
+import time
+
 from itemloaders.processors import Identity, MapCompose, TakeFirst
 from scrapy.loader import ItemLoader
 from src.data.scraping.items import Jewel
@@ -17,6 +19,8 @@ class JewelLoader(ItemLoader):
     # behavior of the default output preprocessor is overridden for them
     image_urls_out = Identity()
     images_out = Identity()
+    # Gem inserts are the list of records as well
+    inserts_out = Identity()
 
     # Convert numeric attributes to float
     price_in = MapCompose(float)
@@ -25,6 +29,22 @@ class JewelLoader(ItemLoader):
     height_in = MapCompose(float)
 
 
+def summarize_inserts(inserts):
+    """
+    Computes the per-item aggregates of gem inserts.
+    :param inserts: list of dict
+        Gem insert records (see `Jewel.inserts`).
+    :return: tuple (float, int)
+        The total weight of inserts in carats (None if it's unknown for
+        all inserts) and the number of distinct gem types.
+    """
+    weights = [
+        x['carat_weight'] for x in inserts if x['carat_weight'] is not None
+    ]
+    carats = sum(weights) if weights else None
+    return carats, len({x['gem_type'] for x in inserts})
+
+
 class BaseJewelParser:
     """
     Abstract base parser class that should be implemented for every
@@ -43,9 +63,18 @@ class BaseJewelParser:
     """
     loader_cls = JewelLoader
 
-    def __init__(self, response):
+    def __init__(self, response, timer=None):
+        """
+        :param response: scrapy.http.HtmlResponse
+            The product page.
+        :param timer: callable or None
+            Optional callback `timer(method_name, seconds)` receiving
+            the time spent in each `parse_*` method and the loading of
+            the item (as `load_item`).
+        """
         self.response = response
         self.loader = self.loader_cls(response=response)
+        self.timer = timer
 
     def parse_image_urls(self):
         raise NotImplementedError
@@ -81,7 +110,43 @@ class BaseJewelParser:
         with the parsed data.
         :return: Jewel instance
         """
-        for field in self.loader.item.fields.keys():
-            getattr(self, f'parse_{field}', lambda: None)()
-
-        return self.loader.load_item()
+        for name in self.get_parse_methods():
+            self.run_parse_method(name)
+
+        if self.timer is None:
+            return self.loader.load_item()
+        start = time.perf_counter()
+        item = self.loader.load_item()
+        self.timer('load_item', time.perf_counter() - start)
+        return item
+
+    @classmethod
+    def get_parse_methods(cls):
+        """
+        Returns the names of the implemented `parse_*` methods of the
+        jewel fields, which are looked up once per parser class.
+        """
+        names = cls.__dict__.get('_parse_methods')
+        if names is None:
+            names = [
+                f'parse_{field}'
+                for field in cls.loader_cls.default_item_class.fields
+                if hasattr(cls, f'parse_{field}')
+            ]
+            cls._parse_methods = names
+        return names
+
+    def run_parse_method(self, name):
+        """
+        Runs the parser method by its name (if it's implemented) and
+        reports its time to the timer (if it's specified).
+        """
+        method = getattr(self, name, None)
+        if method is None:
+            return
+        if self.timer is None:
+            method()
+            return
+        start = time.perf_counter()
+        method()
+        self.timer(name, time.perf_counter() - start)
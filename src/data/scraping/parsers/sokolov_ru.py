@@ -1,6 +1,57 @@
-from src.data.scraping.parsers.base import BaseJewelParser, JewelLoader
+from src.data.scraping.parsers.base import (
+    BaseJewelParser, JewelLoader, summarize_inserts
+)
+from src.data.scraping.parsers.spec import (
+    Extract, Labels, ParserSpec, Records, Select, SpecJewelParser,
+    strip_units
+)
 from src.data.scraping.processors import TakeMax
 
+# Property label -> jewel field or (jewel field, value converter)
+PROPS_FIELDS = {
+    'Коллекция': 'collection',
+    'Бренд': 'brand',
+    'Для кого': 'for_whom',
+    'Тип металла': 'metal',
+    'Проба': 'probe',
+    'Примерный вес': ('weight', strip_units),
+    'Ширина': ('width', strip_units),
+    'Высота': ('height', strip_units),
+    # sokolov.ru jewels sometimes also possess length property, in such
+    # case height denotes the thickness and is usually smaller than the
+    # length. For our purposes, we need only two dimensions: width and
+    # height, and so we consider the length as height in such cases.
+    'Длина': ('height', strip_units),
+}
+# The name of the tab of the product description
+DESCRIPTION_TAB_NAME = 'Об украшении'
+# The category of the products without one
+DEFAULT_CATEGORY = 'Ювелирные украшения'
+
+
+def _parse_number(value, number_type):
+    """
+    Converts the first word of the value (e.g. "0.04 карат") to the
+    number of the given type, returns None if it isn't a number.
+    """
+    if not value:
+        return None
+    try:
+        return number_type(value.split()[0].replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _main_category(category):
+    """
+    Returns the main category of the granular one organized like
+    "category / sub-category / sub-sub-category / ...": the second
+    item, if present (since the first item represents too generic
+    name), otherwise the first one.
+    """
+    categories = category.split('/')
+    return categories[1] if len(categories) > 1 else categories[0]
+
 
 class SokolovRuJewelLoader(JewelLoader):
     """
@@ -27,8 +78,8 @@ class SokolovRuJewelParser(BaseJewelParser):
     """
     loader_cls = SokolovRuJewelLoader
 
-    def __init__(self, response):
-        super(SokolovRuJewelParser, self).__init__(response)
+    def __init__(self, response, timer=None):
+        super(SokolovRuJewelParser, self).__init__(response, timer)
         # Main product info
         self.product = response.css('.product[data-list-id=product]')
         # Specific product properties
@@ -60,11 +111,8 @@ class SokolovRuJewelParser(BaseJewelParser):
         """
         category = self.product.css(
             '.product[data-list-id=product]::attr(data-detail-category)'
-        ).get() or 'Ювелирные украшения'
-
-        categories = category.split('/')
-        category = categories[1] if len(categories) > 1 else categories[0]
-        self.loader.add_value('category', category)
+        ).get() or DEFAULT_CATEGORY
+        self.loader.add_value('category', _main_category(category))
 
     def parse_sku(self):
         """Get product id from the meta-tag with sku itemprop"""
@@ -95,9 +143,8 @@ class SokolovRuJewelParser(BaseJewelParser):
         tab_names = self.props.css('.tab-header-item > p::text').getall()
         tab_texts = self.props.css('.props.wrap-text-show > p::text').getall()
 
-        description_tab_name = 'Об украшении'
-        if description_tab_name in tab_names:
-            description = tab_texts[tab_names.index(description_tab_name)]
+        if DESCRIPTION_TAB_NAME in tab_names:
+            description = tab_texts[tab_names.index(DESCRIPTION_TAB_NAME)]
             self.loader.add_value('description', description)
 
     @staticmethod
@@ -131,32 +178,17 @@ class SokolovRuJewelParser(BaseJewelParser):
         iterating over the list. Since almost all properties are
         concentrated in a single list, it's more convenient to parse
         them in one method by iterating the entire list rather than
-        querying the list for each property separately.
+        querying the list for each property separately. The labels of
+        the properties are mapped to the jewel fields by PROPS_FIELDS.
         """
         for name, value in self._list_props(self.props):
-            if name == 'Коллекция':
-                self.loader.add_value('collection', value)
-            elif name == 'Бренд':
-                self.loader.add_value('brand', value)
-            elif name == 'Для кого':
-                self.loader.add_value('for_whom', value)
-            elif name == 'Тип металла':
-                self.loader.add_value('metal', value)
-            elif name == 'Проба':
-                self.loader.add_value('probe', value)
-            elif name == 'Примерный вес':
-                self.loader.add_value('weight', value.split()[0])
-            elif name == 'Ширина':
-                self.loader.add_value('width', value.split()[0])
-            elif name == 'Высота':
-                self.loader.add_value('height', value.split()[0])
-            elif name == 'Длина':
-                # sokolov.ru jewels sometimes also possess length property,
-                # in such case height denotes the thickness and is usually
-                # smaller than the length. For our purposes, we need only
-                # two dimensions: width and height, and so we consider the
-                # length as height in such cases.
-                self.loader.add_value('height', value.split()[0])
+            field = PROPS_FIELDS.get(name)
+            if field is None:
+                continue
+            if isinstance(field, tuple):
+                field, convert = field
+                value = convert(value)
+            self.loader.add_value(field, value)
 
     @staticmethod
     def _compose_gem_description(props):
@@ -188,20 +220,49 @@ class SokolovRuJewelParser(BaseJewelParser):
 
         return ', '.join(gem_desc_parts)
 
+    @staticmethod
+    def _make_insert(props):
+        """
+        Converts the properties of a single certain type of gem inserts
+        to the structured record (see `Jewel.inserts`).
+        :param props: dict
+            Dictionary of the form gem property name -> property value.
+        :return: dict
+        """
+        quality = None
+        if 'Цветность' in props and 'Чистота' in props:
+            quality = f'{props["Цветность"]}/{props["Чистота"]}'
+        return {
+            'gem_type': props.get('Тип'),
+            'count': _parse_number(props.get('Количество'), int),
+            # The value is like "0.04 карат"
+            'carat_weight': _parse_number(props.get('Вес'), float),
+            'color': props.get('Цвет'),
+            'cut': props.get('Огранка'),
+            'shape': props.get('Форма'),
+            'quality': quality,
+        }
+
     def parse_props_insert(self):
         """
         Iterates over the special type of list of properties - the list
         of gem inserts - and composes the comprehensive description of
         all jewel gems by concatenating the sentences-descriptions of
-        individual gems.
+        individual gems. The inserts are also stored as structured
+        records along with their aggregates.
         """
-        gem_descs = []
+        gem_descs, inserts = [], []
         for insert in self.props.css('.props-insert__item'):
             insert_props = dict(self._list_props(insert, name_in_span=False))
             gem_descs.append(self._compose_gem_description(insert_props))
+            inserts.append(self._make_insert(insert_props))
 
         if gem_descs:
             self.loader.add_value('gems', '. '.join(gem_descs))
+            self.loader.add_value('inserts', inserts)
+            carats, gem_types = summarize_inserts(inserts)
+            self.loader.add_value('gems_carats', carats)
+            self.loader.add_value('gem_types', gem_types)
 
     def parse_metal(self):
         # `metal` value is parsed in `parse_props_list`
@@ -220,6 +281,87 @@ class SokolovRuJewelParser(BaseJewelParser):
         Parses the detailed list of jewel properties (including gem
         inserts) first, and all the rest attributes then.
         """
-        self.parse_props_list()
-        self.parse_props_insert()
+        self.run_parse_method('parse_props_list')
+        self.run_parse_method('parse_props_insert')
         return super(SokolovRuJewelParser, self).parse()
+
+
+def _extract_description(tab_names, tab_texts):
+    """Returns the text of the product description tab, if any."""
+    if DESCRIPTION_TAB_NAME in tab_names:
+        return {
+            'description': tab_texts[tab_names.index(DESCRIPTION_TAB_NAME)]
+        }
+    return None
+
+
+def _extract_inserts(inserts):
+    """
+    Returns the description, the structured records and the aggregates
+    of gem inserts (see `SokolovRuJewelParser.parse_props_insert`).
+    """
+    if not inserts:
+        return None
+    records = [SokolovRuJewelParser._make_insert(x) for x in inserts]
+    carats, gem_types = summarize_inserts(records)
+    return {
+        'gems': '. '.join(
+            SokolovRuJewelParser._compose_gem_description(x) for x in inserts
+        ),
+        'inserts': records,
+        'gems_carats': carats,
+        'gem_types': gem_types,
+    }
+
+
+class SokolovRuFastJewelParser(SpecJewelParser):
+    """
+    Single-pass version of `SokolovRuJewelParser` producing exactly the
+    same jewel instances. It's defined by the declarative spec of the
+    same selectors and property labels, which is compiled to the plan
+    of XPath expressions evaluated directly over the lxml tree of the
+    page, and fills the jewel fields in one pass, applying the same
+    conversions as `SokolovRuJewelLoader` does.
+    """
+    spec = ParserSpec(
+        roots={
+            # Main product info
+            'product': '.product[data-list-id=product]',
+            # Specific product properties
+            'props': '#props',
+        },
+        labels=[Labels(
+            'props', '.props-list', '.name > span::text', '.val > span::text',
+            PROPS_FIELDS
+        )],
+        extracts=[
+            Extract(
+                _extract_inserts, 'props', inserts=Records(
+                    '.props-insert__item', '.props-list', '.name::text',
+                    '.val > span::text'
+                )
+            ),
+            Extract(
+                _extract_description, 'props',
+                tab_names='.tab-header-item > p::text',
+                tab_texts='.props.wrap-text-show > p::text'
+            ),
+        ],
+        fields={
+            'title': Select('h1::attr(data-detail-name)', 'product'),
+            'category': Select(
+                '.product[data-list-id=product]::attr(data-detail-category)',
+                'product', default=DEFAULT_CATEGORY, convert=_main_category
+            ),
+            'price': Select('meta[itemprop=price]::attr(content)', 'product'),
+            'currency': Select(
+                'meta[itemprop=priceCurrency]::attr(content)', 'product'
+            ),
+            'sku': Select('meta[itemprop=sku]::attr(content)', 'product'),
+            'image_urls': Select(
+                'img[itemprop=contentUrl]::attr(data-src)', 'product'
+            ),
+        },
+        # See `SokolovRuJewelLoader`
+        reducers={'height': max, 'inserts': list},
+    )
@@ -0,0 +1,376 @@
+"""
+Declarative specs of the website parsers. A spec describes where the
+jewel data is on the product page: the root blocks of the page, the
+CSS selectors of the fields, the tables mapping property labels to the
+fields (with the conversions of the values, e.g. stripping of units)
+and the custom extraction functions of the composite fields.
+
+The spec is compiled once per parser class into the extraction plan:
+the flat list of steps with precompiled XPath expressions and the dict
+dispatch of property labels, which `SpecJewelParser` runs over the
+lxml tree of the page. The item is constructed directly, the values
+are converted to the types of the item fields (see the `dtype` field
+metadata of `Jewel`) without the item loader.
+"""
+import time
+
+from lxml import etree
+from parsel.csstranslator import css2xpath
+
+from src.data.scraping.items import Jewel
+from src.data.scraping.parsers.base import BaseJewelParser
+
+# Converters of the values to the types of the item fields by `dtype`
+FIELD_TYPES = {'float32': float, 'int32': int}
+
+
+def compile_css(css):
+    """
+    Compiles CSS selector (with parsel's ::text and ::attr extensions)
+    to lxml XPath evaluator, exactly as parsel does it for HTML.
+    """
+    return etree.XPath(css2xpath(css), smart_strings=False)
+
+
+def strip_units(value):
+    """
+    Returns the first word of the value without units (e.g. "4.5" of
+    "4.5 мм"), None if the value is empty.
+    """
+    words = value.split()
+    return words[0] if words else None
+
+
+def take_first(values):
+    """Returns the first non-empty value like `TakeFirst` does."""
+    for value in values:
+        if value is not None and value != '':
+            return value
+    return None
+
+
+class Select:
+    """
+    The value of a field: the first text (or attribute) matched by the
+    CSS selector in the root block.
+    """
+    def __init__(self, css, root, default=None, convert=None):
+        """
+        :param css: str
+        :param root: str
+            The name of the root block (see `ParserSpec.roots`).
+        :param default: str or None
+            The value used if nothing (or an empty string) is matched.
+        :param convert: callable or None
+            The function converting the (default) value.
+        """
+        self.css = css
+        self.root = root
+        self.default = default
+        self.convert = convert
+
+    def compile(self, field):
+        xpath = compile_css(self.css)
+        root, default, convert = self.root, self.default, self.convert
+
+        def step(roots, add):
+            value = None
+            for element in roots[root]:
+                values = xpath(element)
+                if values:
+                    value = values[0]
+                    break
+            # An empty value is kept (and may fail the type conversion)
+            # like the item loader does, unless the default is given
+            if not value and default is not None:
+                value = default
+            if value is not None and convert is not None:
+                value = convert(value)
+            add(field, value)
+        return step
+
+
+class Labels:
+    """
+    The list of properties (rows with the name and the value) in the
+    root block, the values of the properties with the known labels
+    (names) are the values of the fields.
+    """
+    def __init__(self, root, row_css, name_css, value_css, fields):
+        """
+        :param root: str
+            The name of the root block (see `ParserSpec.roots`).
+        :param row_css: str
+            The selector of property rows in the root block.
+        :param name_css: str
+            The selector of the property name in the row.
+        :param value_css: str
+            The selector of the property value in the row.
+        :param fields: dict
+            Property label -> field name or tuple (field name, function
+            converting the value), e.g. `strip_units`.
+        """
+        self.root = root
+        self.row_css = row_css
+        self.name_css = name_css
+        self.value_css = value_css
+        self.fields = fields
+
+    def compile(self):
+        read_rows = _compile_rows(self.row_css, self.name_css, self.value_css)
+        dispatch = {
+            label: field if isinstance(field, tuple) else (field, None)
+            for label, field in self.fields.items()
+        }
+        root = self.root
+
+        def step(roots, add):
+            for element in roots[root]:
+                for name, value in read_rows(element):
+                    target = dispatch.get(name)
+                    if target is None:
+                        continue
+                    field, convert = target
+                    add(field, convert(value) if convert else value)
+        return step
+
+
+class Records:
+    """
+    The selection of records: the dict of the properties (name ->
+    value) of each block matched by the CSS selector, e.g. the list of
+    gem inserts. It's used as an argument of `Extract`.
+    """
+    def __init__(self, css, row_css, name_css, value_css):
+        """
+        :param css: str
+            The selector of the record blocks.
+        See `Labels` for the description of other parameters.
+        """
+        self.css = css
+        self.row_css = row_css
+        self.name_css = name_css
+        self.value_css = value_css
+
+    def compile(self):
+        xpath = compile_css(self.css)
+        read_rows = _compile_rows(self.row_css, self.name_css, self.value_css)
+
+        def select(element):
+            return [dict(read_rows(x)) for x in xpath(element)]
+        return select
+
+
+class Extract:
+    """
+    Custom extraction of composite fields: the function of the
+    selections from the root block, which returns the dict of field
+    values (or None).
+    """
+    def __init__(self, func, root, **selections):
+        """
+        :param func: callable
+            The function receiving the selections as keyword arguments.
+        :param root: str
+            The name of the root block (see `ParserSpec.roots`).
+        :param selections: str or Records
+            CSS selector (all matches are selected) or records.
+        """
+        self.func = func
+        self.root = root
+        self.selections = selections
+
+    def compile(self):
+        selectors = [
+            (name, x.compile() if isinstance(x, Records) else compile_css(x))
+            for name, x in self.selections.items()
+        ]
+        func, root = self.func, self.root
+
+        def step(roots, add):
+            kwargs = {
+                name: [
+                    value for element in roots[root]
+                    for value in select(element)
+                ] for name, select in selectors
+            }
+            for field, value in (func(**kwargs) or {}).items():
+                add(field, value)
+        return step
+
+
+def _compile_rows(row_css, name_css, value_css):
+    """
+    :return: callable
+        The function generating the stripped (name, value) pairs of the
+        property rows of the element.
+    """
+    row_xpath = compile_css(row_css)
+    name_xpath = compile_css(name_css)
+    value_xpath = compile_css(value_css)
+
+    def read_rows(element):
+        for row in row_xpath(element):
+            names = name_xpath(row)
+            values = value_xpath(row)
+            yield (
+                (names[0] if names else '').strip(),
+                (values[0] if values else '').strip(),
+            )
+    return read_rows
+
+
+class ParserSpec:
+    """
+    Declarative spec of the website parser (see the module docstring).
+    """
+    def __init__(self, roots, fields=None, labels=(), extracts=(),
+                 reducers=None, item_cls=Jewel):
+        """
+        :param roots: dict
+            Root block name -> CSS selector of the blocks in the page.
+        :param fields: dict or None
+            Field name -> `Select`.
+        :param labels: list of Labels
+        :param extracts: list of Extract
+        :param reducers: dict or None
+            Field name -> function choosing the output value of the
+            field from the list of its values, by default all values
+            are kept for the list fields (the ones with 'list' dtype)
+            and the first non-empty one is taken for the rest.
+        :param item_cls: scrapy.Item subclass
+        """
+        self.roots = roots
+        self.fields = fields or {}
+        self.labels = labels
+        self.extracts = extracts
+        self.reducers = reducers or {}
+        self.item_cls = item_cls
+
+    def compile(self):
+        """:return: ExtractionPlan"""
+        roots = [(name, compile_css(css)) for name, css in self.roots.items()]
+        # The values are added in the same order as the jewel loader of
+        # the spider collects them in
+        steps = [x.compile() for x in self.labels]
+        steps += [x.compile() for x in self.extracts]
+        steps += [x.compile(field) for field, x in self.fields.items()]
+
+        types, reducers = {}, {}
+        for field, meta in self.item_cls.fields.items():
+            dtype = meta.get('dtype')
+            if dtype in FIELD_TYPES:
+                types[field] = FIELD_TYPES[dtype]
+            reducers[field] = self.reducers.get(
+                field, list if dtype == 'list' else take_first
+            )
+        return ExtractionPlan(roots, steps, types, reducers, self.item_cls)
+
+
+class ExtractionPlan:
+    """
+    Compiled parser spec: runs the extraction steps over the page and
+    constructs the item of the extracted values.
+    """
+    def __init__(self, roots, steps, types, reducers, item_cls):
+        """
+        :param roots: list of tuples (str, lxml.etree.XPath)
+        :param steps: list of callable
+            The functions `step(roots, add)` extracting the values of
+            the root blocks (name -> list of elements) and adding them
+            with `add(field, value)`.
+        :param types: dict
+            Field name -> value type converter.
+        :param reducers: dict
+            Field name -> output value function of the list of values.
+        :param item_cls: scrapy.Item subclass
+        """
+        self.roots = roots
+        self.steps = steps
+        self.types = types
+        self.reducers = reducers
+        self.item_cls = item_cls
+
+    def extract(self, root):
+        """
+        Extracts the values of the fields from the page.
+        :param root: lxml.html.HtmlElement
+            The root element of the page.
+        :return: dict, field name -> list of values.
+        """
+        roots = {name: xpath(root) for name, xpath in self.roots}
+        values = {}
+        types = self.types
+
+        def add(field, value):
+            # None is skipped and lists are flattened like the item
+            # loader does it
+            if value is None:
+                return
+            convert = types.get(field)
+            if isinstance(value, list):
+                if convert is not None:
+                    value = [convert(x) for x in value]
+                values.setdefault(field, []).extend(value)
+            else:
+                if convert is not None:
+                    value = convert(value)
+                values.setdefault(field, []).append(value)
+
+        for step in self.steps:
+            step(roots, add)
+        return values
+
+    def make_item(self, values):
+        """
+        :param values: dict, field name -> list of values.
+        :return: scrapy.Item
+            The item, the fields without values are left unset.
+        """
+        item = self.item_cls()
+        for field, field_values in values.items():
+            value = self.reducers[field](field_values)
+            if value is not None:
+                item[field] = value
+        return item
+
+
+class SpecJewelParser(BaseJewelParser):
+    """
+    Base class of the parsers defined by the declarative spec (see the
+    module docstring), which is compiled once per parser class.
+    """
+    # ParserSpec of the website
+    spec = None
+
+    def __init__(self, response, timer=None):
+        # The jewel loader and parsel selectors are not needed here
+        self.response = response
+        self.timer = timer
+        self.values = None
+
+    @classmethod
+    def get_plan(cls):
+        """:return: ExtractionPlan, the compiled spec of the parser."""
+        plan = cls.__dict__.get('_plan')
+        if plan is None:
+            plan = cls.spec.compile()
+            cls._plan = plan
+        return plan
+
+    def _parse_values(self):
+        self.values = self.get_plan().extract(self.response.selector.root)
+
+    def parse(self):
+        """
+        Extracts the values of the fields by the plan of the parser and
+        returns the jewel instance.
+        """
+        self.run_parse_method('_parse_values')
+        plan = self.get_plan()
+        if self.timer is None:
+            return plan.make_item(self.values)
+        start = time.perf_counter()
+        item = plan.make_item(self.values)
+        self.timer('load_item', time.perf_counter() - start)
+        return item
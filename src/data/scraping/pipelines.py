@@ -1,15 +1,294 @@
+import hashlib
+import logging
+import time
+from pathlib import Path
+
 from itemadapter import ItemAdapter
+from PIL import Image
+from scrapy.exceptions import NotConfigured
 from scrapy.pipelines.images import ImagesPipeline
+from twisted.internet.threads import deferToThread
+
+from src.data.scraping.feeds import InsertsTableWriter
+from src.data.scraping.image_index import ImageIndex
+from src.data.tensors import ImageTensorStore, to_tensor
+
+logger = logging.getLogger(__name__)
 
 
 class SimpleImagesPipeline(ImagesPipeline):
     """
-    A slight modification of the default images pipeline in such way
-    that `images` item field is filled only with the local paths of
-    images and not with dicts of paths, urls, download statuses etc.
+    A modification of the default images pipeline in such way that:
+    - `images` item field is filled only with the local paths of
+      images and not with dicts of paths, urls, download statuses etc.;
+    - images are stored by the hash of their content (as downloaded)
+      rather than by the hash of their url: full/<hh>/<sha1>.jpg, so
+      the same image served from different urls (by different
+      products or websites) is converted and stored only once;
+    - the index of downloaded images (see `ImageIndex`) is kept in
+      the images store: images fetched within `IMAGES_EXPIRES` days
+      are not requested again, and stale ones are revalidated with
+      conditional requests (If-None-Match / If-Modified-Since).
+
+    Note that differently sized variants of the same picture have
+    different content, so they can't be deduplicated this way.
     """
+    INDEX_NAME = 'index.sqlite'
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super(SimpleImagesPipeline, self).__init__(
+            store_uri, download_func, settings
+        )
+        # Index records are committed often, so that a crashed crawl
+        # loses only a few of the downloaded images
+        self.index = ImageIndex(
+            Path(self.store.basedir, self.INDEX_NAME), commit_every=100
+        )
+
+    def close_spider(self, spider):
+        self.index.close()
+        stats = spider.crawler.stats
+        stored = stats.get_value('images/stored', 0)
+        deduplicated = stats.get_value('images/deduplicated', 0)
+        if stored + deduplicated:
+            stats.set_value(
+                'images/dedup_ratio', deduplicated / (stored + deduplicated)
+            )
+
+    def media_to_download(self, request, info, *, item=None):
+        record = self.index.get(request.url)
+        if record is None or not self._is_stored(record['path']):
+            return None  # download
+
+        age_days = (time.time() - record['fetched_at']) / 60 / 60 / 24
+        if age_days <= self.expires:
+            self.inc_stats(info.spider, 'uptodate')
+            return self._index_result(record, 'uptodate')
+
+        if record['etag']:
+            request.headers['If-None-Match'] = record['etag']
+        if record['last_modified']:
+            request.headers['If-Modified-Since'] = record['last_modified']
+        return None  # revalidate
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        if response.status == 304:
+            record = self.index.get(request.url)
+            if record is not None:
+                self.index.touch(request.url)
+                self.inc_stats(info.spider, 'not_modified')
+                return self._index_result(record, 'not_modified')
+
+        result = super(SimpleImagesPipeline, self).media_downloaded(
+            response, request, info, item=item
+        )
+        self.index.put(
+            request.url, result['checksum'], result['path'],
+            etag=self._get_header(response, 'ETag'),
+            last_modified=self._get_header(response, 'Last-Modified')
+        )
+        return result
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        if response is None:
+            # The content is unknown before the download
+            return super(SimpleImagesPipeline, self).file_path(
+                request, response, info, item=item
+            )
+        checksum = self._get_checksum(response)
+        return f'full/{checksum[:2]}/{checksum}.jpg'
+
+    def image_downloaded(self, response, request, info, *, item=None):
+        path = self.file_path(request, response=response, info=info)
+        if self._is_stored(path):
+            info.spider.crawler.stats.inc_value('images/deduplicated')
+        else:
+            super(SimpleImagesPipeline, self).image_downloaded(
+                response, request, info, item=item
+            )
+            info.spider.crawler.stats.inc_value('images/stored')
+        return self._get_checksum(response)
+
+    def get_media_requests(self, item, info):
+        requests = super(SimpleImagesPipeline, self).get_media_requests(
+            item, info
+        )
+        for request in requests:
+            # Distinguishes image downloads from pages (see metrics)
+            request.meta['image_request'] = True
+            # Images are revalidated by the pipeline itself, caching
+            # them in the HTTP cache would only double the disk usage
+            request.meta['dont_cache'] = True
+        return requests
+
     def item_completed(self, results, item, info):
         image_paths = [x['path'] for ok, x in results if ok]
         adapter = ItemAdapter(item)
         adapter['images'] = image_paths
         return item
+
+    def stored_paths(self, urls):
+        """
+        Returns the local paths of the images which have been already
+        downloaded to the images store, without downloading anything.
+        Used to fill `images` field when items are produced offline.
+        :param urls: list of str
+            Image urls.
+        :return: list of str, paths relative to the images store.
+        """
+        records = [self.index.get(url) for url in urls]
+        return [
+            x['path'] for x in records
+            if x is not None and self._is_stored(x['path'])
+        ]
+
+    def _is_stored(self, path):
+        return Path(self.store.basedir, path).exists()
+
+    @staticmethod
+    def _get_checksum(response):
+        # The hash is needed both for the path and the checksum, so it
+        # is computed once per response and kept in the request meta
+        if 'image_checksum' not in response.meta:
+            response.meta['image_checksum'] = hashlib.sha1(
+                response.body
+            ).hexdigest()
+        return response.meta['image_checksum']
+
+    @staticmethod
+    def _get_header(response, name):
+        value = response.headers.get(name)
+        return value.decode('latin-1') if value is not None else None
+
+    @staticmethod
+    def _index_result(record, status):
+        return {
+            'url': record['url'],
+            'path': record['path'],
+            'checksum': record['checksum'],
+            'status': status,
+        }
+
+
+class ImageTensorPipeline:
+    """
+    Converts the images downloaded by `SimpleImagesPipeline` to tensors
+    of fixed sizes and appends them to the image tensor stores (see
+    `ImageTensorStore`), so that models can be trained on memory-mapped
+    arrays instead of decoding image files. Images are decoded and
+    resized in the reactor thread pool not to block the crawl.
+
+    The pipeline is enabled by the IMAGE_TENSOR_SIZES setting (the list
+    of image sizes) and IMAGE_TENSORS_PATH setting (the folder of the
+    stores), it must run after `SimpleImagesPipeline`.
+    """
+    def __init__(self, images_store, tensors_path, sizes, stats):
+        self.images_store = images_store
+        self.stores = {
+            size: ImageTensorStore(tensors_path, size) for size in sizes
+        }
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        sizes = settings.getlist('IMAGE_TENSOR_SIZES')
+        tensors_path = settings.get('IMAGE_TENSORS_PATH')
+        if not sizes or not tensors_path:
+            raise NotConfigured
+        return cls(
+            settings['IMAGES_STORE'], tensors_path,
+            [int(x) for x in sizes], crawler.stats
+        )
+
+    def close_spider(self, spider):
+        for store in self.stores.values():
+            store.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        sku = adapter.get('sku')
+        if not sku:
+            return item
+
+        # Images are stored by their checksums (see SimpleImagesPipeline),
+        # only the missing sizes of new images are computed
+        tasks = []
+        for path in adapter.get('images') or []:
+            checksum = Path(path).stem
+            sizes = [
+                size for size, store in self.stores.items()
+                if not store.has_image(checksum)
+            ]
+            if sizes or any(
+                (sku, checksum) not in store for store in self.stores.values()
+            ):
+                tasks.append((path, checksum, sizes))
+        if not tasks:
+            return item
+
+        dfd = deferToThread(self._make_tensors, tasks)
+        dfd.addCallback(self._store_tensors, sku)
+        dfd.addCallback(lambda _: item)
+        return dfd
+
+    def _make_tensors(self, tasks):
+        """
+        Runs in the thread pool.
+        :return: list of tuples (str, dict)
+            Image checksums and their tensors (size -> array).
+        """
+        results = []
+        for path, checksum, sizes in tasks:
+            tensors = {}
+            if sizes:
+                try:
+                    with Image.open(Path(self.images_store, path)) as image:
+                        image.load()
+                        tensors = {x: to_tensor(image, x) for x in sizes}
+                except OSError:
+                    logger.warning('Failed to read image %s', path)
+                    continue
+            results.append((checksum, tensors))
+        return results
+
+    def _store_tensors(self, results, sku):
+        for checksum, tensors in results:
+            for size, store in self.stores.items():
+                # The same image may be computed for concurrent items
+                if not store.has_image(checksum):
+                    self.stats.inc_value(f'image_tensors/{size}/stored')
+                store.add(sku, checksum, tensors.get(size))
+
+
+class GemInsertsPipeline:
+    """
+    Writes the gem inserts of items (see `Jewel.inserts`) to the side
+    table (see `InsertsTableWriter`) at INSERTS_FEED_PATH, overwriting
+    it. The inserts aren't exported to the feeds themselves.
+
+    The pipeline is enabled by the INSERTS_FEED_PATH setting.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = None
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('INSERTS_FEED_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(path)
+
+    def open_spider(self, spider):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.path.open('w', newline='', encoding='utf-8')
+        self.writer = InsertsTableWriter(self.file)
+
+    def close_spider(self, spider):
+        self.file.close()
+
+    def process_item(self, item, spider):
+        self.writer.write_item(item)
+        return item
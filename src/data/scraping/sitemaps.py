@@ -0,0 +1,130 @@
+"""
+Streaming processing of (gzipped) sitemaps. Unlike
+`scrapy.utils.sitemap.Sitemap`, which builds the whole document tree,
+`StreamingSitemap` parses the sitemap incrementally and discards the
+processed entries, so that the memory consumption doesn't depend on
+the number of entries (except for the response body itself).
+"""
+import gzip
+import re
+from io import BytesIO
+
+import lxml.etree
+from scrapy.http import XmlResponse
+from scrapy.utils.gz import gzip_magic_number
+
+
+def _local_name(tag):
+    return tag.split('}', 1)[1] if '}' in tag else tag
+
+
+def open_sitemap(response):
+    """
+    Returns the file-like object reading the sitemap contained in the
+    response (decompressing it on the fly if it's gzipped), or None if
+    the response isn't a sitemap. See
+    `SitemapSpider._get_sitemap_body`.
+    """
+    if isinstance(response, XmlResponse):
+        return BytesIO(response.body)
+    elif gzip_magic_number(response):
+        return gzip.GzipFile(fileobj=BytesIO(response.body))
+    elif response.url.endswith('.xml') or response.url.endswith('.xml.gz'):
+        # Already decompressed by HttpCompressionMiddleware
+        return BytesIO(response.body)
+    return None
+
+
+class StreamingSitemap:
+    """
+    Iterates over the entries of a sitemap (type is urlset) or a
+    sitemap index (type is sitemapindex) read from the file-like
+    object. The entries are the same dicts as the ones of
+    `scrapy.utils.sitemap.Sitemap`.
+    """
+    # Tags of the entries of both sitemap types
+    entry_tags = ('{*}url', '{*}sitemap')
+
+    def __init__(self, file):
+        self._elements = (
+            element for _, element in lxml.etree.iterparse(
+                file, tag=self.entry_tags, recover=True,
+                remove_comments=True, remove_pis=True,
+                resolve_entities=False
+            )
+        )
+        self._root = None
+        self.type = None
+        # The type is defined by the root, which is known as soon as
+        # the first entry is read
+        self._first = self._next_element()
+        if self._first is not None:
+            self._root = self._first.getparent()
+            if self._root is not None:
+                self.type = _local_name(self._root.tag)
+
+    def _next_element(self):
+        try:
+            return next(self._elements, None)
+        except lxml.etree.XMLSyntaxError:
+            return None
+
+    def __iter__(self):
+        if self.type is None:
+            return
+        element = self._first
+        while element is not None:
+            if element.getparent() is self._root:
+                entry = {}
+                for child in element:
+                    name = _local_name(child.tag)
+                    if name == 'link':
+                        if 'href' in child.attrib:
+                            entry.setdefault('alternate', []).append(
+                                child.get('href')
+                            )
+                    else:
+                        entry[name] = (child.text or '').strip()
+                # Free the processed entries
+                element.clear()
+                while self._root[0] is not element:
+                    del self._root[0]
+                if 'loc' in entry:
+                    yield entry
+            element = self._next_element()
+
+
+class RuleMatcher:
+    """
+    Finds the first of the regex rules matching a URL with a single
+    precompiled regex: each rule is a lookahead alternative in a named
+    group, so the alternatives are tried in the order of rules as the
+    sequential search does. Falls back to the sequential search if the
+    rules can't be combined (they have flags or groups).
+    """
+    def __init__(self, rules):
+        """
+        :param rules: list of str or re.Pattern
+        """
+        self.rules = [re.compile(x) if isinstance(x, str) else x
+                      for x in rules]
+        self._combined = None
+        if self.rules and all(
+                x.flags == re.UNICODE and not x.groups for x in self.rules):
+            try:
+                self._combined = re.compile('|'.join(
+                    f'(?P<rule{i}>(?=.*?(?:{rule.pattern})))'
+                    for i, rule in enumerate(self.rules)
+                ))
+            except re.error:
+                pass
+
+    def match(self, url):
+        """:return: int or None, the index of the first matching rule."""
+        if self._combined is not None:
+            match = self._combined.match(url)
+            return int(match.lastgroup[4:]) if match else None
+        for i, rule in enumerate(self.rules):
+            if rule.search(url):
+                return i
+        return None
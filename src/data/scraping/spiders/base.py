@@ -0,0 +1,333 @@
+import hashlib
+import logging
+import time
+from collections import deque
+
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.spiders import SitemapSpider
+from scrapy.spidermiddlewares.offsite import OffsiteMiddleware
+from scrapy.spiders.sitemap import iterloc
+from src.data.scraping.checkpoint import FeedCheckpoint
+from src.data.scraping.incremental import CrawlState
+from src.data.scraping.sitemaps import (
+    RuleMatcher, StreamingSitemap, open_sitemap
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BaseJewelSpider(SitemapSpider):
+    """
+    Abstract base spider class for the websites, whose product pages
+    are listed in the sitemap. The spider follows the sitemap entries
+    matching `sitemap_rules`, parses each product page with the
+    `parser_cls` parser and yields the resulting jewel instances.
+
+    If the CRAWL_STATE_PATH setting is specified, the spider works in
+    the incremental mode: it keeps the state of the crawled product
+    pages (see `CrawlState`) and skips the pages that haven't changed
+    since the previous crawl:
+    - the page isn't downloaded at all, if its sitemap lastmod value
+      is the same as the stored one;
+    - the page isn't parsed, if its content fingerprint is the same
+      as the stored one.
+    All the product pages listed in the sitemaps are marked as seen, so
+    that the items of the delisted ones can be removed from the feed
+    after the crawl.
+
+    The sitemaps are parsed incrementally (see `StreamingSitemap`) and
+    their product requests are scheduled lazily: no more than
+    `sitemap_max_pending` (the SITEMAP_MAX_PENDING setting) requests
+    are kept in the scheduler, the rest of the sitemap entries are read
+    as the scheduled pages are downloaded. Nested sitemaps are requested
+    with a lower priority, so the next sitemap is downloaded only when
+    the products of the previous ones are scheduled.
+
+    If the FEED_CHECKPOINT_PATH setting is specified, the crawl is
+    resumable: the scraped items are committed to the `FeedCheckpoint`
+    and the pages of the committed items are skipped. Sitemaps are
+    never filtered as duplicates, so that they are read again when
+    a paused crawl is resumed.
+    """
+    # Subclass of BaseJewelParser parsing the product pages
+    parser_cls = None
+    # Optional faster parser producing the same items as `parser_cls`,
+    # used instead of it if the FAST_PARSE setting is enabled
+    fast_parser_cls = None
+    # Optional callback `parse_timer(method_name, seconds)` receiving
+    # the parsing time of product pages (see `MetricsExtension`)
+    parse_timer = None
+    # The maximum number of the scheduled product requests of sitemaps,
+    # 0 means unlimited
+    sitemap_max_pending = 1000
+    # The priority of nested sitemap requests
+    sitemap_priority = -1
+
+    def __init__(self, *args, **kwargs):
+        super(BaseJewelSpider, self).__init__(*args, **kwargs)
+        self.crawl_state = None
+        self.checkpoint = None
+        # Sitemap lastmod values of the pages scheduled for downloading
+        self._lastmods = {}
+        self._rule_matcher = RuleMatcher([regex for regex, _ in self._cbs])
+        self._follow_matcher = RuleMatcher(self._follow)
+        # Iterators of the product requests of partially read sitemaps
+        self._sitemap_backlog = deque()
+        # Crawl states of the pages, which items aren't committed yet
+        self._pending_states = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(BaseJewelSpider, cls).from_crawler(
+            crawler, *args, **kwargs
+        )
+        spider.parser_cls = cls.get_parser_cls(
+            crawler.settings.getbool('FAST_PARSE')
+        )
+        spider.sitemap_max_pending = crawler.settings.getint(
+            'SITEMAP_MAX_PENDING', cls.sitemap_max_pending
+        )
+        # The offsite policy of the spider (see `_iter_sitemap_requests`)
+        spider._offsite = OffsiteMiddleware(crawler.stats)
+        spider._offsite.spider_opened(spider)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(
+            spider.response_received, signal=signals.response_received
+        )
+        checkpoint_path = crawler.settings.get('FEED_CHECKPOINT_PATH')
+        if checkpoint_path:
+            spider.checkpoint = FeedCheckpoint(checkpoint_path)
+            spider.checkpoint.set_state(FeedCheckpoint.RUNNING)
+            crawler.signals.connect(
+                spider.checkpoint_item, signal=signals.item_scraped
+            )
+            crawler.signals.connect(
+                spider.close_checkpoint, signal=signals.spider_closed
+            )
+        crawl_state_path = crawler.settings.get('CRAWL_STATE_PATH')
+        if crawl_state_path:
+            # The crawl state of a resumable crawl is committed along
+            # with the checkpoint only (see `checkpoint_item`)
+            spider.crawl_state = CrawlState(
+                crawl_state_path,
+                commit_every=float('inf') if checkpoint_path else 1000
+            )
+            crawler.signals.connect(
+                spider.close_crawl_state, signal=signals.spider_closed
+            )
+        return spider
+
+    def start_requests(self):
+        for url in self.sitemap_urls:
+            yield Request(url, self._parse_sitemap, dont_filter=True)
+
+    @classmethod
+    def get_parser_cls(cls, fast=False):
+        """
+        Returns the parser class of the spider: the fast one if it's
+        requested and implemented, the default one otherwise.
+        """
+        if fast and cls.fast_parser_cls is not None:
+            return cls.fast_parser_cls
+        return cls.parser_cls
+
+    def close_crawl_state(self):
+        self.crawl_state.close()
+
+    def close_checkpoint(self):
+        self.checkpoint.set_state(FeedCheckpoint.PAUSED)
+        self.checkpoint.close()
+
+    def checkpoint_item(self, item, response, spider):
+        """
+        Commits the scraped item to the checkpoint. The crawl state of
+        its page is updated only now, so that the page isn't skipped by
+        the incremental crawl resumed after a crash if the item has
+        been lost.
+        """
+        url = self.get_page_url(response)
+        committed = self.checkpoint.add(url, item)
+        state = self._pending_states.pop(url, None)
+        if state is not None:
+            self.crawl_state.update(url, *state)
+        if committed and self.crawl_state is not None:
+            self.crawl_state.commit()
+
+    @staticmethod
+    def get_page_url(response):
+        """
+        Returns the sitemap URL of the product page, not the redirected
+        one, which identifies the page in the crawl state.
+        """
+        return response.meta.get('redirect_urls', [response.url])[0]
+
+    def parse_item(self, response):
+        """Parses the product page with the parser of the spider."""
+        if self.parse_timer is None:
+            return self.parser_cls(response).parse()
+
+        start = time.perf_counter()
+        item = self.parser_cls(response, self.parse_timer).parse()
+        self.parse_timer('parse', time.perf_counter() - start)
+        return item
+
+    def parse_product(self, response):
+        if self.crawl_state is None:
+            yield self.parse_item(response)
+            return
+
+        url = self.get_page_url(response)
+        lastmod = self._lastmods.pop(url, None)
+        content_hash = self.content_fingerprint(response)
+        if self.crawl_state.has_content(url, content_hash):
+            self.crawler.stats.inc_value('incremental/unchanged_content')
+            self.crawl_state.update(url, lastmod, content_hash)
+            return
+
+        self.crawler.stats.inc_value('incremental/changed')
+        item = self.parse_item(response)
+        state = (lastmod, content_hash, item.get('sku'))
+        if self.checkpoint is not None:
+            self._pending_states[url] = state
+        yield item
+        if self.checkpoint is None:
+            self.crawl_state.update(url, *state)
+
+    def parse(self, response, **kwargs):
+        # Do nothing, all products will be parsed by `parse_product`
+        pass
+
+    def content_fingerprint(self, response):
+        """
+        Returns the hash of the product page content used to detect
+        whether the page has changed since the previous crawl. Might be
+        overridden in order to ignore the volatile parts of the page
+        (session tokens, banners, etc.) by hashing its relevant blocks.
+        """
+        return hashlib.sha1(response.body).hexdigest()
+
+    @staticmethod
+    def is_sitemap_url(url):
+        return url.endswith('.xml')
+
+    def is_product_url(self, url):
+        return self._rule_matcher.match(url) is not None
+
+    def _parse_sitemap(self, response):
+        if response.url.endswith('/robots.txt'):
+            yield from super(BaseJewelSpider, self)._parse_sitemap(response)
+            return
+
+        body = open_sitemap(response)
+        if body is None:
+            logger.warning(
+                'Ignoring invalid sitemap: %(response)s',
+                {'response': response}, extra={'spider': self}
+            )
+            return
+
+        sitemap = StreamingSitemap(body)
+        entries = self.sitemap_filter(sitemap)
+        if sitemap.type == 'sitemapindex':
+            for loc in iterloc(entries, self.sitemap_alternate_links):
+                if self._follow_matcher.match(loc) is not None:
+                    yield Request(
+                        loc, callback=self._parse_sitemap,
+                        priority=self.sitemap_priority, dont_filter=True
+                    )
+        elif sitemap.type == 'urlset':
+            requests = self._iter_sitemap_requests(entries)
+            if not self.sitemap_max_pending:
+                yield from requests
+                return
+            self._sitemap_backlog.append(requests)
+            yield from self.pull_sitemap_requests()
+
+    def _iter_sitemap_requests(self, entries):
+        for loc in iterloc(entries, self.sitemap_alternate_links):
+            rule = self._rule_matcher.match(loc)
+            if rule is None:
+                continue
+            request = Request(loc, callback=self._cbs[rule][1])
+            # The requests scheduled directly in the engine bypass
+            # the offsite middleware, so all of them are checked here
+            if not self._offsite.should_follow(request, self):
+                self.crawler.stats.inc_value('offsite/filtered')
+                continue
+            yield request
+
+    def pull_sitemap_requests(self):
+        """
+        Reads the product requests of the partially read sitemaps until
+        the scheduler has `sitemap_max_pending` requests. Nothing is
+        read while the scheduler has more than half of them.
+        """
+        if not self._sitemap_backlog:
+            return
+        engine = self.crawler.engine
+        pending = len(engine.slot.scheduler) if engine.slot else 0
+        if pending > self.sitemap_max_pending // 2:
+            return
+        for _ in range(self.sitemap_max_pending - pending):
+            while self._sitemap_backlog:
+                request = next(self._sitemap_backlog[0], None)
+                if request is not None:
+                    yield request
+                    break
+                self._sitemap_backlog.popleft()
+            else:
+                return
+
+    def schedule_sitemap_requests(self):
+        """
+        Schedules the product requests of the partially read sitemaps
+        (see `pull_sitemap_requests`) directly in the engine. They
+        aren't yielded from the product callbacks, so that the depth
+        and the referer of unrelated product pages aren't assigned to
+        them by the spider middlewares.
+        :return: bool, whether any request is scheduled.
+        """
+        scheduled = False
+        for request in self.pull_sitemap_requests():
+            self.crawler.engine.crawl(request, self)
+            scheduled = True
+        return scheduled
+
+    def response_received(self, response, request, spider):
+        # Each downloaded page frees a place in the scheduler
+        if spider is self:
+            self.schedule_sitemap_requests()
+
+    def spider_idle(self, spider):
+        # All the scheduled pages are parsed (or skipped), but sitemaps
+        # may still have entries
+        if spider is self and self.schedule_sitemap_requests():
+            raise DontCloseSpider
+
+    def sitemap_filter(self, entries):
+        for entry in entries:
+            url = entry['loc']
+            if self.is_sitemap_url(url):
+                yield entry
+            elif self.is_product_url(url):
+                if self.crawl_state is not None:
+                    # The page is still listed, so its item is kept in
+                    # the feed even if the page isn't downloaded (see
+                    # `CrawlState.get_unseen_skus`)
+                    self.crawl_state.touch(url)
+                if self.checkpoint is not None and self.checkpoint.has(url):
+                    self.crawler.stats.inc_value('resume/skipped_committed')
+                    continue
+                if self.crawl_state is None:
+                    yield entry
+                    continue
+
+                lastmod = entry.get('lastmod')
+                if self.crawl_state.is_unchanged(url, lastmod):
+                    self.crawler.stats.inc_value(
+                        'incremental/skipped_by_lastmod'
+                    )
+                else:
+                    self._lastmods[url] = lastmod
+                    yield entry
@@ -1,8 +1,12 @@
-from scrapy.spiders import SitemapSpider
-from src.data.scraping.parsers.sokolov_ru import SokolovRuJewelParser
+import hashlib
 
+from src.data.scraping.parsers.sokolov_ru import (
+    SokolovRuFastJewelParser, SokolovRuJewelParser
+)
+from src.data.scraping.spiders.base import BaseJewelSpider
 
-class SokolovRuSpider(SitemapSpider):
+
+class SokolovRuSpider(BaseJewelSpider):
     """
     Scraping spider class for sokolov.ru that iterates over the
     product webpages listed in the sitemap and parses jewel product
@@ -12,32 +16,16 @@ class SokolovRuSpider(SitemapSpider):
     allowed_domains = ['sokolov.ru']
     sitemap_urls = ['https://sokolov.ru/sitemap.xml']
     # All product pages share a common prefix /jewelry-catalog/product
-    sitemap_rules = [('/jewelry-catalog/product/', 'parse_product')]
-
-    def parse_product(self, response):
-        yield SokolovRuJewelParser(response).parse()
-
-    def parse(self, response, **kwargs):
-        # Do nothing, all products will be parsed by `parse_product`
-        pass
-
-    @staticmethod
-    def is_sitemap_url(url):
-        return url.endswith('.xml')
-
-    @staticmethod
-    def is_product_url(url):
-        # Remove scheme from URL
-        route = url.split('//')[-1]
-        # Cut domain from the route
-        domain = route.split('/')[0]
-        route = route.replace(domain, '', 1)
-
-        product_prefix, _ = SokolovRuSpider.sitemap_rules[0]
-        return route.startswith(product_prefix)
-
-    def sitemap_filter(self, entries):
-        for entry in entries:
-            url = entry['loc']
-            if self.is_sitemap_url(url) or self.is_product_url(url):
-                yield entry
+    sitemap_rules = [
+        (r'^https?://[^/]+/jewelry-catalog/product/', 'parse_product')
+    ]
+    parser_cls = SokolovRuJewelParser
+    fast_parser_cls = SokolovRuFastJewelParser
+
+    def content_fingerprint(self, response):
+        # Only the blocks with the product data are hashed, the rest
+        # of the page (header, cart, recommendations) is volatile
+        blocks = response.css('.product[data-list-id=product], #props')
+        return hashlib.sha1(
+            ''.join(blocks.getall()).encode('utf-8')
+        ).hexdigest()
@@ -0,0 +1,165 @@
+"""
+Packed image tensors: product images resized to the fixed shape and
+stored as raw uint8 arrays, which can be memory-mapped and sliced
+with numpy without decoding image files.
+"""
+import csv
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+CHANNELS = 3
+# Letterbox padding color
+BACKGROUND = (255, 255, 255)
+
+
+def to_tensor(image, size):
+    """
+    Resizes the image to fit the `size` x `size` square preserving
+    the aspect ratio and pads it with white background (letterbox).
+    :param image: PIL.Image.Image
+    :param size: int
+    :return: numpy.ndarray of uint8 with shape (size, size, 3)
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = ImageOps.pad(
+        image, (size, size), method=Image.BICUBIC, color=BACKGROUND
+    )
+    return np.asarray(image, dtype=np.uint8)
+
+
+class ImageTensorStore:
+    """
+    Append-only store of image tensors of the single size. Consists of:
+    - images_<size>.u8 - a raw C-ordered uint8 array with the shape
+      (rows, size, size, 3);
+    - images_<size>.csv - the index of rows: sku, checksum, row.
+
+    Rows are identified by the image checksum (content hash), so the
+    image shared by several products is stored once and referenced by
+    several index entries. An incomplete row written by an interrupted
+    process is truncated when the store is opened again.
+    """
+    INDEX_FIELDS = ['sku', 'checksum', 'row']
+
+    def __init__(self, path, size):
+        """
+        :param path: str or Path
+            The folder of the store, created if it doesn't exist.
+        :param size: int
+            The width and the height of the images.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.data_path = Path(self.path, f'images_{size}.u8')
+        self.index_path = Path(self.path, f'images_{size}.csv')
+        self.row_bytes = size * size * CHANNELS
+
+        self.rows = 0
+        if self.data_path.exists():
+            self.rows = self.data_path.stat().st_size // self.row_bytes
+            os.truncate(self.data_path, self.rows * self.row_bytes)
+
+        # checksum -> row and indexed (sku, checksum) pairs
+        self._checksum_rows = {}
+        self._indexed = set()
+        for sku, checksum, row in iter_index(self.index_path):
+            if row < self.rows:
+                self._checksum_rows[checksum] = row
+                self._indexed.add((sku, checksum))
+
+        is_new_index = not self.index_path.exists()
+        self._data_file = self.data_path.open('ab')
+        self._index_file = self.index_path.open('a', newline='')
+        self._index_writer = csv.writer(self._index_file)
+        if is_new_index:
+            self._index_writer.writerow(self.INDEX_FIELDS)
+
+    def __contains__(self, key):
+        """Whether the (sku, checksum) pair is already stored."""
+        return key in self._indexed
+
+    def has_image(self, checksum):
+        return checksum in self._checksum_rows
+
+    def add(self, sku, checksum, tensor):
+        """
+        Stores the image tensor of the product, unless the image with
+        the same checksum is already stored.
+        :param sku: str
+            Product SKU.
+        :param checksum: str
+            The hash of the image content.
+        :param tensor: numpy.ndarray or None
+            The image tensor (see `to_tensor`), may be None if the
+            image is known to be stored already.
+        :return: int, the row of the image.
+        """
+        row = self._checksum_rows.get(checksum)
+        if row is None:
+            self._data_file.write(tensor.tobytes())
+            # Data must reach the file before the index refers to it
+            self._data_file.flush()
+            row = self._checksum_rows[checksum] = self.rows
+            self.rows += 1
+
+        if (sku, checksum) not in self._indexed:
+            self._index_writer.writerow([sku, checksum, row])
+            self._index_file.flush()
+            self._indexed.add((sku, checksum))
+        return row
+
+    def close(self):
+        self._data_file.close()
+        self._index_file.close()
+
+
+def iter_index(index_path):
+    """
+    Iterates over the index of the image tensor store.
+    :return:
+        Nothing, but tuples (sku, checksum, row) are generated.
+    """
+    if not Path(index_path).exists():
+        return
+    with open(index_path, newline='') as f:
+        for record in csv.DictReader(f):
+            yield record['sku'], record['checksum'], int(record['row'])
+
+
+def load_image_tensors(path, size):
+    """
+    Memory-maps the image tensors stored by `ImageTensorStore`.
+    :param path: str or Path
+        The folder of the store.
+    :param size: int
+        The width and the height of the images.
+    :return: tuple (numpy.memmap, dict)
+        Read-only array of shape (rows, size, size, 3) and the mapping
+        sku -> list of rows of the product images.
+    """
+    data_path = Path(path, f'images_{size}.u8')
+    rows = data_path.stat().st_size // (size * size * CHANNELS)
+    shape = (rows, size, size, CHANNELS)
+    if rows:
+        tensors = np.memmap(data_path, dtype=np.uint8, mode='r', shape=shape)
+    else:
+        tensors = np.empty(shape, dtype=np.uint8)
+
+    sku_rows = {}
+    for sku, _, row in iter_index(Path(path, f'images_{size}.csv')):
+        if row < rows:
+            sku_rows.setdefault(sku, []).append(row)
+    return tensors, sku_rows
+
+
+def normalize(batch, mean=0.5, std=0.5):
+    """
+    Converts the batch of uint8 image tensors to float32 values
+    normalized as (x / 255 - mean) / std.
+    """
+    return (np.asarray(batch, dtype=np.float32) / 255 - mean) / std
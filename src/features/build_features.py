@@ -0,0 +1,284 @@
+"""
+Model-ready features of the jewels built from the csv feed of the
+website. The feed is read in chunks and all the transformations are
+vectorized, so the memory consumption is bounded by the chunk size
+(except for the sparse text features, which are compact).
+
+The features are saved to data/processed/<site_py>/features/:
+- skus.npy - product SKUs, the rows of all the feature arrays;
+- numeric.npy - float32 values of numeric fields (0 if missing)
+  followed by the missing value flags (1 if missing);
+- categorical.npy - int32 codes of categorical fields (0 if missing),
+  the code of a value is its index in vocab.json plus one;
+- text_data.npy, text_indices.npy, text_indptr.npy - the CSR matrix
+  of hashed word n-grams of text fields, each field is hashed into
+  its own block of columns;
+- vocab.json - values of categorical fields in the order of codes;
+- meta.json - column names, numeric field statistics, text hashing
+  parameters etc.
+All the arrays can be memory-mapped (see `load_features`).
+"""
+import click
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from src.common.paths import get_features_path
+from src.data.scraping import config
+
+NUMERIC_FIELDS = [
+    'price', 'weight', 'width', 'height', 'gems_carats', 'gem_types'
+]
+CATEGORICAL_FIELDS = ['category', 'metal', 'probe', 'for_whom', 'collection']
+TEXT_FIELDS = ['title', 'description', 'gems']
+# Word unigrams and bigrams are hashed
+TEXT_NGRAM_RANGE = (1, 2)
+
+
+def make_text_vectorizer(n_features):
+    """
+    Returns the stateless vectorizer of the text fields, so that the
+    chunks of the feed are transformed independently.
+    """
+    return HashingVectorizer(
+        n_features=n_features, ngram_range=TEXT_NGRAM_RANGE,
+        alternate_sign=False, norm='l2', dtype=np.float32
+    )
+
+
+def iter_feed_chunks(feed_path, chunksize):
+    """
+    Reads the feature fields of the csv feed in chunks.
+    :return:
+        Nothing, but pandas.DataFrame chunks are generated. Fields
+        missing in the feed are filled with NaN values.
+    """
+    fields = ['sku'] + NUMERIC_FIELDS + CATEGORICAL_FIELDS + TEXT_FIELDS
+    dtypes = {x: np.float32 for x in NUMERIC_FIELDS}
+    dtypes.update({x: str for x in fields if x not in dtypes})
+    chunks = pd.read_csv(
+        feed_path, usecols=lambda x: x in dtypes, dtype=dtypes,
+        keep_default_na=False, na_values=[''], chunksize=chunksize
+    )
+    for chunk in chunks:
+        yield chunk.reindex(columns=fields)
+
+
+def encode_categorical(values, vocab):
+    """
+    Encodes the categorical values with integer codes.
+    :param values: pandas.Series
+        Categorical values, NaN if missing.
+    :param vocab: dict
+        Value -> code mapping, new values are added to it.
+    :return: numpy.ndarray of int32, the codes (0 for missing values).
+    """
+    codes, uniques = pd.factorize(values)
+    # The loop is over the unique values only, the rows are encoded
+    # by the lookup table; missing values (-1) refer to the last entry
+    lookup = np.zeros(len(uniques) + 1, dtype=np.int32)
+    for i, value in enumerate(uniques):
+        lookup[i] = vocab.setdefault(value, len(vocab) + 1)
+    return lookup[codes]
+
+
+def _count_rows(feed_path, chunksize):
+    return sum(
+        len(chunk) for chunk in pd.read_csv(
+            feed_path, usecols=['sku'], dtype=str, chunksize=chunksize
+        )
+    )
+
+
+def build_features(site, chunksize=10000, text_features=2 ** 16):
+    """
+    Builds the features of the website products from its csv feed
+    (data/raw/<site_py>/items.csv) and saves them (see the module
+    description). The features folder is replaced atomically.
+    :param site: str
+        The shortest domain name of the website.
+    :param chunksize: int
+        The number of feed rows processed at once.
+    :param text_features: int
+        The number of hashed text features (columns) per text field.
+    :return: dict, the metadata of the features.
+    """
+    feed_path, _ = config.get_scraping_output_paths(site)
+    features_path = Path(get_features_path(site))
+    tmp_path = Path(str(features_path) + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    rows = _count_rows(feed_path, chunksize)
+    n_numeric = len(NUMERIC_FIELDS)
+    numeric = np.lib.format.open_memmap(
+        Path(tmp_path, 'numeric.npy'), mode='w+', dtype=np.float32,
+        shape=(rows, 2 * n_numeric)
+    )
+    categorical = np.lib.format.open_memmap(
+        Path(tmp_path, 'categorical.npy'), mode='w+', dtype=np.int32,
+        shape=(rows, len(CATEGORICAL_FIELDS))
+    )
+    vocabs = {x: {} for x in CATEGORICAL_FIELDS}
+    vectorizer = make_text_vectorizer(text_features)
+    skus, text_blocks = [], []
+    # Running sums for the numeric fields statistics
+    counts = np.zeros(n_numeric, dtype=np.int64)
+    sums = np.zeros(n_numeric, dtype=np.float64)
+    squares = np.zeros(n_numeric, dtype=np.float64)
+
+    start = 0
+    for chunk in iter_feed_chunks(feed_path, chunksize):
+        end = start + len(chunk)
+        skus.append(chunk['sku'].fillna('').to_numpy(dtype=str))
+
+        values = chunk[NUMERIC_FIELDS].to_numpy(dtype=np.float32)
+        missing = np.isnan(values)
+        numeric[start:end, :n_numeric] = np.where(missing, 0, values)
+        numeric[start:end, n_numeric:] = missing
+        counts += (~missing).sum(axis=0)
+        sums += np.nansum(values, axis=0, dtype=np.float64)
+        squares += np.nansum(
+            np.square(values, dtype=np.float64), axis=0
+        )
+
+        for i, field in enumerate(CATEGORICAL_FIELDS):
+            categorical[start:end, i] = encode_categorical(
+                chunk[field], vocabs[field]
+            )
+
+        text_blocks.append(sp.hstack([
+            vectorizer.transform(chunk[field].fillna(''))
+            for field in TEXT_FIELDS
+        ], format='csr'))
+        start = end
+
+    numeric.flush()
+    categorical.flush()
+    if text_blocks:
+        text = sp.vstack(text_blocks, format='csr')
+    else:
+        text = sp.csr_matrix(
+            (0, text_features * len(TEXT_FIELDS)), dtype=np.float32
+        )
+    for name in ('data', 'indices', 'indptr'):
+        np.save(Path(tmp_path, f'text_{name}.npy'), getattr(text, name))
+    np.save(
+        Path(tmp_path, 'skus.npy'),
+        np.concatenate(skus) if skus else np.array([], dtype=str)
+    )
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0))
+    meta = {
+        'site': site,
+        'source': str(feed_path),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'rows': rows,
+        'numeric_columns': (
+            NUMERIC_FIELDS + [f'{x}_missing' for x in NUMERIC_FIELDS]
+        ),
+        'numeric_stats': {
+            field: {
+                'count': int(counts[i]),
+                'mean': float(means[i]) if counts[i] else None,
+                'std': float(stds[i]) if counts[i] else None,
+            }
+            for i, field in enumerate(NUMERIC_FIELDS)
+        },
+        'categorical_columns': CATEGORICAL_FIELDS,
+        'text': {
+            'fields': TEXT_FIELDS,
+            'features_per_field': text_features,
+            'ngram_range': list(TEXT_NGRAM_RANGE),
+            'shape': list(text.shape),
+            'nnz': int(text.nnz),
+        },
+    }
+    with Path(tmp_path, 'vocab.json').open('w', encoding='utf-8') as f:
+        json.dump(
+            {field: list(vocab) for field, vocab in vocabs.items()},
+            f, ensure_ascii=False, indent=1
+        )
+    with Path(tmp_path, 'meta.json').open('w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    # Release the memory-mapped files before moving them
+    del numeric, categorical
+    if features_path.exists():
+        shutil.rmtree(features_path)
+    os.replace(tmp_path, features_path)
+    return meta
+
+
+def load_features(site, mmap_mode='r'):
+    """
+    Loads the features built by `build_features`.
+    :param site: str
+        The shortest domain name of the website.
+    :param mmap_mode: str or None
+        The memory-mapping mode of the arrays (see `numpy.load`),
+        None to read them into memory.
+    :return: dict
+        skus, numeric, categorical (numpy arrays), text
+        (scipy.sparse.csr_matrix), vocab and meta (dicts).
+    """
+    path = Path(get_features_path(site))
+
+    def load(name):
+        return np.load(Path(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    with Path(path, 'meta.json').open(encoding='utf-8') as f:
+        meta = json.load(f)
+    with Path(path, 'vocab.json').open(encoding='utf-8') as f:
+        vocab = json.load(f)
+    text = sp.csr_matrix(
+        (load('text_data'), load('text_indices'), load('text_indptr')),
+        shape=tuple(meta['text']['shape']), copy=False
+    )
+    return {
+        'skus': load('skus'),
+        'numeric': load('numeric'),
+        'categorical': load('categorical'),
+        'text': text,
+        'vocab': vocab,
+        'meta': meta,
+    }
+
+
+@click.command('features')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to build features of'
+)
+@click.option(
+    '--chunksize', type=int, default=10000, show_default=True,
+    help='The number of feed rows processed at once.'
+)
+@click.option(
+    '--text-features', type=int, default=2 ** 16, show_default=True,
+    help='The number of hashed text features per text field.'
+)
+def features_cli(site, chunksize, text_features):
+    """
+    Build the model-ready numeric, categorical and text features of
+    the website products from the csv feed and save them to the
+    data/processed/ folder.
+    """
+    meta = build_features(site, chunksize, text_features)
+    click.echo(
+        f'Built features of {meta["rows"]} items: '
+        f'{len(meta["numeric_columns"])} numeric, '
+        f'{len(meta["categorical_columns"])} categorical, '
+        f'{meta["text"]["shape"][1]} text columns '
+        f'({meta["text"]["nnz"]} non-zero values)'
+    )
@@ -0,0 +1,107 @@
+"""
+Dense item embeddings built from the features (see `build_features`)
+for the similarity search. An embedding is the concatenation of
+the following blocks, each one normalized to the unit length and
+scaled by its weight:
+- standardized numeric values and missing value flags;
+- one-hot codes of the low-cardinality categorical fields;
+- truncated SVD components of the hashed text features and one-hot
+  codes of the high-cardinality categorical fields (e.g. collection).
+The embeddings themselves are normalized to the unit length, so their
+dot product is the cosine similarity.
+"""
+import numpy as np
+import scipy.sparse as sp
+from sklearn.decomposition import TruncatedSVD
+
+# Categorical fields with more values are folded into the SVD block
+MAX_ONE_HOT_VALUES = 64
+DEFAULT_WEIGHTS = {'numeric': 1., 'categorical': 1., 'text': 1.}
+
+
+def normalize_rows(matrix):
+    """
+    Scales the rows of the matrix to the unit length (zero rows are
+    kept), so that their dot products are the cosine similarities.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _standardize_numeric(features):
+    """
+    :return: numpy.ndarray of float32, the numeric features with
+        standardized values (0 if missing) and missing value flags.
+    """
+    numeric = np.asarray(features['numeric'], dtype=np.float32)
+    stats = features['meta']['numeric_stats']
+    n_values = len(stats)
+    means = np.array(
+        [x['mean'] or 0. for x in stats.values()], dtype=np.float32
+    )
+    stds = np.array([x['std'] or 1. for x in stats.values()], dtype=np.float32)
+    values, missing = numeric[:, :n_values], numeric[:, n_values:]
+    standardized = np.where(missing > 0, 0, (values - means) / stds)
+    return np.hstack([standardized, missing]).astype(np.float32)
+
+
+def _one_hot(codes, n_values):
+    """
+    :return: scipy.sparse.csr_matrix with n_values columns,
+        missing values (code 0) have no non-zero entries.
+    """
+    rows = np.flatnonzero(codes)
+    return sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, codes[rows] - 1)),
+        shape=(len(codes), n_values)
+    )
+
+
+def build_embeddings(features, text_components=64, weights=None, seed=0):
+    """
+    Builds the item embeddings from the features.
+    :param features: dict
+        The features returned by `load_features`.
+    :param text_components: int
+        The number of SVD components of the text block.
+    :param weights: dict or None
+        Block name (numeric, categorical, text) -> block weight,
+        see DEFAULT_WEIGHTS.
+    :param seed: int
+        The random seed of SVD.
+    :return: numpy.ndarray of float32 with shape (rows, dimension)
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    categorical = np.asarray(features['categorical'])
+    rows = len(categorical)
+
+    one_hot, wide = [], [features['text']]
+    for i, field in enumerate(features['meta']['categorical_columns']):
+        n_values = len(features['vocab'][field])
+        block = _one_hot(categorical[:, i], n_values)
+        if n_values <= MAX_ONE_HOT_VALUES:
+            one_hot.append(block)
+        else:
+            wide.append(block)
+
+    if one_hot:
+        one_hot = sp.hstack(one_hot, format='csr').toarray()
+    else:
+        one_hot = np.zeros((rows, 0), dtype=np.float32)
+    blocks = [
+        (_standardize_numeric(features), weights['numeric']),
+        (one_hot, weights['categorical']),
+    ]
+
+    wide = sp.hstack(wide, format='csr')
+    n_components = min(text_components, wide.shape[1] - 1, rows - 1)
+    if n_components > 0:
+        svd = TruncatedSVD(n_components, random_state=seed)
+        blocks.append((svd.fit_transform(wide), weights['text']))
+
+    embeddings = np.hstack([
+        normalize_rows(np.asarray(block, dtype=np.float32)) * weight
+        for block, weight in blocks
+    ])
+    return normalize_rows(embeddings).astype(np.float32)
@@ -0,0 +1,400 @@
+"""
+Perceptual hashes and colour descriptors of the downloaded product
+images, which are used to find near-duplicate images (the same photo
+resized, recompressed or slightly retouched) across products.
+
+Each distinct image of the images store (see `ImageIndex`) gets:
+- phash - 64-bit DCT perceptual hash, robust to resizing and
+  compression;
+- dhash - 64-bit difference (gradient) hash;
+- histogram - L2-normalized RGB colour histogram of the foreground
+  (near-white background pixels are ignored).
+The results are cached in data/processed/<site_py>/images/hashes.sqlite
+by the image checksum (content hash), so only the images downloaded
+since the previous run are decoded. Failed images are cached as well
+and aren't retried.
+"""
+import click
+import logging
+import multiprocessing
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from scipy.fft import dctn
+
+from src.common.paths import get_image_hashes_path
+from src.common.sqlite import SqliteStore
+from src.data.scraping import config
+from src.data.scraping.image_index import ImageIndex
+from src.data.scraping.pipelines import SimpleImagesPipeline
+
+logger = logging.getLogger(__name__)
+
+# Hashes are HASH_SIZE x HASH_SIZE = 64 bits
+HASH_SIZE = 8
+# pHash is computed over the DCT of the image downscaled to
+# (HASH_SIZE * PHASH_FACTOR) pixels square
+PHASH_FACTOR = 4
+# Bins per RGB channel of the colour histogram
+HISTOGRAM_BINS = 4
+# The histogram is computed over the thumbnail of this size
+HISTOGRAM_SIZE = 64
+# Pixels with all channels above the level are the background
+BACKGROUND_LEVEL = 240
+# The number of set bits of each byte value
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)
+
+
+def _pack_bits(bits):
+    """:return: int, the 64 flags as an unsigned integer."""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def _grayscale(image, width, height):
+    image = image.convert('L').resize((width, height), Image.LANCZOS)
+    return np.asarray(image, dtype=np.float32)
+
+
+def phash(image):
+    """
+    :param image: PIL.Image.Image
+    :return: int, the perceptual hash: the signs of the low-frequency
+        DCT coefficients relative to their median.
+    """
+    size = HASH_SIZE * PHASH_FACTOR
+    coefs = dctn(_grayscale(image, size, size), norm='ortho')
+    low = coefs[:HASH_SIZE, :HASH_SIZE]
+    return _pack_bits(low > np.median(low))
+
+
+def dhash(image):
+    """
+    :param image: PIL.Image.Image
+    :return: int, the difference hash: whether the brightness grows
+        between the horizontally adjacent pixels.
+    """
+    pixels = _grayscale(image, HASH_SIZE + 1, HASH_SIZE)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def color_histogram(image):
+    """
+    :param image: PIL.Image.Image
+    :return: numpy.ndarray of float32 with shape (HISTOGRAM_BINS ** 3,)
+        L2-normalized histogram of foreground pixel colours.
+    """
+    image = image.convert('RGB')
+    image.thumbnail((HISTOGRAM_SIZE, HISTOGRAM_SIZE))
+    pixels = np.asarray(image, dtype=np.uint8).reshape(-1, 3)
+    foreground = pixels[(pixels <= BACKGROUND_LEVEL).any(axis=1)]
+    if len(foreground):
+        pixels = foreground
+    bins = (pixels.astype(np.int64) * HISTOGRAM_BINS) // 256
+    codes = (bins[:, 0] * HISTOGRAM_BINS + bins[:, 1]) * HISTOGRAM_BINS
+    histogram = np.bincount(
+        codes + bins[:, 2], minlength=HISTOGRAM_BINS ** 3
+    ).astype(np.float32)
+    return histogram / np.linalg.norm(histogram)
+
+
+def hash_image(path):
+    """
+    Computes the hashes and the colour histogram of the image file.
+    :param path: str or Path
+    :return: tuple (int, int, numpy.ndarray)
+        phash, dhash and histogram of the image.
+    """
+    with Image.open(path) as image:
+        image.load()
+        return phash(image), dhash(image), color_histogram(image)
+
+
+def _hash_image_task(task):
+    """Runs in the worker process, see `hash_images`."""
+    checksum, path = task
+    try:
+        return (checksum,) + hash_image(path)
+    except (OSError, ValueError) as e:
+        logger.warning('Failed to read image %s: %s', path, e)
+        return checksum, None, None, None
+
+
+def hamming_distances(hashes, value):
+    """
+    :param hashes: numpy.ndarray of uint64
+    :param value: int or numpy.ndarray of uint64
+    :return: numpy.ndarray of uint8, the Hamming distances between
+        the hashes and the value (element-wise if it's an array).
+    """
+    diff = np.bitwise_xor(
+        np.asarray(hashes, dtype=np.uint64), np.asarray(value, np.uint64)
+    )
+    return POPCOUNT[np.atleast_1d(diff).view(np.uint8)].reshape(-1, 8).sum(
+        axis=1, dtype=np.uint8
+    )
+
+
+class ImageHashCache(SqliteStore):
+    """
+    Image hashes and histograms keyed by the image checksum. The
+    hashes are stored as hex strings, since SQLite integers are
+    signed; the hashes of images that failed to be read are NULL.
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS hashes (
+            checksum TEXT PRIMARY KEY,
+            phash TEXT,
+            dhash TEXT,
+            histogram BLOB
+        );
+    '''
+
+    def checksums(self):
+        """:return: set of str, the checksums of processed images."""
+        return {x for x, in self.execute('SELECT checksum FROM hashes')}
+
+    def put(self, checksum, phash_value, dhash_value, histogram):
+        if phash_value is None:
+            row = (checksum, None, None, None)
+        else:
+            row = (
+                checksum, f'{phash_value:016x}', f'{dhash_value:016x}',
+                histogram.astype(np.float32).tobytes()
+            )
+        self.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)', row)
+        self.modified()
+
+    def load(self):
+        """
+        Loads the hashes of the successfully processed images.
+        :return: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray,
+            numpy.ndarray)
+            Image checksums, phashes and dhashes (uint64) and
+            histograms (float32 matrix), the rows are sorted by
+            checksum.
+        """
+        rows = self.execute(
+            'SELECT checksum, phash, dhash, histogram FROM hashes '
+            'WHERE phash IS NOT NULL ORDER BY checksum'
+        ).fetchall()
+        checksums = np.array([x[0] for x in rows], dtype=object)
+        phashes = np.array([int(x[1], 16) for x in rows], dtype=np.uint64)
+        dhashes = np.array([int(x[2], 16) for x in rows], dtype=np.uint64)
+        histograms = np.frombuffer(
+            b''.join(x[3] for x in rows), dtype=np.float32
+        ).reshape(len(rows), HISTOGRAM_BINS ** 3)
+        return checksums, phashes, dhashes, histograms
+
+
+class HammingIndex:
+    """
+    Lookup of the hashes within the Hamming distance of a query hash.
+    The 64 bits are split into `max_distance + 1` bands, and each band
+    buckets the hashes by its bits (a sorted array of band values). Two
+    hashes within `max_distance` bits differ in at most `max_distance`
+    bands, so they share the bucket of at least one band: the union of
+    the query buckets contains all the neighbours, and only these
+    candidates are compared bit by bit.
+    """
+    def __init__(self, hashes, max_distance):
+        """
+        :param hashes: numpy.ndarray of uint64
+        :param max_distance: int
+            The maximum Hamming distance of the lookups.
+        """
+        if not 0 <= max_distance < HASH_SIZE ** 2:
+            raise ValueError(f'Invalid Hamming distance {max_distance}')
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.max_distance = max_distance
+
+        self._bands = []
+        shift = HASH_SIZE ** 2
+        for bits in np.array_split(np.arange(shift), max_distance + 1):
+            shift -= len(bits)
+            self._bands.append(
+                (np.uint64(shift), np.uint64((1 << len(bits)) - 1))
+            )
+        # Bucket of each band: sorted band values and their rows
+        self._buckets = []
+        for shift, mask in self._bands:
+            keys = (self.hashes >> shift) & mask
+            order = np.argsort(keys, kind='stable')
+            self._buckets.append((keys[order], order))
+
+    def query(self, value):
+        """
+        :param value: int
+        :return: tuple (numpy.ndarray, numpy.ndarray)
+            The rows of the hashes within `max_distance` bits of the
+            value and their distances, in the order of distance.
+        """
+        candidates = []
+        for (shift, mask), (keys, order) in zip(self._bands, self._buckets):
+            key = (np.uint64(value) >> shift) & mask
+            start = np.searchsorted(keys, key, side='left')
+            end = np.searchsorted(keys, key, side='right')
+            candidates.append(order[start:end])
+        rows = np.unique(np.concatenate(candidates))
+        distances = hamming_distances(self.hashes[rows], value)
+        keep = distances <= self.max_distance
+        rows, distances = rows[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return rows[order], distances[order]
+
+
+def hash_images(site, processes=None, chunksize=64):
+    """
+    Computes the hashes and histograms of the stored images of the
+    website, which aren't in the cache yet, in a pool of worker
+    processes (see the module docstring).
+    :param site: str
+        The shortest domain name of the website.
+    :param processes: int
+        The number of worker processes, defaults to the number of CPUs.
+    :param chunksize: int
+        The number of images sent to a worker process at once.
+    :return: dict
+        The numbers of stored, new and failed images and the elapsed
+        time in seconds.
+    """
+    _, images_path = config.get_scraping_output_paths(site)
+    started = time.perf_counter()
+    index_path = Path(images_path, SimpleImagesPipeline.INDEX_NAME)
+    with ImageIndex(index_path) as index:
+        files = dict(index.iter_files())
+
+    stats = {'images': len(files), 'new': 0, 'failed': 0}
+    with ImageHashCache(get_image_hashes_path(site)) as cache:
+        known = cache.checksums()
+        tasks = [
+            (checksum, str(Path(images_path, path)))
+            for checksum, path in files.items()
+            if checksum not in known and Path(images_path, path).exists()
+        ]
+        if tasks:
+            with multiprocessing.Pool(processes) as pool:
+                for result in pool.imap_unordered(
+                        _hash_image_task, tasks, chunksize):
+                    cache.put(*result)
+                    stats['new'] += 1
+                    stats['failed'] += result[1] is None
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def find_similar_images(site, checksum=None, image_path=None,
+                        max_distance=6):
+    """
+    Finds the cached images of the website near-duplicate to the
+    given one by the Hamming distance of their perceptual hashes.
+    :param site: str
+        The shortest domain name of the website.
+    :param checksum: str
+        The checksum of the cached image to find the similar ones to.
+    :param image_path: str
+        The path to the image file to find the similar ones to, used
+        if `checksum` is not given.
+    :param max_distance: int
+        The maximum Hamming distance between the phashes.
+    :return: list of dicts
+        checksum, phash and dhash distances and colour similarity
+        (cosine of histograms) of the similar images in the order of
+        the phash distance. The query image itself is not excluded.
+    """
+    with ImageHashCache(get_image_hashes_path(site)) as cache:
+        checksums, phashes, dhashes, histograms = cache.load()
+    if checksum is not None:
+        row = np.searchsorted(checksums, checksum)
+        if row == len(checksums) or checksums[row] != checksum:
+            raise KeyError(f'Image {checksum} is not hashed')
+        query = phashes[row], dhashes[row], histograms[row]
+    else:
+        query = hash_image(image_path)
+
+    rows, distances = HammingIndex(phashes, max_distance).query(query[0])
+    dhash_distances = hamming_distances(dhashes[rows], query[1])
+    similarities = histograms[rows] @ query[2]
+    return [
+        {
+            'checksum': checksums[row],
+            'phash_distance': int(distance),
+            'dhash_distance': int(dhash_distance),
+            'color_similarity': float(similarity),
+        }
+        for row, distance, dhash_distance, similarity in zip(
+            rows, distances, dhash_distances, similarities
+        )
+    ]
+
+
+@click.group('images')
+def images_cli():
+    """
+    Hash the downloaded images of the website and look up the
+    near-duplicate ones.
+    """
+
+
+@images_cli.command('hash')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to hash images of'
+)
+@click.option(
+    '--processes', '-p', type=int, default=None,
+    help='The number of worker processes [default: number of CPUs]'
+)
+@click.option(
+    '--chunksize', type=int, default=64, show_default=True,
+    help='The number of images sent to a worker process at once.'
+)
+def hash_images_cli(site, processes, chunksize):
+    """
+    Compute the perceptual hashes and colour histograms of the new
+    images of the website and add them to the cache.
+    """
+    stats = hash_images(site, processes, chunksize)
+    click.echo(
+        f'Hashed {stats["new"]} new of {stats["images"]} images '
+        f'({stats["failed"]} failed) in {stats["seconds"]:.1f} s'
+    )
+
+
+@images_cli.command('similar')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to search images of'
+)
+@click.option(
+    '--checksum', type=str, default=None,
+    help='The checksum of the hashed image to search similar ones to.'
+)
+@click.option(
+    '--image', 'image_path', type=click.Path(exists=True, dir_okay=False),
+    default=None, help='The image file to search similar ones to.'
+)
+@click.option(
+    '--max-distance', type=click.IntRange(0, 63), default=6,
+    show_default=True,
+    help='The maximum Hamming distance between the perceptual hashes.'
+)
+def similar_images_cli(site, checksum, image_path, max_distance):
+    """
+    Print the near-duplicate images of the given one: checksum, phash
+    and dhash distances and colour similarity.
+    """
+    if (checksum is None) == (image_path is None):
+        raise click.UsageError('Specify either --checksum or --image')
+    try:
+        similar = find_similar_images(
+            site, checksum, image_path, max_distance
+        )
+    except KeyError as e:
+        raise click.ClickException(e.args[0])
+    for record in similar:
+        click.echo(
+            f'{record["checksum"]}\t{record["phash_distance"]}\t'
+            f'{record["dhash_distance"]}\t{record["color_similarity"]:.3f}'
+        )
@@ -0,0 +1,572 @@
+"""
+Approximate nearest neighbour search over the item embeddings (see
+`build_embeddings`) by the cosine similarity with the inverted file
+index (IVF): the embeddings are clustered with spherical k-means, and
+a query is compared only with the items of the `n_probe` clusters
+(lists) closest to it instead of the entire catalog.
+
+The index of the website is stored in models/<site_py>/index/ as
+numpy arrays, which are memory-mapped on load.
+"""
+import click
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.common.paths import get_models_path
+from src.features.build_features import load_features
+from src.features.embeddings import build_embeddings, normalize_rows
+
+# Categorical fields, which values may be required to match the ones
+# of the query item
+FILTER_FIELDS = ['category', 'metal']
+# The maximum number of vectors multiplied by queries at once
+BATCH_SIZE = 65536
+# K-means is fitted on the sample of this number of points per cluster
+KMEANS_POINTS_PER_CLUSTER = 256
+
+
+def get_index_path(site):
+    """
+    Return the path to the similarity index of the website:
+    models/<site_py>/index/.
+    """
+    return Path(get_models_path(site), 'index')
+
+
+def _top_k(scores, ids, k):
+    """
+    Selects k best scores in each row.
+    :param scores: numpy.ndarray with shape (queries, candidates)
+    :param ids: numpy.ndarray with the same shape, candidate ids.
+    :return: tuple (numpy.ndarray, numpy.ndarray)
+        The best scores and their ids with shape (queries, k), sorted
+        in descending order of scores.
+    """
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    return (
+        np.take_along_axis(scores, best, axis=1),
+        np.take_along_axis(ids, best, axis=1),
+    )
+
+
+def assign_clusters(vectors, centroids):
+    """:return: numpy.ndarray, the closest centroid of each vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), BATCH_SIZE):
+        batch = np.asarray(vectors[start:start + BATCH_SIZE])
+        labels[start:start + len(batch)] = np.argmax(
+            batch @ centroids.T, axis=1
+        )
+    return labels
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """
+    Clusters the unit vectors by the cosine similarity.
+    :return: numpy.ndarray of float32 with shape (n_clusters, dimension),
+        the unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = KMEANS_POINTS_PER_CLUSTER * n_clusters
+    if len(vectors) > sample_size:
+        rows = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+        sample = np.asarray(vectors[rows], dtype=np.float32)
+    else:
+        sample = np.asarray(vectors, dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        labels = assign_clusters(sample, centroids)
+        # The sums of cluster members as the product of the sparse
+        # membership matrix and the sample
+        membership = sp.csr_matrix(
+            (np.ones(len(sample), dtype=np.float32),
+             (labels, np.arange(len(sample)))),
+            shape=(n_clusters, len(sample))
+        )
+        sums = np.asarray(membership @ sample)
+        # Empty clusters are restarted from random points
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty))]
+        centroids = normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index of unit vectors. The vectors are stored sorted
+    by their lists (clusters): the vectors of the list `i` occupy the
+    positions from `offsets[i]` to `offsets[i + 1]`, and `ids` contains
+    the original rows of the vectors. Optional `filters` contains
+    integer codes of the vectors metadata (e.g. categories) in the
+    same order, which can be required to match the query ones.
+    """
+    ARRAYS = ['centroids', 'vectors', 'ids', 'offsets', 'filters']
+
+    def __init__(self, centroids, vectors, ids, offsets, filters=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.filters = filters
+        # Original row -> position of the vector
+        self.positions = np.empty(len(ids), dtype=np.int64)
+        self.positions[ids] = np.arange(len(ids))
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, filters=None, n_lists=None, n_iter=10, seed=0):
+        """
+        :param vectors: numpy.ndarray with shape (rows, dimension)
+            Unit vectors to index.
+        :param filters: numpy.ndarray with shape (rows, fields) or None
+            Integer codes of the vectors metadata.
+        :param n_lists: int or None
+            The number of lists, the square root of the number of
+            vectors by default.
+        :param n_iter: int
+            The number of k-means iterations.
+        :return: IVFIndex
+        """
+        if n_lists is None:
+            n_lists = int(round(np.sqrt(len(vectors))))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        centroids = spherical_kmeans(vectors, n_lists, n_iter, seed)
+
+        labels = assign_clusters(vectors, centroids)
+        ids = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(
+            centroids, np.ascontiguousarray(vectors[ids], dtype=np.float32),
+            ids, offsets, None if filters is None else filters[ids]
+        )
+
+    def save(self, path):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        for name in self.ARRAYS:
+            if getattr(self, name) is not None:
+                np.save(Path(path, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = {
+            name: np.load(Path(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in cls.ARRAYS if Path(path, f'{name}.npy').exists()
+        }
+        return cls(**arrays)
+
+    def get_vectors(self, rows):
+        """:return: the vectors of the original rows."""
+        return np.asarray(self.vectors[self.positions[rows]])
+
+    def get_filters(self, rows):
+        """:return: the metadata codes of the original rows."""
+        return np.asarray(self.filters[self.positions[rows]])
+
+    def _search_lists(self, queries, probes, best_scores, best_ids,
+                      filter_codes=None, exclude=None):
+        """
+        Merges the vectors of the probed lists into the best results of
+        the queries. The queries are processed in a batch: each list is
+        compared with all the queries probing it by a single matrix
+        product.
+        :param probes: numpy.ndarray with shape (queries, lists)
+            The lists probed by each query.
+        See `search` for the description of other parameters.
+        :return: tuple (numpy.ndarray, numpy.ndarray)
+            The updated best scores and ids of the queries.
+        """
+        k = best_scores.shape[1]
+        for lst in np.unique(probes):
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            if start == end:
+                continue
+            q = np.flatnonzero((probes == lst).any(axis=1))
+            scores = queries[q] @ np.asarray(self.vectors[start:end]).T
+            ids = np.broadcast_to(self.ids[start:end], scores.shape)
+
+            if filter_codes is not None:
+                codes = filter_codes[q][:, None, :]
+                allowed = (
+                    (np.asarray(self.filters[start:end])[None] == codes)
+                    | (codes < 0)
+                ).all(axis=2)
+                scores = np.where(allowed, scores, -np.inf)
+            if exclude is not None:
+                scores = np.where(ids == exclude[q][:, None], -np.inf, scores)
+
+            best_scores[q], best_ids[q] = _top_k(
+                np.hstack([best_scores[q], scores]),
+                np.hstack([best_ids[q], ids]), k
+            )
+        return best_scores, best_ids
+
+    def search(self, queries, k=10, n_probe=8, filter_codes=None,
+               exclude=None, widen=True):
+        """
+        Finds approximately the most similar vectors to the queries.
+        :param queries: numpy.ndarray with shape (queries, dimension)
+            Unit query vectors.
+        :param k: int
+            The number of results per query.
+        :param n_probe: int
+            The number of the closest lists searched per query.
+        :param filter_codes: numpy.ndarray with shape (queries, fields)
+            The metadata codes the results must have, -1 means any.
+        :param exclude: numpy.ndarray with shape (queries,) or None
+            The row excluded from the results of each query (e.g. the
+            query item itself), -1 means none.
+        :param widen: bool
+            Whether to probe the next closest lists (twice as many each
+            time) for the queries with less than k results, e.g. since
+            the probed lists have few vectors matching the filters.
+        :return: tuple (numpy.ndarray, numpy.ndarray)
+            Rows and scores (cosine similarities) of the results with
+            shape (queries, k), the missing results have -1 rows.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        n_probe = min(n_probe, self.n_lists)
+        similarities = queries @ self.centroids.T
+        probes = np.argpartition(-similarities, n_probe - 1, axis=1)[
+            :, :n_probe
+        ]
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores, best_ids = self._search_lists(
+            queries, probes, best_scores, best_ids, filter_codes, exclude
+        )
+
+        pending = np.flatnonzero(np.isneginf(best_scores).any(axis=1))
+        if widen and len(pending) and n_probe < self.n_lists:
+            # The lists not probed yet in the order of similarity
+            ranking = np.argsort(-similarities[pending], axis=1, kind='stable')
+            probed = np.zeros((len(pending), self.n_lists), dtype=bool)
+            np.put_along_axis(probed, probes[pending], True, axis=1)
+            keep = ~np.take_along_axis(probed, ranking, axis=1)
+            rest = ranking[keep].reshape(len(pending), -1)
+            start = 0
+            while len(pending) and start < rest.shape[1]:
+                end = start + max(n_probe, start)
+                pending_scores, pending_ids = self._search_lists(
+                    queries[pending], rest[:, start:end],
+                    best_scores[pending], best_ids[pending],
+                    None if filter_codes is None else filter_codes[pending],
+                    None if exclude is None else exclude[pending]
+                )
+                best_scores[pending] = pending_scores
+                best_ids[pending] = pending_ids
+                left = np.isneginf(pending_scores).any(axis=1)
+                pending, rest = pending[left], rest[left]
+                start = end
+
+        best_ids[np.isneginf(best_scores)] = -1
+        return best_ids, best_scores
+
+
+def brute_force_search(vectors, queries, k=10, exclude=None, filters=None,
+                       filter_codes=None):
+    """
+    Finds exactly the most similar vectors to the queries.
+    :param filters: numpy.ndarray with shape (rows, fields) or None
+        Integer codes of the vectors metadata.
+    See `IVFIndex.search` for the description of other parameters.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(vectors), BATCH_SIZE):
+        batch = np.asarray(vectors[start:start + BATCH_SIZE])
+        scores = queries @ batch.T
+        ids = np.broadcast_to(
+            np.arange(start, start + len(batch)), scores.shape
+        )
+        if filter_codes is not None:
+            codes = filter_codes[:, None, :]
+            allowed = (
+                (np.asarray(filters[start:start + len(batch)])[None] == codes)
+                | (codes < 0)
+            ).all(axis=2)
+            scores = np.where(allowed, scores, -np.inf)
+        if exclude is not None:
+            scores = np.where(ids == exclude[:, None], -np.inf, scores)
+        best_scores, best_ids = _top_k(
+            np.hstack([best_scores, scores]), np.hstack([best_ids, ids]), k
+        )
+    best_ids[np.isneginf(best_scores)] = -1
+    return best_ids, best_scores
+
+
+def evaluate_recall(index, vectors, k=10, n_probe=8, sample=1000, seed=0,
+                    filters=None):
+    """
+    Measures recall@k of the index against the brute-force search for
+    the random sample of indexed vectors (excluding themselves).
+    :param filters: numpy.ndarray with shape (rows, fields) or None
+        Integer codes of the vectors metadata, if specified, the
+        results are required to have the same codes as the queries.
+    :return: dict, recall and timings of both searches.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(sample, len(vectors)), replace=False)
+    queries = np.asarray(vectors[rows])
+    filter_codes = None if filters is None else np.asarray(filters[rows])
+
+    start = time.perf_counter()
+    approximate, _ = index.search(
+        queries, k, n_probe, filter_codes, exclude=rows
+    )
+    ann_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    exact, _ = brute_force_search(
+        vectors, queries, k, rows, filters, filter_codes
+    )
+    exact_seconds = time.perf_counter() - start
+
+    found, total = 0, 0
+    for approximate_row, exact_row in zip(approximate, exact):
+        exact_row = exact_row[exact_row >= 0]
+        found += len(np.intersect1d(approximate_row, exact_row))
+        total += len(exact_row)
+    return {
+        'k': k,
+        'n_probe': n_probe,
+        'queries': len(rows),
+        'recall': found / total if total else None,
+        'ann_seconds': ann_seconds,
+        'exact_seconds': exact_seconds,
+    }
+
+
+def build_index(site, n_lists=None, n_iter=10, text_components=64,
+                n_probe=8, k=10, recall_sample=1000):
+    """
+    Builds the embeddings of the website products from their features
+    (see `build_features`), indexes them and saves the index together
+    with the product SKUs and the metadata. The index folder is
+    replaced atomically.
+    :return: dict, the metadata of the index including the recall
+        measured against the brute-force search (without filters and
+        with the results required to match all the FILTER_FIELDS).
+    """
+    features = load_features(site)
+    vectors = build_embeddings(features, text_components)
+    columns = features['meta']['categorical_columns']
+    filters = np.asarray(features['categorical'])[
+        :, [columns.index(x) for x in FILTER_FIELDS]
+    ]
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, filters, n_lists, n_iter)
+    meta = {
+        'site': site,
+        'rows': len(vectors),
+        'dimension': vectors.shape[1],
+        'n_lists': index.n_lists,
+        'text_components': text_components,
+        'build_seconds': time.perf_counter() - start,
+        'filter_fields': FILTER_FIELDS,
+        'filter_vocab': {x: features['vocab'][x] for x in FILTER_FIELDS},
+        'recall': evaluate_recall(index, vectors, k, n_probe, recall_sample),
+        # The results of the same values of all FILTER_FIELDS
+        'filtered_recall': evaluate_recall(
+            index, vectors, k, n_probe, recall_sample, filters=filters
+        ),
+    }
+
+    index_path = get_index_path(site)
+    tmp_path = Path(str(index_path) + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    index.save(tmp_path)
+    np.save(Path(tmp_path, 'skus.npy'), np.asarray(features['skus']))
+    with Path(tmp_path, 'meta.json').open('w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    if index_path.exists():
+        shutil.rmtree(index_path)
+    os.replace(tmp_path, index_path)
+    return meta
+
+
+def load_index(site, mmap_mode='r'):
+    """
+    :return: tuple (IVFIndex, numpy.ndarray, dict)
+        The index of the website, SKUs of its rows and its metadata.
+    """
+    path = get_index_path(site)
+    with Path(path, 'meta.json').open(encoding='utf-8') as f:
+        meta = json.load(f)
+    skus = np.load(Path(path, 'skus.npy'), mmap_mode=mmap_mode)
+    return IVFIndex.load(path, mmap_mode), skus, meta
+
+
+def query_index(site, skus=None, vectors=None, k=10, n_probe=8, same=()):
+    """
+    Finds the most similar products of the website to the given ones
+    (the products themselves are excluded) or to the given vectors.
+    :param skus: list of str or None
+        SKUs of the query products.
+    :param vectors: numpy.ndarray or None
+        Query vectors, used if SKUs aren't specified.
+    :param same: list of str
+        The fields of FILTER_FIELDS, which values of the results must
+        be the same as the ones of the query products.
+    :return: list of lists of tuples (str, float)
+        SKUs and similarities of the results for each query.
+    """
+    index, index_skus, meta = load_index(site)
+    exclude, filter_codes = None, None
+    if skus is not None:
+        rows = {sku: row for row, sku in enumerate(index_skus)}
+        missing = [x for x in skus if x not in rows]
+        if missing:
+            raise KeyError(f'Unknown SKUs: {", ".join(missing)}')
+        exclude = np.array([rows[x] for x in skus])
+        vectors = index.get_vectors(exclude)
+        if same:
+            filter_codes = index.get_filters(exclude).copy()
+            for i, field in enumerate(meta['filter_fields']):
+                if field not in same:
+                    filter_codes[:, i] = -1
+    elif same:
+        raise ValueError('Filters require SKUs of the query products')
+
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    result_rows, scores = index.search(
+        vectors, k, n_probe, filter_codes, exclude
+    )
+    return [
+        [
+            (index_skus[row], float(score))
+            for row, score in zip(query_rows, query_scores) if row >= 0
+        ]
+        for query_rows, query_scores in zip(result_rows, scores)
+    ]
+
+
+@click.group('index')
+def index_cli():
+    """
+    Build and query the similarity index of the website products.
+    """
+
+
+@index_cli.command('build')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to build the index of'
+)
+@click.option(
+    '--lists', type=int, default=None,
+    help='The number of index lists [default: sqrt of the number of items]'
+)
+@click.option(
+    '--iterations', type=int, default=10, show_default=True,
+    help='The number of k-means iterations.'
+)
+@click.option(
+    '--text-components', type=int, default=64, show_default=True,
+    help='The number of SVD components of the text features.'
+)
+@click.option(
+    '--probe', type=int, default=8, show_default=True,
+    help='The number of lists searched per query to measure recall.'
+)
+@click.option(
+    '--top-k', type=int, default=10, show_default=True,
+    help='The number of results per query to measure recall.'
+)
+@click.option(
+    '--recall-sample', type=int, default=1000, show_default=True,
+    help='The number of queries to measure recall.'
+)
+def build_index_cli(site, lists, iterations, text_components, probe, top_k,
+                    recall_sample):
+    """
+    Build the similarity index over the embeddings of the website
+    products and report its recall against the brute-force search.
+    """
+    meta = build_index(
+        site, lists, iterations, text_components, probe, top_k, recall_sample
+    )
+    click.echo(
+        f'Indexed {meta["rows"]} items in {meta["n_lists"]} lists, '
+        f'{meta["dimension"]} dimensions'
+    )
+    for name, recall in [('all', meta['recall']),
+                         ('same ' + ', '.join(FILTER_FIELDS),
+                          meta['filtered_recall'])]:
+        click.echo(
+            f'recall@{recall["k"]} (probe {recall["n_probe"]}, {name}): '
+            f'{recall["recall"]:.3f}, '
+            f'{recall["ann_seconds"]:.3f}s vs '
+            f'{recall["exact_seconds"]:.3f}s brute-force for '
+            f'{recall["queries"]} queries'
+        )
+
+
+@index_cli.command('query')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to search products of'
+)
+@click.option(
+    '--sku', 'skus', type=str, multiple=True,
+    help='SKU of the query product (may be specified several times)'
+)
+@click.option(
+    '--vector-file', type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='The .npy file with query vectors (one per row)'
+)
+@click.option(
+    '--top-k', type=int, default=10, show_default=True,
+    help='The number of results per query.'
+)
+@click.option(
+    '--probe', type=int, default=8, show_default=True,
+    help='The number of index lists searched per query.'
+)
+@click.option(
+    '--same', type=click.Choice(FILTER_FIELDS), multiple=True,
+    help='Require the results to have the same field value as the query '
+         'product (may be specified several times)'
+)
+def query_index_cli(site, skus, vector_file, top_k, probe, same):
+    """
+    Find the products most similar to the given ones or to the given
+    vectors.
+    """
+    if skus:
+        queries, vectors = list(skus), None
+    elif vector_file:
+        vectors = np.load(vector_file)
+        queries = [f'vector {i}' for i in range(len(vectors))]
+    else:
+        raise click.UsageError('Specify --sku or --vector-file')
+
+    try:
+        results = query_index(
+            site, skus or None, vectors, top_k, probe, same
+        )
+    except (KeyError, ValueError) as e:
+        raise click.UsageError(str(e.args[0]))
+
+    for query, query_results in zip(queries, results):
+        click.echo(f'{query}:')
+        for rank, (sku, score) in enumerate(query_results, 1):
+            click.echo(f'{rank:>4}. {sku} {score:.4f}')
@@ -0,0 +1,345 @@
+"""
+Streaming generator of the labelled item pairs of the website for
+training the similarity models. The pair set of the catalog is never
+materialized: the items are grouped once (O(items) memory), and the
+pairs are sampled batch by batch.
+
+Each anchor item gets one positive and `negatives` negative pairs:
+- positives share the collection or the duplicate cluster (the
+  canonical id of `deduplicate`, i.e. the same product listed under
+  several SKUs) with the anchor;
+- hard negatives have the same category and metal as the anchor but
+  another collection and cluster, the rest of negatives are sampled
+  from the whole catalog (easy negatives).
+Items without any positive aren't anchors (but may be negatives).
+
+The anchors are shuffled per epoch and split into chunks, each chunk
+produces one batch. The randomness of a chunk depends only on the
+seed, the epoch and the chunk number, and the chunks are dealt to the
+shards round-robin, so the union of the shard batches is the same for
+any number of shards.
+"""
+import click
+import contextlib
+import csv
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.common.paths import get_canonical_ids_path, get_site_py
+from src.features.build_features import load_features
+
+# The items with the same (non-missing) value are positives
+POSITIVE_FIELDS = ['collection']
+# Hard negatives have the same values of the fields as the anchor
+STRATUM_FIELDS = ['category', 'metal']
+# The number of attempts to sample a negative unrelated to the anchor
+NEGATIVE_ATTEMPTS = 4
+
+
+class Groups:
+    """
+    Items grouped by integer codes (0 is no group): the item rows
+    sorted by code, and the start, the size of each item's group in
+    them and the item position in its group.
+    """
+    def __init__(self, codes):
+        """
+        :param codes: numpy.ndarray of int with shape (items,)
+        """
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.order = np.argsort(self.codes, kind='stable')
+        sorted_codes = self.codes[self.order]
+        starts = np.searchsorted(sorted_codes, sorted_codes, side='left')
+        ends = np.searchsorted(sorted_codes, sorted_codes, side='right')
+        self.start = np.empty(len(self.codes), dtype=np.int64)
+        self.size = np.empty(len(self.codes), dtype=np.int64)
+        self.position = np.empty(len(self.codes), dtype=np.int64)
+        self.start[self.order] = starts
+        self.size[self.order] = ends - starts
+        self.position[self.order] = np.arange(len(self.codes)) - starts
+        self.size[self.codes == 0] = 0
+
+    def sample_other(self, rows, rng):
+        """
+        Samples another member of the group of each item, the items
+        must be in groups of two or more members.
+        :return: numpy.ndarray of int64
+        """
+        sizes = self.size[rows]
+        offset = 1 + (rng.random(len(rows)) * (sizes - 1)).astype(np.int64)
+        return self.order[
+            self.start[rows] + (self.position[rows] + offset) % sizes
+        ]
+
+    def sample_any(self, rows, rng):
+        """Samples a member (maybe the item itself) of each group."""
+        offset = (rng.random(len(rows)) * self.size[rows]).astype(np.int64)
+        return self.order[self.start[rows] + offset]
+
+
+def _encode(values):
+    """:return: numpy.ndarray of int64, 1-based codes of the values."""
+    values = np.asarray(values)
+    _, codes = np.unique(
+        values, axis=0 if values.ndim > 1 else None, return_inverse=True
+    )
+    return codes.ravel().astype(np.int64) + 1
+
+
+class PairSampler:
+    """
+    Samples the training pairs of the items (see the module docstring).
+    """
+    def __init__(self, positive_codes, stratum_codes, negatives=3,
+                 hard_ratio=.5):
+        """
+        :param positive_codes: list of numpy.ndarray of int
+            The group codes of the items (0 is no group) per positive
+            kind: the items of the same group are positives.
+        :param stratum_codes: numpy.ndarray of int
+            The codes of the hard negatives strata of the items.
+        :param negatives: int
+            The number of negative pairs per anchor.
+        :param hard_ratio: float
+            The share of hard negatives among the negatives.
+        """
+        self.positives = [Groups(x) for x in positive_codes]
+        self.strata = Groups(stratum_codes)
+        self.n_items = len(self.strata.codes)
+        self.negatives = negatives
+        self.hard_negatives = int(round(negatives * hard_ratio))
+        self.anchors = np.flatnonzero(np.any(
+            [x.size >= 2 for x in self.positives], axis=0
+        )) if self.positives else np.zeros(0, dtype=np.int64)
+
+    @property
+    def pairs_per_anchor(self):
+        return 1 + self.negatives
+
+    def _related(self, left, right):
+        """Whether the items are the same or in the same positive group."""
+        related = left == right
+        for groups in self.positives:
+            codes = groups.codes
+            related |= (codes[left] == codes[right]) & (codes[left] != 0)
+        return related
+
+    def _sample_positives(self, anchors, rng):
+        # A random kind of the ones the anchor has a positive of
+        valid = np.array([x.size[anchors] >= 2 for x in self.positives])
+        kinds = np.argmax(rng.random(valid.shape) * valid, axis=0)
+        partners = np.empty(len(anchors), dtype=np.int64)
+        for kind, groups in enumerate(self.positives):
+            mask = kinds == kind
+            partners[mask] = groups.sample_other(anchors[mask], rng)
+        return partners
+
+    def _sample_negatives(self, anchors, hard, rng):
+        """
+        :return: numpy.ndarray of int64
+            Negative partners of the anchors, -1 if none was found.
+        """
+        partners = np.full(len(anchors), -1, dtype=np.int64)
+        pending = np.arange(len(anchors))
+        for attempt in range(2 * NEGATIVE_ATTEMPTS):
+            if not len(pending):
+                break
+            if hard and attempt < NEGATIVE_ATTEMPTS:
+                candidates = self.strata.sample_any(anchors[pending], rng)
+            else:
+                # Fall back to easy negatives for small strata
+                candidates = rng.integers(self.n_items, size=len(pending))
+            found = ~self._related(anchors[pending], candidates)
+            partners[pending[found]] = candidates[found]
+            pending = pending[~found]
+        return partners
+
+    def sample(self, anchors, rng):
+        """
+        Samples the pairs of the anchors in random order.
+        :param anchors: numpy.ndarray of int
+        :param rng: numpy.random.Generator
+        :return: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Left and right item rows and labels (1 for positives,
+            0 for negatives) of the pairs.
+        """
+        left = [anchors]
+        right = [self._sample_positives(anchors, rng)]
+        labels = [np.ones(len(anchors), dtype=np.int8)]
+        for i in range(self.negatives):
+            partners = self._sample_negatives(
+                anchors, i < self.hard_negatives, rng
+            )
+            found = partners >= 0
+            left.append(anchors[found])
+            right.append(partners[found])
+            labels.append(np.zeros(found.sum(), dtype=np.int8))
+
+        order = rng.permutation(sum(len(x) for x in left))
+        return (
+            np.concatenate(left)[order],
+            np.concatenate(right)[order],
+            np.concatenate(labels)[order],
+        )
+
+    def count_batches(self, batch_size):
+        anchors_per_batch = -(-batch_size // self.pairs_per_anchor)
+        return -(-len(self.anchors) // anchors_per_batch)
+
+    def iter_batches(self, batch_size, epoch=0, seed=0, shard=0,
+                     num_shards=1):
+        """
+        Generates the batches of pairs of the shard. All the batches
+        have `batch_size` pairs except for the last one (and except for
+        the anchors without unrelated items to sample negatives from).
+        :param batch_size: int
+        :param epoch: int
+            The epoch, which the anchors are shuffled for.
+        :param seed: int
+        :param shard: int
+            The shard of the batches, from 0 to `num_shards` - 1.
+        :param num_shards: int
+            The number of shards (e.g. training worker processes).
+        :return:
+            Nothing, but tuples of numpy arrays (left, right, labels)
+            are generated (see `sample`).
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError(f'Invalid shard {shard} of {num_shards}')
+        anchors = np.random.default_rng([seed, epoch]).permutation(
+            self.anchors
+        )
+        anchors_per_batch = -(-batch_size // self.pairs_per_anchor)
+        for chunk in range(shard, self.count_batches(batch_size),
+                           num_shards):
+            rng = np.random.default_rng([seed, epoch, chunk])
+            start = chunk * anchors_per_batch
+            left, right, labels = self.sample(
+                anchors[start:start + anchors_per_batch], rng
+            )
+            yield left[:batch_size], right[:batch_size], labels[:batch_size]
+
+
+def load_families(site, skus):
+    """
+    Reads the duplicate clusters of the website items (see
+    `deduplicate`).
+    :param skus: numpy.ndarray of str
+    :return: numpy.ndarray of int64 or None
+        The codes of the clusters of the items (0 if the item isn't
+        clustered), None if the canonical ids aren't built.
+    """
+    path = get_canonical_ids_path()
+    if not path.exists():
+        return None
+    table = pd.read_csv(
+        path, dtype=str, usecols=['site', 'sku', 'canonical_id']
+    )
+    table = table[table['site'] == get_site_py(site)]
+    clusters = pd.Series(table['canonical_id'].to_numpy(), table['sku'])
+    clusters = clusters[~clusters.index.duplicated()]
+    ids = clusters.reindex(np.asarray(skus, dtype=str)).to_numpy()
+    codes = np.zeros(len(ids), dtype=np.int64)
+    known = pd.notna(ids)
+    if known.any():
+        codes[known] = _encode(ids[known].astype(str))
+    return codes
+
+
+def load_pair_sampler(site, negatives=3, hard_ratio=.5):
+    """
+    Creates the pair sampler of the website items from their features
+    (see `build_features`) and duplicate clusters.
+    See `PairSampler` for the description of parameters.
+    :return: tuple (PairSampler, dict)
+        The sampler and the memory-mapped features of the items, the
+        rows of the features are the ones of the pairs.
+    """
+    features = load_features(site)
+    columns = features['meta']['categorical_columns']
+    categorical = features['categorical']
+
+    positive_codes = [
+        np.asarray(categorical[:, columns.index(x)]) for x in POSITIVE_FIELDS
+    ]
+    families = load_families(site, features['skus'])
+    if families is not None:
+        positive_codes.append(families)
+    stratum_codes = _encode(np.asarray(
+        categorical[:, [columns.index(x) for x in STRATUM_FIELDS]]
+    ))
+    sampler = PairSampler(positive_codes, stratum_codes, negatives, hard_ratio)
+    return sampler, features
+
+
+@click.command('pairs')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to generate pairs of'
+)
+@click.option(
+    '--batch-size', type=int, default=1024, show_default=True,
+    help='The number of pairs per batch.'
+)
+@click.option(
+    '--negatives', type=int, default=3, show_default=True,
+    help='The number of negative pairs per positive one.'
+)
+@click.option(
+    '--hard-ratio', type=click.FloatRange(0, 1), default=.5,
+    show_default=True,
+    help='The share of hard negatives (the same category and metal).'
+)
+@click.option(
+    '--epoch', type=int, default=0, show_default=True,
+    help='The epoch to generate pairs of.'
+)
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option(
+    '--shard', type=int, default=0, show_default=True,
+    help='The shard of pairs to generate.'
+)
+@click.option(
+    '--num-shards', type=int, default=1, show_default=True,
+    help='The number of shards.'
+)
+@click.option(
+    '--output', '-o', type=click.Path(dir_okay=False), default=None,
+    help='The csv file to write the pairs to (left_sku, right_sku, '
+         'label) [default: only measure the generation speed]'
+)
+def pairs_cli(site, batch_size, negatives, hard_ratio, epoch, seed, shard,
+              num_shards, output):
+    """
+    Generate the training pairs of the website items: positives of the
+    same collection or duplicate cluster and hard negatives of the same
+    category and metal.
+    """
+    sampler, features = load_pair_sampler(site, negatives, hard_ratio)
+    skus = features['skus']
+    batches = sampler.iter_batches(
+        batch_size, epoch, seed, shard, num_shards
+    )
+
+    start = time.perf_counter()
+    counts = np.zeros(2, dtype=np.int64)
+    writer = None
+    with contextlib.ExitStack() as stack:
+        if output:
+            writer = csv.writer(stack.enter_context(
+                open(output, 'w', newline='', encoding='utf-8')
+            ))
+            writer.writerow(['left_sku', 'right_sku', 'label'])
+        for left, right, labels in batches:
+            counts += np.bincount(labels, minlength=2)
+            if writer is not None:
+                writer.writerows(zip(skus[left], skus[right], labels))
+    seconds = time.perf_counter() - start
+
+    click.echo(
+        f'Generated {counts[1]} positive and {counts[0]} negative pairs '
+        f'of {len(sampler.anchors)} anchors in {seconds:.2f} s '
+        f'({counts.sum() / max(seconds, 1e-9):.0f} pairs/s)'
+    )
@@ -0,0 +1,470 @@
+"""
+HTTP service answering the similarity queries of the storefront over
+the similarity index of the website (see `build_index`).
+
+Endpoints:
+- GET /similar?sku=<sku>[&k=10][&same=category][&same=metal] -
+  the most similar products to the given one;
+- GET /stats - request latency percentiles, cache hit rate and
+  batching statistics of the worker as json;
+- GET /metrics - the same metrics in the Prometheus text format;
+- GET /health.
+
+Concurrent queries are collected into micro-batches, each answered by
+a single vectorized search (see `IVFIndex.search`), and the results
+for hot SKUs are kept in an LRU cache. The index arrays are
+memory-mapped, so several worker processes listening on the same port
+(SO_REUSEPORT) share one copy of them in the page cache.
+"""
+import asyncio
+import click
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from src.common.metrics import FAST_BUCKETS, REGISTRY
+from src.models.index import load_index
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of results per query
+MAX_K = 100
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'jsim_serve_request_seconds',
+    'Latency of the similarity service requests.',
+    FAST_BUCKETS
+)
+BATCH_SIZE = REGISTRY.histogram(
+    'jsim_serve_batch_size',
+    'The number of queries answered by a single search.',
+    (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    'jsim_serve_cache_requests',
+    'Similarity queries by the result cache status (hit or miss).'
+)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """Keeps the most recently used `max_size` values."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        value = self._values.get(key)
+        if value is not None:
+            self._values.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+
+class QueryBatcher:
+    """
+    Collects concurrent queries into batches answered by a single call
+    of the search function in the thread pool. A batch is started by
+    the first query and includes the queries arriving within `max_wait`
+    seconds (up to `max_batch` ones); the queries arriving while the
+    search runs form the next batch.
+    """
+    def __init__(self, search, max_batch=64, max_wait=.001):
+        """
+        :param search: callable
+            Takes the list of queries and returns the list of results.
+        """
+        self.search = search
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        # The queue is bound to the running event loop in Python < 3.10
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def query(self, query):
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            BATCH_SIZE.labels().observe(len(batch))
+            queries = [query for query, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    None, self.search, queries
+                )
+            except Exception as e:
+                logger.exception('Batch search failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+
+class SimilarityService:
+    """
+    Answers the similarity queries by SKUs with the memory-mapped index
+    of the website, micro-batching and result caching.
+    """
+    def __init__(self, site, n_probe=8, cache_size=10000, max_batch=64,
+                 max_wait=.001):
+        self.site = site
+        self.n_probe = n_probe
+        self.index, skus, self.meta = load_index(site)
+        self.rows = {sku: row for row, sku in enumerate(skus.tolist())}
+        self.skus = skus
+        self.filter_fields = self.meta['filter_fields']
+        self.cache = LRUCache(cache_size)
+        self.batcher = QueryBatcher(self.search, max_batch, max_wait)
+        # Concurrent queries missing the cache share a single search
+        self._pending = {}
+
+    def search(self, queries):
+        """
+        :param queries: list of tuples (int, int, tuple of str)
+            Rows of the query products, the numbers of results and
+            the fields which values must be the same.
+        :return: list of lists of dicts, the results of each query.
+        """
+        rows = np.array([row for row, _, _ in queries])
+        k = max(k for _, k, _ in queries)
+        filter_codes = None
+        if any(same for _, _, same in queries):
+            filter_codes = self.index.get_filters(rows).copy()
+            same_mask = np.array([
+                [field in same for field in self.filter_fields]
+                for _, _, same in queries
+            ])
+            filter_codes[~same_mask] = -1
+
+        result_rows, scores = self.index.search(
+            self.index.get_vectors(rows), k, self.n_probe, filter_codes,
+            exclude=rows
+        )
+        found_rows = result_rows[result_rows >= 0]
+        found_filters = dict(zip(
+            found_rows.tolist(),
+            self.index.get_filters(found_rows).tolist() if len(found_rows)
+            else []
+        ))
+        vocab = self.meta['filter_vocab']
+
+        results = []
+        for (_, query_k, _), query_rows, query_scores in zip(
+                queries, result_rows.tolist(), scores.tolist()):
+            result = []
+            for row, score in zip(query_rows[:query_k], query_scores):
+                if row < 0:
+                    break
+                item = {'sku': self.skus[row], 'score': round(score, 6)}
+                for field, code in zip(self.filter_fields, found_filters[row]):
+                    item[field] = vocab[field][code - 1] if code else None
+                result.append(item)
+            results.append(result)
+        return results
+
+    async def similar(self, sku, k=10, same=()):
+        row = self.rows.get(sku)
+        if row is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f'Unknown SKU: {sku}')
+        key = (row, k, tuple(sorted(same)))
+        result = self.cache.get(key)
+        if result is not None:
+            CACHE_REQUESTS.labels(status='hit').inc()
+            return result
+
+        CACHE_REQUESTS.labels(status='miss').inc()
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(
+                self.batcher.query(key)
+            )
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        result = await asyncio.shield(future)
+        self.cache.put(key, result)
+        return result
+
+    def stats(self):
+        latency = REQUEST_SECONDS.labels(endpoint='similar')
+        batch_size = BATCH_SIZE.labels()
+        hits = CACHE_REQUESTS.labels(status='hit').value
+        misses = CACHE_REQUESTS.labels(status='miss').value
+        return {
+            'site': self.site,
+            'pid': os.getpid(),
+            'items': len(self.rows),
+            'requests': latency.count,
+            'latency_seconds': {
+                'mean': latency.to_dict()['mean'],
+                'p50': latency.quantile(.5),
+                'p99': latency.quantile(.99),
+            },
+            'cache': {
+                'size': len(self.cache),
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None,
+            },
+            'batches': {
+                'count': batch_size.count,
+                'mean_size': batch_size.to_dict()['mean'],
+            },
+        }
+
+    async def route(self, method, target):
+        """
+        :return: tuple (HTTPStatus, str, bytes)
+            Status, content type and body of the response.
+        """
+        if method != 'GET':
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'Use GET')
+        url = urlsplit(target)
+        if url.path == '/similar':
+            params = parse_qs(url.query)
+            try:
+                sku = params['sku'][0]
+                k = int(params.get('k', ['10'])[0])
+            except (KeyError, ValueError):
+                raise HttpError(
+                    HTTPStatus.BAD_REQUEST, 'Specify sku and integer k'
+                )
+            same = params.get('same', [])
+            if not 0 < k <= MAX_K or set(same) - set(self.filter_fields):
+                raise HttpError(
+                    HTTPStatus.BAD_REQUEST,
+                    f'k must be from 1 to {MAX_K} and same one of '
+                    f'{", ".join(self.filter_fields)}'
+                )
+            result = {'sku': sku, 'results': await self.similar(sku, k, same)}
+        elif url.path == '/stats':
+            result = self.stats()
+        elif url.path == '/metrics':
+            return HTTPStatus.OK, 'text/plain; version=0.0.4', \
+                REGISTRY.render().encode('utf-8')
+        elif url.path == '/health':
+            result = {'status': 'ok'}
+        else:
+            raise HttpError(HTTPStatus.NOT_FOUND, 'Not found')
+        return HTTPStatus.OK, 'application/json', \
+            json.dumps(result, ensure_ascii=False).encode('utf-8')
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests of the connection (keep-alive)."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                # The body of the invalid length can't be skipped, the
+                # connection is closed after the error response
+                if length > 0:
+                    await reader.readexactly(length)
+
+                start = time.perf_counter()
+                parts = request_line.decode('latin-1').split()
+                version = parts[2] if len(parts) == 3 else 'HTTP/1.0'
+                try:
+                    if len(parts) != 3:
+                        raise HttpError(
+                            HTTPStatus.BAD_REQUEST, 'Malformed request'
+                        )
+                    if length < 0:
+                        raise HttpError(
+                            HTTPStatus.BAD_REQUEST, 'Invalid Content-Length'
+                        )
+                    status, content_type, body = await self.route(
+                        parts[0], parts[1]
+                    )
+                except HttpError as e:
+                    status, content_type = e.status, 'application/json'
+                    body = json.dumps({'error': str(e)}).encode('utf-8')
+                except Exception:
+                    logger.exception('Failed to serve %s', parts[1])
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    content_type = 'application/json'
+                    body = b'{"error": "Internal server error"}'
+                endpoint = urlsplit(parts[1]).path.strip('/') \
+                    if len(parts) == 3 else ''
+                if endpoint == 'similar':
+                    REQUEST_SECONDS.labels(endpoint=endpoint).observe(
+                        time.perf_counter() - start
+                    )
+
+                keep_alive = (
+                    version == 'HTTP/1.1' and length >= 0
+                    and headers.get('connection', '').lower() != 'close'
+                )
+                writer.write(
+                    f'{version} {status.value} {status.phrase}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Length: {len(body)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}'
+                    f'\r\n\r\n'.encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, host, port, reuse_port=False):
+        self.batcher.start()
+        server = await asyncio.start_server(
+            self.handle_connection, host, port, reuse_port=reuse_port or None
+        )
+        logger.info(
+            'Serving %s similarities at http://%s:%d (pid %d)',
+            self.site, host, port, os.getpid()
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.stop()
+
+
+def _run_worker(site, host, port, reuse_port, options):
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s'
+    )
+    service = SimilarityService(site, **options)
+    try:
+        asyncio.run(service.run(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(site, host='127.0.0.1', port=8000, workers=1, **options):
+    """
+    Runs the similarity service of the website in `workers` processes
+    listening on the same port.
+    :param options:
+        Keyword arguments of `SimilarityService`.
+    """
+    if workers == 1:
+        _run_worker(site, host, port, False, options)
+        return
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError(
+            'Several workers require SO_REUSEPORT, '
+            'which is not supported by the platform'
+        )
+
+    processes = [
+        multiprocessing.Process(
+            target=_run_worker, args=(site, host, port, True, options)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+@click.command('serve')
+@click.option(
+    '--site', '-s', type=str, required=True,
+    help='The domain name of the website to serve similarities of'
+)
+@click.option(
+    '--host', type=str, default='127.0.0.1', show_default=True,
+    help='The interface to listen on.'
+)
+@click.option(
+    '--port', type=int, default=8000, show_default=True,
+    help='The port to listen on.'
+)
+@click.option(
+    '--workers', type=int, default=1, show_default=True,
+    help='The number of worker processes sharing the port (SO_REUSEPORT).'
+)
+@click.option(
+    '--probe', type=int, default=8, show_default=True,
+    help='The number of index lists searched per query.'
+)
+@click.option(
+    '--cache-size', type=int, default=10000, show_default=True,
+    help='The number of cached query results per worker, 0 to disable.'
+)
+@click.option(
+    '--max-batch', type=int, default=64, show_default=True,
+    help='The maximum number of queries searched at once.'
+)
+@click.option(
+    '--max-wait', type=float, default=.001, show_default=True,
+    help='Seconds to wait for more queries to join a batch.'
+)
+def serve_cli(site, host, port, workers, probe, cache_size, max_batch,
+              max_wait):
+    """
+    Serve the similar products of the website over HTTP from the
+    similarity index (see `jsim index build`).
+    """
+    try:
+        serve(
+            site, host, port, workers, n_probe=probe, cache_size=cache_size,
+            max_batch=max_batch, max_wait=max_wait
+        )
+    except RuntimeError as e:
+        raise click.UsageError(str(e))
@@ -0,0 +1,52 @@
+"""
+The list fields must survive the csv feed and its conversion to the
+Parquet feed.
+"""
+import pyarrow.parquet as pq
+
+from src.data.scraping.exporters import (
+    JsonListCsvItemExporter, csv_to_parquet
+)
+from src.data.scraping.items import Jewel
+
+URLS = [
+    'https://cdn.example.com/img/w_400,h_400,c_fill/1.jpg',
+    'https://cdn.example.com/img/2.jpg',
+]
+
+
+def _export_csv(path, items, fields):
+    with open(path, 'wb') as f:
+        exporter = JsonListCsvItemExporter(f, fields_to_export=fields)
+        exporter.start_exporting()
+        for item in items:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+
+
+def test_list_values_with_commas(tmp_path):
+    csv_path, parquet_path = tmp_path / 'items.csv', tmp_path / 'items.pq'
+    _export_csv(csv_path, [
+        Jewel(sku='1', price=10.5, image_urls=URLS),
+        Jewel(sku='2', image_urls=[]),
+        Jewel(sku='3'),
+    ], ['sku', 'price', 'image_urls'])
+    csv_to_parquet(csv_path, parquet_path)
+
+    table = pq.read_table(parquet_path).to_pydict()
+    assert table['sku'] == ['1', '2', '3']
+    assert table['price'] == [10.5, None, None]
+    assert table['image_urls'] == [URLS, [], []]
+
+
+def test_comma_joined_lists(tmp_path):
+    # The feeds exported before the lists were JSON-encoded
+    csv_path, parquet_path = tmp_path / 'items.csv', tmp_path / 'items.pq'
+    csv_path.write_text(
+        'sku,image_urls\n1,"https://a/1.jpg,https://a/2.jpg"\n',
+        encoding='utf-8'
+    )
+    csv_to_parquet(csv_path, parquet_path)
+    assert pq.read_table(parquet_path).to_pydict()['image_urls'] == [
+        ['https://a/1.jpg', 'https://a/2.jpg']
+    ]
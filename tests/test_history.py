@@ -0,0 +1,119 @@
+"""
+Round trips of the catalog feeds through the history store: the
+states and prices restored from the recorded changes must match the
+feeds.
+"""
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.history import price_series, record_history, state_at
+
+SITE = 'example.com'
+FIELDS = ['sku', 'title', 'price', 'collection']
+
+
+def _moment(day, hour=12):
+    return datetime(2021, 6, day, hour, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def record(tmp_path, monkeypatch):
+    """Records the feed of the rows as the crawl of the day."""
+    # The history is stored in data/history/ of the working folder
+    monkeypatch.chdir(tmp_path)
+
+    def record(day, rows, columns=FIELDS, complete=True):
+        feed_path = tmp_path / f'items-{day}.csv'
+        pd.DataFrame(rows, columns=columns).to_csv(feed_path, index=False)
+        return record_history(SITE, feed_path, complete, _moment(day))
+    return record
+
+
+def _state(day):
+    state = state_at(SITE, _moment(day, 23))
+    return {
+        sku: {k: v for k, v in row.items() if v is not None}
+        for sku, row in state.to_dict('index').items()
+    }
+
+
+def test_complete_crawls(record):
+    assert record(1, [
+        ['a', 'Ring', '100', 'Spring'],
+        ['b', 'Chain', '200', ''],
+    ]) == 7  # 2 new items: 3 and 2 fields and the presence
+    assert record(2, [
+        ['a', 'Ring', '120', 'Spring'],
+        ['b', 'Chain', '200', ''],
+    ]) == 1
+    # Nothing changed
+    assert record(3, [
+        ['a', 'Ring', '120', 'Spring'],
+        ['b', 'Chain', '200', ''],
+    ]) == 0
+
+    assert _state(1) == {
+        'a': {'title': 'Ring', 'price': '100', 'collection': 'Spring'},
+        'b': {'title': 'Chain', 'price': '200'},
+    }
+    assert _state(3)['a']['price'] == '120'
+    # Before the first crawl
+    assert state_at(SITE, date(2021, 5, 31)).empty
+
+
+def test_partial_crawl_keeps_missing_items(record):
+    record(1, [['a', 'Ring', '100', ''], ['b', 'Chain', '200', '']])
+    record(2, [['a', 'Ring', '90', '']], complete=False)
+    assert _state(2) == {
+        'a': {'title': 'Ring', 'price': '90'},
+        'b': {'title': 'Chain', 'price': '200'},
+    }
+    # The complete crawl removes the missing item
+    record(3, [['a', 'Ring', '90', '']])
+    assert set(_state(3)) == {'a'}
+
+
+def test_reappearing_item(record):
+    record(1, [['a', 'Ring', '100', ''], ['b', 'Chain', '200', '']])
+    record(2, [['a', 'Ring', '100', '']])
+    record(3, [['a', 'Ring', '100', ''], ['b', 'Chain', '250', '']])
+    record(4, [['a', 'Ring', '100', ''], ['b', 'Chain', '260', '']])
+
+    assert set(_state(1)) == {'a', 'b'}
+    assert set(_state(2)) == {'a'}
+    assert _state(3)['b'] == {'title': 'Chain', 'price': '250'}
+
+    series = price_series(SITE, 'b')
+    assert list(series.index) == [
+        pd.Timestamp(_moment(day)) for day in (1, 2, 3, 4)
+    ]
+    assert np.array_equal(
+        series.to_numpy(), [200, np.nan, 250, 260], equal_nan=True
+    )
+    # Only the crawls within the bounds
+    series = price_series(SITE, 'b', since=date(2021, 6, 3))
+    assert list(series) == [250, 260]
+    # The item without price changes has a single price
+    assert list(price_series(SITE, 'a')) == [100]
+
+
+def test_dropped_and_new_columns(record):
+    record(1, [['a', 'Ring', '100', 'Spring']])
+    # The collection column is dropped from the feed, the brand one
+    # is added
+    record(2, [['a', 'Ring', '100', 'Sokolov']],
+           columns=['sku', 'title', 'price', 'brand'])
+    assert _state(1)['a'] == {
+        'title': 'Ring', 'price': '100', 'collection': 'Spring'
+    }
+    assert _state(2)['a'] == {
+        'title': 'Ring', 'price': '100', 'brand': 'Sokolov'
+    }
+    # The column is back
+    record(3, [['a', 'Ring', '100', 'Summer']])
+    assert _state(3)['a'] == {
+        'title': 'Ring', 'price': '100', 'collection': 'Summer'
+    }
@@ -0,0 +1,107 @@
+"""
+The band lookup of `HammingIndex` must find exactly the hashes found
+by the brute force comparison.
+"""
+import numpy as np
+import pytest
+
+from src.features.image_hashes import HammingIndex
+
+TOP_BIT = 1 << 63
+
+
+def _random_hashes(rng, size):
+    return rng.integers(0, 2 ** 64, size, dtype=np.uint64, endpoint=False)
+
+
+def _near_duplicates(rng, hashes, size, max_flips):
+    """Flips a few random bits of randomly chosen hashes."""
+    result = []
+    for value in rng.choice(hashes, size):
+        value = int(value)
+        flips = rng.integers(0, min(max_flips, 64) + 1)
+        for bit in rng.choice(64, flips, replace=False):
+            value ^= 1 << int(bit)
+        result.append(value)
+    return np.array(result, dtype=np.uint64)
+
+
+def _brute_force(hashes, value, max_distance):
+    bits = np.unpackbits(
+        np.bitwise_xor(hashes, np.uint64(value)).view(np.uint8)
+    ).reshape(len(hashes), 64)
+    distances = bits.sum(axis=1)
+    rows = np.flatnonzero(distances <= max_distance)
+    return rows, distances[rows]
+
+
+def _assert_same(index, queries):
+    for value in queries:
+        rows, distances = index.query(int(value))
+        expected_rows, expected_distances = _brute_force(
+            index.hashes, value, index.max_distance
+        )
+        order = np.argsort(rows)
+        assert np.array_equal(rows[order], expected_rows)
+        assert np.array_equal(distances[order], expected_distances)
+        # The neighbours are in the order of distance
+        assert np.all(np.diff(distances.astype(np.int64)) >= 0)
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 4, 10, 63])
+def test_query_matches_brute_force(max_distance):
+    rng = np.random.default_rng(max_distance)
+    hashes = _random_hashes(rng, 20000)
+    hashes = np.concatenate([
+        hashes, _near_duplicates(rng, hashes, 2000, max_distance + 2)
+    ])
+    index = HammingIndex(hashes, max_distance)
+    queries = np.concatenate([
+        rng.choice(hashes, 30),
+        _near_duplicates(rng, hashes, 30, max_distance + 1),
+        _random_hashes(rng, 10),
+    ])
+    _assert_same(index, queries)
+
+
+def test_max_distance_63_finds_all_but_complement():
+    rng = np.random.default_rng(0)
+    hashes = _random_hashes(rng, 1000)
+    value = int(hashes[0])
+    hashes = np.append(hashes, np.uint64(value ^ (2 ** 64 - 1)))
+    rows, _ = HammingIndex(hashes, 63).query(value)
+    assert sorted(rows) == list(range(1000))
+
+
+def test_top_bit():
+    rng = np.random.default_rng(1)
+    hashes = _random_hashes(rng, 5000) | np.uint64(TOP_BIT)
+    hashes[:10] = np.arange(10, dtype=np.uint64)
+    for max_distance in (0, 3):
+        index = HammingIndex(hashes, max_distance)
+        _assert_same(index, [
+            TOP_BIT, TOP_BIT | 1, 2 ** 64 - 1, int(hashes[20]), 0, 7
+        ])
+    rows, distances = HammingIndex(hashes, 1).query(int(hashes[20]) ^ 1)
+    assert 20 in rows
+    assert distances[list(rows).index(20)] == 1
+
+
+def test_empty_index():
+    index = HammingIndex(np.zeros(0, dtype=np.uint64), 5)
+    rows, distances = index.query(TOP_BIT | 12345)
+    assert len(rows) == 0
+    assert len(distances) == 0
+
+
+def test_duplicates():
+    hashes = np.array([TOP_BIT, TOP_BIT, 5, TOP_BIT | 1], dtype=np.uint64)
+    rows, distances = HammingIndex(hashes, 0).query(TOP_BIT)
+    assert sorted(rows) == [0, 1]
+    assert list(distances) == [0, 0]
+
+
+@pytest.mark.parametrize('max_distance', [-1, 64])
+def test_invalid_distance(max_distance):
+    with pytest.raises(ValueError):
+        HammingIndex(np.zeros(1, dtype=np.uint64), max_distance)
@@ -0,0 +1,80 @@
+"""
+The items of the product pages delisted from the sitemaps must be found
+by the crawl state and removed from the feeds.
+"""
+import csv
+import sqlite3
+
+from src.data.scraping.feeds import remove_csv_rows
+from src.data.scraping.incremental import CrawlState
+
+BEFORE = '2021-06-01T00:00:00+00:00'
+SINCE = '2021-06-02T00:00:00+00:00'
+AFTER = '2021-06-02T00:00:01+00:00'
+
+
+def _set_seen(state, url, last_seen):
+    state.execute(
+        'UPDATE pages SET last_seen = ? WHERE url = ?', (last_seen, url)
+    )
+
+
+def test_unseen_skus(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        for url, sku, last_seen in [
+            ('/1', 'a', AFTER),
+            ('/2', 'b', BEFORE),
+            ('/3', None, BEFORE),
+            # The page of the item has moved
+            ('/4', 'c', BEFORE),
+            ('/5', 'c', AFTER),
+        ]:
+            state.update(url, '2021-01-01', 'hash', sku)
+            _set_seen(state, url, last_seen)
+        # The SKU isn't lost when the content is unchanged
+        state.update('/1', content_hash='hash')
+
+        assert state.count_seen(SINCE) == 2
+        assert state.get_unseen_skus(SINCE) == {'b'}
+        assert state.remove_unseen(SINCE) == 3
+        assert state.get('/2') is None
+        assert state.get_unseen_skus(SINCE) == set()
+        assert state.execute(
+            "SELECT sku FROM pages WHERE url = '/1'"
+        ).fetchone() == ('a',)
+
+
+def test_state_without_skus(tmp_path):
+    path = tmp_path / 'state.sqlite'
+    connection = sqlite3.connect(str(path))
+    connection.execute(
+        'CREATE TABLE pages (url TEXT PRIMARY KEY, lastmod TEXT, '
+        'content_hash TEXT, last_seen TEXT)'
+    )
+    connection.execute(
+        "INSERT INTO pages VALUES ('/1', '2021-01-01', 'hash', ?)", (BEFORE,)
+    )
+    connection.commit()
+    connection.close()
+
+    with CrawlState(path) as state:
+        assert state.get('/1') == ('2021-01-01', 'hash')
+        assert state.get_unseen_skus(SINCE) == set()
+        state.update('/1', sku='a')
+        _set_seen(state, '/1', BEFORE)
+        assert state.get_unseen_skus(SINCE) == {'a'}
+
+
+def test_remove_csv_rows(tmp_path):
+    path = tmp_path / 'items.csv'
+    path.write_text(
+        'sku,title\na,Ring\nb,"Chain,\nlong"\nb,Chain\nc,Pendant\n',
+        encoding='utf-8'
+    )
+    assert remove_csv_rows(path, {'b', 'x'}) == 2
+    with path.open(newline='', encoding='utf-8') as f:
+        assert list(csv.DictReader(f)) == [
+            {'sku': 'a', 'title': 'Ring'}, {'sku': 'c', 'title': 'Pendant'}
+        ]
+    assert remove_csv_rows(path, set()) == 0
+    assert remove_csv_rows(tmp_path / 'missing.csv', {'a'}) == 0
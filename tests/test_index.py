@@ -0,0 +1,66 @@
+"""
+The filtered search of `IVFIndex` must return k results whenever the
+brute-force search finds them, widening the probed lists as needed.
+"""
+import numpy as np
+
+from src.features.embeddings import normalize_rows
+from src.models.index import IVFIndex, brute_force_search, evaluate_recall
+
+
+def _data(rng, rows=3000, dimension=16, rare=20):
+    vectors = normalize_rows(
+        rng.standard_normal((rows, dimension)).astype(np.float32)
+    )
+    filters = np.stack([
+        rng.integers(0, 3, rows), np.zeros(rows, dtype=np.int64)
+    ], axis=1)
+    # A rare value, which the few closest lists usually lack
+    filters[rng.choice(rows, rare, replace=False), 1] = 1
+    return vectors, filters
+
+
+def test_filtered_search_finds_k_results():
+    rng = np.random.default_rng(0)
+    vectors, filters = _data(rng)
+    index = IVFIndex.build(vectors, filters, n_lists=50)
+    queries = vectors[:40]
+    filter_codes = np.tile([-1, 1], (len(queries), 1))
+    exclude = np.arange(len(queries))
+
+    rows, scores = index.search(
+        queries, 10, 2, filter_codes, exclude=exclude
+    )
+    assert (rows >= 0).all()
+    assert (filters[rows, 1] == 1).all()
+    assert (rows != exclude[:, None]).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+    # Without widening only the items of the probed lists are found
+    narrow, _ = index.search(
+        queries, 10, 2, filter_codes, exclude=exclude, widen=False
+    )
+    assert (narrow < 0).any()
+
+
+def test_fewer_matches_than_k():
+    rng = np.random.default_rng(1)
+    vectors, filters = _data(rng, rare=5)
+    index = IVFIndex.build(vectors, filters, n_lists=40)
+    rows, _ = index.search(vectors[:3], 10, 1, np.tile([-1, 1], (3, 1)))
+    exact, _ = brute_force_search(
+        vectors, vectors[:3], 10, None, filters, np.tile([-1, 1], (3, 1))
+    )
+    assert (np.sort(rows, axis=1) == np.sort(exact, axis=1)).all()
+    assert ((rows >= 0).sum(axis=1) == 5).all()
+
+
+def test_filtered_recall():
+    rng = np.random.default_rng(2)
+    vectors, filters = _data(rng)
+    index = IVFIndex.build(vectors, filters, n_lists=50)
+    recall = evaluate_recall(
+        index, vectors, n_probe=50, sample=100, filters=filters
+    )
+    # All the lists are probed
+    assert recall['recall'] == 1
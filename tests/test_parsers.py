@@ -0,0 +1,125 @@
+"""
+The spec-based sokolov.ru parser must produce the same items as the
+loader-based one (see `SokolovRuFastJewelParser`).
+"""
+import pytest
+from scrapy.http import HtmlResponse
+
+from src.data.scraping.mock_site import MockCatalog
+from src.data.scraping.parsers.sokolov_ru import (
+    SokolovRuFastJewelParser, SokolovRuJewelParser
+)
+
+BASE_URL = 'http://127.0.0.1'
+CATALOG = MockCatalog(60, images=1, image_size=8, page_padding=0)
+PROP = (
+    '<div class="props-list"><div class="name"><span>{}</span></div>'
+    '<div class="val"><span>{}</span></div></div>'
+)
+
+
+def _response(html):
+    return HtmlResponse(
+        url=f'{BASE_URL}/jewelry-catalog/product/0/', body=html.encode(),
+        encoding='utf-8'
+    )
+
+
+def _page(number=0):
+    return CATALOG.render_product(BASE_URL, number)
+
+
+def _replace(html, pattern, replacement):
+    assert pattern in html
+    return html.replace(pattern, replacement)
+
+
+def _with_props(html, *props):
+    return _replace(
+        html, '</div></body>',
+        ''.join(PROP.format(name, value) for name, value in props)
+        + '</div></body>'
+    )
+
+
+def _gem_page():
+    # The first page of the catalog with gem inserts
+    for number in range(CATALOG.products):
+        html = _page(number)
+        if 'props-insert__item' in html:
+            return html
+    raise AssertionError('No page with inserts')
+
+
+EDGE_PAGES = {
+    'no_price': lambda: _replace(
+        _page(), '<meta itemprop="price"', '<meta itemprop="cost"'
+    ),
+    'empty_title': lambda: _replace(
+        _page(), 'data-detail-name="', 'data-detail-name="" data-x="'
+    ),
+    'no_category': lambda: _replace(
+        _page(), 'data-detail-category=', 'data-category='
+    ),
+    'flat_category': lambda: _replace(
+        _page(), 'data-detail-category="Украшения/', 'data-detail-category="'
+    ),
+    'no_description': lambda: _replace(
+        _page(), '<p>Об украшении</p>', '<p>Доставка</p>'
+    ),
+    'no_image': lambda: _replace(_page(), 'data-src=', 'data-lazy='),
+    'empty_width': lambda: _replace(
+        _page(), '<span>Ширина</span>', '<span>Ширина старая</span>'
+    ).replace('</div></body>', PROP.format('Ширина', '') + '</div></body>'),
+    'length': lambda: _with_props(_page(), ('Длина', '42.5 мм')),
+    'unknown_props': lambda: _with_props(
+        _page(), ('Покрытие', 'Родирование'), ('', '')
+    ),
+    'insert_without_weight': lambda: _replace(
+        _gem_page(), '<div class="name">Вес</div>',
+        '<div class="name">Размер</div>'
+    ),
+    'no_product': lambda: '<html><body><p>Not found</p></body></html>',
+}
+
+
+def _parse_both(html):
+    response = _response(html)
+    return (
+        dict(SokolovRuJewelParser(response).parse()),
+        dict(SokolovRuFastJewelParser(response).parse()),
+    )
+
+
+@pytest.mark.parametrize('number', range(CATALOG.products))
+def test_catalog_pages(number):
+    expected, actual = _parse_both(_page(number))
+    assert actual == expected
+
+
+@pytest.mark.parametrize('name', sorted(EDGE_PAGES))
+def test_edge_pages(name):
+    expected, actual = _parse_both(EDGE_PAGES[name]())
+    assert actual == expected
+
+
+@pytest.mark.parametrize('pattern', [
+    '<meta itemprop="price" content="',
+    '<span>Примерный вес</span></div><div class="val"><span>',
+])
+def test_invalid_number_fails_both(pattern):
+    # The value isn't a number, both parsers fail the page
+    response = _response(_replace(_page(), pattern, pattern + 'n/a '))
+    for parser_cls in (SokolovRuJewelParser, SokolovRuFastJewelParser):
+        with pytest.raises(ValueError):
+            parser_cls(response).parse()
+
+
+def test_empty_price_fails_both():
+    response = _response(_replace(
+        _page(), '<meta itemprop="price" content="',
+        '<meta itemprop="price" content="" data-price="'
+    ))
+    for parser_cls in (SokolovRuJewelParser, SokolovRuFastJewelParser):
+        with pytest.raises(ValueError):
+            parser_cls(response).parse()